@@ -73,6 +73,8 @@ class AutoTagEvent:
                         handler.auto_tag(event)
                 except Exception as e:
                     get_logger().debug(
-                        f"Error while trying to auto tag with handler {handler.__class__.__name__} event {event}",
+                        "Error while trying to auto tag with handler %s event %s",
+                        handler.__class__.__name__,
+                        event,
                         exc_info=e,
                     )
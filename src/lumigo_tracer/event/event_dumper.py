@@ -272,7 +272,9 @@ class EventDumper:
                     )
             except Exception as e:
                 get_logger().debug(
-                    f"Error while trying to parse with handler {handler.__class__.__name__} event {event}",
+                    "Error while trying to parse with handler %s event %s",
+                    handler.__class__.__name__,
+                    event,
                     exc_info=e,
                 )
         return lumigo_dumps(event, max_size)
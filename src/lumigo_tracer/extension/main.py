@@ -34,12 +34,12 @@ def register():
 def start_extension_loop(lambda_service: LambdaService):
     with lumigo_safe_execute("Extension main initialization"):
         get_extension_logger().debug(
-            f"Extension started running with extension id: {lambda_service.extension_id}"
+            "Extension started running with extension id: %s", lambda_service.extension_id
         )
         config()
         extension = LumigoExtension(lambda_service)
     for event in lambda_service.events_generator():
-        get_extension_logger().debug(f"Extension got event: {event}")
+        get_extension_logger().debug("Extension got event: %s", event)
         if event.get("eventType") == "INVOKE":
             with lumigo_safe_execute("Extension: start new invocation"):
                 extension.start_new_invocation(event)
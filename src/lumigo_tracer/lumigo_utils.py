@@ -2,6 +2,7 @@ import datetime
 import decimal
 import base64
 import hashlib
+import math
 import json
 import logging
 import os
@@ -11,11 +12,19 @@ from functools import reduce, lru_cache
 import time
 import http.client
 import socket
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import random
-from typing import Union, List, Optional, Dict, Any, Tuple, Pattern, TypeVar
+import queue
+import threading
+import concurrent.futures
+import zlib
+from typing import Union, List, Optional, Dict, Any, Tuple, Pattern, TypeVar, Deque, Callable
 from contextlib import contextmanager
-from base64 import b64encode
+from json.encoder import encode_basestring_ascii  # type: ignore
+from json.decoder import scanstring  # type: ignore
+from json.scanner import NUMBER_RE  # type: ignore
+import codecs
+import weakref
 import inspect
 import traceback
 from pathlib import Path
@@ -34,9 +43,24 @@ EDGE_SUFFIX = "golumigo.com"
 EDGE_HOST = "{region}.lumigo-tracer-edge." + EDGE_SUFFIX
 EDGE_PATH = "/api/spans"
 HTTPS_PREFIX = "https://"
+HTTP_PREFIX = "http://"
 LOG_FORMAT = "#LUMIGO# - %(levelname)s - %(asctime)s - %(message)s"
 SECONDS_TO_TIMEOUT = 0.5
 COOLDOWN_AFTER_TIMEOUT_DURATION = datetime.timedelta(seconds=10)
+INITIAL_COOLDOWN_AFTER_TIMEOUT_DURATION = datetime.timedelta(seconds=1)
+EDGE_RTT_WINDOW_SIZE = 50
+EDGE_RTT_MIN_SAMPLES = 5
+# The socket timeout is the observed p99 of the edge RTT, multiplied by this factor
+EDGE_TIMEOUT_P99_FACTOR = 3
+# The RTTs are measured mostly on small requests, so bigger bodies get the full EDGE_TIMEOUT
+EDGE_RTT_TIMEOUT_MAX_BODY_SIZE = 32 * 1024
+# The weight of the last flush in the moving average of the flushes' durations
+FLUSH_DURATION_EWMA_ALPHA = 0.2
+# The timeout buffer is this factor of the average flush duration, in the bounds of MIN/MAX_TIMEOUT_BUFFER (seconds)
+TIMEOUT_BUFFER_FLUSH_FACTOR = 3
+MIN_TIMEOUT_BUFFER = 0.5
+MAX_TIMEOUT_BUFFER = 3
+MIN_EDGE_TIMEOUT = 0.1
 LUMIGO_EVENT_KEY = "_lumigo"
 STEP_FUNCTION_UID_KEY = "step_function_uid"
 # number of spans that are too big to enter the reported message before break
@@ -65,6 +89,10 @@ DOMAIN_SCRUBBER_REGEXES = [
     r"sts\..*amazonaws\.com",
 ]
 SKIP_SCRUBBING_KEYS = [EXECUTION_TAGS_KEY]
+MASKED_KEYS_CACHE_SIZE = 4096
+INVOCATION_MAPPING_MAX_SIZE = 1000
+# Big bodies are dumped by scanning only their beginning, up to this factor of the max size
+PREFIX_WINDOW_FACTOR = 16
 LUMIGO_SECRET_MASKING_REGEX_BACKWARD_COMP = "LUMIGO_BLACKLIST_REGEX"
 LUMIGO_SECRET_MASKING_REGEX = "LUMIGO_SECRET_MASKING_REGEX"
 LUMIGO_SYNC_TRACING = "LUMIGO_SYNC_TRACING"
@@ -83,15 +111,49 @@ EDGE_KINESIS_STREAM_NAME = "prod_trc-inges-edge_edge-kinesis-stream"
 STACKTRACE_LINE_TO_DROP = "lumigo_tracer/tracer.py"
 Container = TypeVar("Container", dict, list)
 DEFAULT_AUTO_TAG_KEY = "LUMIGO_AUTO_TAG"
+LUMIGO_ASYNC_REPORTING = "LUMIGO_ASYNC_REPORTING"
+ASYNC_REPORTING_QUEUE_SIZE = 100
+LUMIGO_EDGE_COMPRESSION = "LUMIGO_EDGE_COMPRESSION"
+SUPPORTED_EDGE_COMPRESSIONS = ("gzip", "deflate")
+# upper bound for the gzip/zlib header, trailer and the flush markers
+COMPRESSION_OVERHEAD = 64
+LUMIGO_SPILL_TO_DISK = "LUMIGO_SPILL_TO_DISK"
+LUMIGO_SPILL_DIR = "/tmp/lumigo-spill"
+SPILL_SUFFIX = ".spill"
+DEFAULT_SPILL_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_SPILL_DRAIN_BUDGET = 0.2
+LUMIGO_CHUNKED_REPORTING = "LUMIGO_CHUNKED_REPORTING"
+LUMIGO_COMPACT_ENVELOPE = "LUMIGO_COMPACT_ENVELOPE"
+DEFAULT_REPORTING_TIME_BUDGET = 1.0
+LUMIGO_SPAN_AGGREGATION_THRESHOLD = "LUMIGO_SPAN_AGGREGATION_THRESHOLD"
+DEFAULT_SPAN_AGGREGATION_KEEP_SLOWEST = 5
+DEFAULT_TAIL_SAMPLING_PERCENTILE = 90.0
+LUMIGO_TIMEOUT_MECHANISM = "LUMIGO_TIMEOUT_MECHANISM"
+LUMIGO_BOTOCORE_INSTRUMENTATION = "LUMIGO_BOTOCORE_INSTRUMENTATION"
+TIMEOUT_MECHANISM_THREAD = "thread"
+TIMEOUT_MECHANISM_SIGNAL = "signal"
+DEFAULT_ASYNC_REPORTING_FLUSH_TIMEOUT = EDGE_TIMEOUT * 2
 
 _logger: Dict[str, logging.Logger] = {}
 
 edge_kinesis_boto_client = None
 edge_connection = None
+edge_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_edge_pool_local = threading.local()
 
 
 def should_use_tracer_extension() -> bool:
-    return (os.environ.get(LUMIGO_USE_TRACER_EXTENSION) or "false").lower() == "true"
+    return Configuration.use_tracer_extension
+
+
+def should_post_to_edge() -> bool:
+    """
+    :return: Whether `report_json` posts the spans to the edge now,
+        and doesn't skip them or write them to the extension's files.
+    """
+    if not Configuration.should_report or should_use_tracer_extension():
+        return False
+    return InternalState.should_report_to_edge()
 
 
 def get_extension_dir() -> str:
@@ -103,24 +165,163 @@ def get_region() -> str:
 
 
 class InternalState:
+    """
+    This class holds the state of the tracer that is shared between invocations.
+
+    The connection to the edge is managed as a circuit breaker:
+    * closed - we report as usual.
+    * open - after a timeout, we skip reporting until the cooldown is over.
+        The cooldown starts short, and doubles on consecutive timeouts (up to `COOLDOWN_AFTER_TIMEOUT_DURATION`).
+    * half-open - after the cooldown, the next report is a probe. Success closes the circuit.
+
+    The socket timeout is derived from the recent RTTs to the edge (for small bodies),
+        and capped by the invocation's remaining time.
+    """
+
     timeout_on_connection: Optional[datetime.datetime] = None
+    consecutive_timeouts: int = 0
+    edge_rtts: Deque[float] = deque(maxlen=EDGE_RTT_WINDOW_SIZE)
+    invocation_deadline: Optional[float] = None
     internal_error_already_logged = False
+    flush_duration: Optional[float] = None
 
     @staticmethod
     def reset():
         InternalState.timeout_on_connection = None
+        InternalState.consecutive_timeouts = 0
+        InternalState.edge_rtts.clear()
+        InternalState.invocation_deadline = None
         InternalState.internal_error_already_logged = False
+        InternalState.flush_duration = None
+
+    @staticmethod
+    def mark_flush_duration(duration: float):
+        """
+        :param duration: The duration (in seconds) of posting the spans to the edge at the end of the invocation.
+            We keep an exponential moving average of it.
+        """
+        previous = InternalState.flush_duration
+        if previous is None:
+            InternalState.flush_duration = duration
+        else:
+            alpha = FLUSH_DURATION_EWMA_ALPHA
+            InternalState.flush_duration = alpha * duration + (1 - alpha) * previous
 
     @staticmethod
     def mark_timeout_to_edge():
         InternalState.timeout_on_connection = datetime.datetime.now()
+        InternalState.consecutive_timeouts += 1
+
+    @staticmethod
+    def mark_edge_success(rtt: float):
+        """
+        :param rtt: The duration (in seconds) of the successful request.
+        """
+        InternalState.timeout_on_connection = None
+        InternalState.consecutive_timeouts = 0
+        InternalState.edge_rtts.append(rtt)
+
+    @staticmethod
+    def get_cooldown() -> datetime.timedelta:
+        exponent = max(InternalState.consecutive_timeouts - 1, 0)
+        return min(
+            INITIAL_COOLDOWN_AFTER_TIMEOUT_DURATION * (2 ** exponent),
+            COOLDOWN_AFTER_TIMEOUT_DURATION,
+        )
 
     @staticmethod
     def should_report_to_edge() -> bool:
         if not InternalState.timeout_on_connection:
             return True
         time_diff = datetime.datetime.now() - InternalState.timeout_on_connection
-        return time_diff > COOLDOWN_AFTER_TIMEOUT_DURATION
+        return time_diff > InternalState.get_cooldown()
+
+    @staticmethod
+    def get_edge_timeout(body_size: int = 0) -> float:
+        """
+        :param body_size: The size (in bytes) of the body that we are going to send.
+        :return: The socket timeout (in seconds) for the next request to the edge.
+        """
+        timeout = EDGE_TIMEOUT
+        rtts = InternalState.edge_rtts
+        if len(rtts) >= EDGE_RTT_MIN_SAMPLES and body_size <= EDGE_RTT_TIMEOUT_MAX_BODY_SIZE:
+            p99 = sorted(rtts)[math.ceil(len(rtts) * 0.99) - 1]
+            timeout = min(EDGE_TIMEOUT, max(MIN_EDGE_TIMEOUT, p99 * EDGE_TIMEOUT_P99_FACTOR))
+        if InternalState.invocation_deadline:
+            remaining_time = InternalState.invocation_deadline - time.time()
+            timeout = min(timeout, max(remaining_time, MIN_EDGE_TIMEOUT))
+        return timeout
+
+
+class BackgroundReporter:
+    """
+    This class sends the already serialized payloads to the edge from a daemon thread,
+        so the reporting doesn't block the user's handler.
+    The queue is bounded - if it is full, the payload is dropped (and a span is lost).
+    """
+
+    _queue: Optional["queue.Queue"] = None
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enqueue(region: Optional[str], to_send: bytes) -> bool:
+        sender_queue = BackgroundReporter._get_queue()
+        try:
+            sender_queue.put_nowait((region, to_send))
+            return True
+        except queue.Full:
+            get_logger().warning("The background reporter queue is full. A span was lost.")
+            internal_analytics_message("report: background queue is full")
+            return False
+
+    @staticmethod
+    def flush(timeout: Optional[float] = None) -> bool:
+        """
+        Block until all the enqueued payloads were sent, or until the timeout (in seconds) passed.
+
+        :return: True if the queue was drained, False if we gave up due to the timeout.
+        """
+        sender_queue = BackgroundReporter._queue
+        if not sender_queue:
+            return True
+        if timeout is None:
+            timeout = Configuration.async_reporting_flush_timeout
+        deadline = time.monotonic() + timeout
+        with sender_queue.all_tasks_done:
+            while sender_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    get_logger().warning("Timeout while flushing the background reporter")
+                    return False
+                sender_queue.all_tasks_done.wait(remaining)
+        return True
+
+    @staticmethod
+    def _get_queue() -> "queue.Queue":
+        with BackgroundReporter._lock:
+            if not BackgroundReporter._thread or not BackgroundReporter._thread.is_alive():
+                BackgroundReporter._queue = BackgroundReporter._queue or queue.Queue(
+                    maxsize=ASYNC_REPORTING_QUEUE_SIZE
+                )
+                BackgroundReporter._thread = threading.Thread(
+                    target=BackgroundReporter._sender_loop,
+                    args=(BackgroundReporter._queue,),
+                    name="lumigo-reporter",
+                    daemon=True,
+                )
+                BackgroundReporter._thread.start()
+            return BackgroundReporter._queue  # type: ignore
+
+    @staticmethod
+    def _sender_loop(sender_queue: "queue.Queue") -> None:
+        while True:
+            region, to_send = sender_queue.get()
+            try:
+                with lumigo_safe_execute("background reporter: send"):
+                    _send_to_edge(region, to_send, drain_spill=True)
+            finally:
+                sender_queue.task_done()
 
 
 class Configuration:
@@ -141,6 +342,27 @@ class Configuration:
     should_scrub_known_services: bool = False
     is_sync_tracer: bool = False
     auto_tag: List[str] = []
+    async_reporting: bool = False
+    async_reporting_flush_timeout: float = DEFAULT_ASYNC_REPORTING_FLUSH_TIMEOUT
+    edge_compression: Optional[str] = None
+    spill_to_disk: bool = False
+    spill_dir: str = LUMIGO_SPILL_DIR
+    spill_max_bytes: int = DEFAULT_SPILL_MAX_BYTES
+    spill_drain_budget: float = DEFAULT_SPILL_DRAIN_BUDGET
+    chunked_reporting: bool = False
+    edge_connections: int = 1
+    reporting_time_budget: float = DEFAULT_REPORTING_TIME_BUDGET
+    compact_envelope: bool = False
+    use_tracer_extension: bool = False
+    prune_trace: bool = True
+    client_warnings: bool = True
+    span_aggregation_threshold: int = 0
+    span_aggregation_keep_slowest: int = DEFAULT_SPAN_AGGREGATION_KEEP_SLOWEST
+    tail_sampling_rate: Optional[float] = None
+    tail_sampling_percentile: float = DEFAULT_TAIL_SAMPLING_PERCENTILE
+    sampling_rate: float = 1.0
+    timeout_mechanism: str = TIMEOUT_MECHANISM_THREAD
+    botocore_instrumentation: bool = False
 
     @staticmethod
     def get_max_entry_size(has_error: bool = False) -> int:
@@ -165,9 +387,26 @@ def config(
     edge_kinesis_aws_access_key_id: Optional[str] = None,
     edge_kinesis_aws_secret_access_key: Optional[str] = None,
     auto_tag: Optional[List[str]] = None,
+    async_reporting: bool = False,
+    async_reporting_flush_timeout: Optional[float] = None,
+    edge_compression: Optional[str] = None,
+    spill_to_disk: bool = False,
+    chunked_reporting: bool = False,
+    edge_connections: Optional[int] = None,
+    reporting_time_budget: Optional[float] = None,
+    compact_envelope: bool = False,
+    span_aggregation_threshold: Optional[int] = None,
+    span_aggregation_keep_slowest: Optional[int] = None,
+    tail_sampling_rate: Optional[float] = None,
+    tail_sampling_percentile: Optional[float] = None,
+    sampling_rate: Optional[float] = None,
+    timeout_mechanism: Optional[str] = None,
+    botocore_instrumentation: bool = False,
 ) -> None:
     """
     This function configure the lumigo wrapper.
+    The environment variables are read only here, the rest of the tracer reads `Configuration`.
+    Call this function again to apply changes in the environment.
 
     :param verbose: Whether the tracer should send all the possible information (debug mode)
     :param edge_host: The host to send the events. Leave empty for default.
@@ -177,7 +416,8 @@ def config(
     :param step_function: Is this function is a part of a step function?
     :param timeout_timer: Should we start a timer to send the traced data before timeout acceded.
     :param timeout_timer_buffer: The buffer (seconds) that we take before reaching timeout to send the traces to lumigo.
-        The default is 10% of the duration of the lambda (with upper and lower bounds of 0.5 and 3 seconds).
+        The default is 3 times the average duration of the previous flushes (between 0.5 and 3 seconds),
+        or 10% of the duration of the lambda before we measure it (between 0.5 and 3 seconds).
     :param domains_scrubber: List of regexes. We will not collect data of requests with hosts that match it.
     :param max_entry_size: The maximum size of each entry when sending back the events.
     :param get_key_depth: Max depth to search the lumigo key in the event (relevant to step functions). default 4.
@@ -185,8 +425,30 @@ def config(
     :param edge_kinesis_aws_access_key_id: The credentials to push to the Kinesis in China region
     :param edge_kinesis_aws_secret_access_key: The credentials to push to the Kinesis in China region
     :param auto_tag: The keys from the event that should be used as execution tags.
+    :param async_reporting: Should we send the spans from a background thread instead of blocking the handler.
+    :param async_reporting_flush_timeout: The max time (seconds) to wait for the background thread at the end of the
+        invocation. Default: twice the edge timeout.
+    :param edge_compression: Compress the spans before sending them ("gzip" or "deflate"). Default: no compression.
+    :param spill_to_disk: Should we keep the spans that we failed to send on the disk, and retry in the next invocation.
+    :param chunked_reporting: Should we split big traces to several requests instead of dropping spans.
+    :param edge_connections: The number of parallel connections to use when sending several requests. Default 1.
+    :param reporting_time_budget: The total time (seconds) to spend on sending several requests. Default 1.
+    :param compact_envelope: Should we send the fields that are shared by all the spans only once per request.
+    :param span_aggregation_threshold: After this number of similar successful spans, the rest are sent as a single
+        aggregated span. Default 0 (no aggregation).
+    :param span_aggregation_keep_slowest: The number of the slowest aggregated spans that are still sent. Default 5.
+    :param tail_sampling_rate: The fraction of the fast successful invocations that we send their full trace.
+        The rest are sent as a summary. Default: send all the invocations.
+    :param tail_sampling_percentile: The invocations above this percentile of the recent durations are always sent.
+        Default 90.
+    :param sampling_rate: The fraction of the transactions that we trace. The decision is a hash of the transaction id,
+        so all the functions of a transaction agree. Only the timing of the other invocations is sent. Default 1.
+    :param timeout_mechanism: How we wait for the timeout timer: "thread" (a watchdog thread) or "signal" (SIGALRM).
+        Default "thread".
+    :param botocore_instrumentation: Should we take the fields of the AWS calls' spans from botocore's parameters
+        and parsed responses, instead of parsing the http bodies. Default: parse the http bodies.
     """
-
+    Configuration.client_warnings = os.environ.get("LUMIGO_WARNINGS") != "off"
     Configuration.token = token or os.environ.get(LUMIGO_TOKEN_KEY, "")
     if not (Configuration.token and re.match("[t][_][a-z0-9]{15,100}", Configuration.token)):
         if token is not None:
@@ -246,9 +508,111 @@ def config(
         os.environ.get("LUMIGO_SCRUB_KNOWN_SERVICES") == "true"
     )
     Configuration.is_sync_tracer = os.environ.get(LUMIGO_SYNC_TRACING, "FALSE").lower() == "true"
+    get_omitting_regex.cache_clear()  # The masking regex may have changed
     Configuration.auto_tag = auto_tag or os.environ.get(
         "LUMIGO_AUTO_TAG", DEFAULT_AUTO_TAG_KEY
     ).split(",")
+    Configuration.async_reporting = (
+        async_reporting or os.environ.get(LUMIGO_ASYNC_REPORTING, "").lower() == "true"
+    )
+    try:
+        Configuration.async_reporting_flush_timeout = async_reporting_flush_timeout or float(
+            os.environ.get(
+                "LUMIGO_ASYNC_REPORTING_FLUSH_TIMEOUT", DEFAULT_ASYNC_REPORTING_FLUSH_TIMEOUT
+            )
+        )
+    except Exception:
+        warn_client(
+            "Could not configure LUMIGO_ASYNC_REPORTING_FLUSH_TIMEOUT. Using default value."
+        )
+        Configuration.async_reporting_flush_timeout = DEFAULT_ASYNC_REPORTING_FLUSH_TIMEOUT
+    edge_compression = (
+        edge_compression or os.environ.get(LUMIGO_EDGE_COMPRESSION, "")
+    ).lower() or None
+    if edge_compression and edge_compression not in SUPPORTED_EDGE_COMPRESSIONS:
+        warn_client(f"Unsupported edge compression: {edge_compression}. Sending uncompressed.")
+        edge_compression = None
+    Configuration.edge_compression = edge_compression
+    Configuration.spill_to_disk = (
+        spill_to_disk or os.environ.get(LUMIGO_SPILL_TO_DISK, "").lower() == "true"
+    )
+    Configuration.spill_dir = os.environ.get("LUMIGO_SPILL_DIR", LUMIGO_SPILL_DIR)
+    try:
+        Configuration.spill_max_bytes = int(
+            os.environ.get("LUMIGO_SPILL_MAX_BYTES", DEFAULT_SPILL_MAX_BYTES)
+        )
+        Configuration.spill_drain_budget = float(
+            os.environ.get("LUMIGO_SPILL_DRAIN_BUDGET", DEFAULT_SPILL_DRAIN_BUDGET)
+        )
+    except Exception:
+        warn_client("Could not configure the spill journal. Using default values.")
+        Configuration.spill_max_bytes = DEFAULT_SPILL_MAX_BYTES
+        Configuration.spill_drain_budget = DEFAULT_SPILL_DRAIN_BUDGET
+    Configuration.chunked_reporting = (
+        chunked_reporting or os.environ.get(LUMIGO_CHUNKED_REPORTING, "").lower() == "true"
+    )
+    Configuration.compact_envelope = (
+        compact_envelope or os.environ.get(LUMIGO_COMPACT_ENVELOPE, "").lower() == "true"
+    )
+    try:
+        Configuration.edge_connections = max(
+            edge_connections or int(os.environ.get("LUMIGO_EDGE_CONNECTIONS", 1)), 1
+        )
+        Configuration.reporting_time_budget = reporting_time_budget or float(
+            os.environ.get("LUMIGO_REPORTING_TIME_BUDGET", DEFAULT_REPORTING_TIME_BUDGET)
+        )
+    except Exception:
+        warn_client("Could not configure the chunked reporting. Using default values.")
+        Configuration.edge_connections = 1
+        Configuration.reporting_time_budget = DEFAULT_REPORTING_TIME_BUDGET
+    Configuration.use_tracer_extension = (
+        os.environ.get(LUMIGO_USE_TRACER_EXTENSION) or "false"
+    ).lower() == "true"
+    Configuration.prune_trace = os.environ.get("LUMIGO_PRUNE_TRACE_OFF", "").lower() != "true"
+    try:
+        Configuration.span_aggregation_threshold = max(
+            span_aggregation_threshold or int(os.environ.get(LUMIGO_SPAN_AGGREGATION_THRESHOLD, 0)),
+            0,
+        )
+        keep_slowest = os.environ.get(
+            "LUMIGO_SPAN_AGGREGATION_KEEP_SLOWEST", DEFAULT_SPAN_AGGREGATION_KEEP_SLOWEST
+        )
+        Configuration.span_aggregation_keep_slowest = max(
+            span_aggregation_keep_slowest or int(keep_slowest), 0
+        )
+    except Exception:
+        warn_client("Could not configure the span aggregation. Not aggregating spans.")
+        Configuration.span_aggregation_threshold = 0
+        Configuration.span_aggregation_keep_slowest = DEFAULT_SPAN_AGGREGATION_KEEP_SLOWEST
+    try:
+        if tail_sampling_rate is None and "LUMIGO_TAIL_SAMPLING_RATE" in os.environ:
+            tail_sampling_rate = float(os.environ["LUMIGO_TAIL_SAMPLING_RATE"])
+        Configuration.tail_sampling_rate = tail_sampling_rate
+        Configuration.tail_sampling_percentile = tail_sampling_percentile or float(
+            os.environ.get("LUMIGO_TAIL_SAMPLING_PERCENTILE", DEFAULT_TAIL_SAMPLING_PERCENTILE)
+        )
+    except Exception:
+        warn_client("Could not configure the tail sampling. Sending all the invocations.")
+        Configuration.tail_sampling_rate = None
+        Configuration.tail_sampling_percentile = DEFAULT_TAIL_SAMPLING_PERCENTILE
+    try:
+        if sampling_rate is None:
+            sampling_rate = float(os.environ.get("LUMIGO_SAMPLING_RATE", 1))
+        Configuration.sampling_rate = sampling_rate
+    except Exception:
+        warn_client("Could not configure LUMIGO_SAMPLING_RATE. Tracing all the invocations.")
+        Configuration.sampling_rate = 1.0
+    timeout_mechanism = (
+        timeout_mechanism or os.environ.get(LUMIGO_TIMEOUT_MECHANISM, TIMEOUT_MECHANISM_THREAD)
+    ).lower()
+    if timeout_mechanism not in (TIMEOUT_MECHANISM_THREAD, TIMEOUT_MECHANISM_SIGNAL):
+        warn_client(f"Unsupported timeout mechanism: {timeout_mechanism}. Using a watchdog thread.")
+        timeout_mechanism = TIMEOUT_MECHANISM_THREAD
+    Configuration.timeout_mechanism = timeout_mechanism
+    botocore_instrumentation_env = os.environ.get(LUMIGO_BOTOCORE_INSTRUMENTATION, "")
+    Configuration.botocore_instrumentation = (
+        botocore_instrumentation or botocore_instrumentation_env.lower() == "true"
+    )
 
 
 def _is_span_has_error(span: dict) -> bool:
@@ -260,8 +624,41 @@ def _is_span_has_error(span: dict) -> bool:
     )
 
 
+def _get_base64_size(size: int) -> int:
+    """
+    :return: the length of the base64 encoding of `size` bytes, without encoding them.
+    """
+    return 4 * ((size + 2) // 3)
+
+
 def _get_event_base64_size(event) -> int:
-    return len(b64encode(aws_dump(event).encode()))
+    return _get_base64_size(len(aws_dump(event)))
+
+
+class EncodedSpan(dict):
+    """
+    A span that was already serialized (e.g. when it ended), so we don't serialize it again when reporting.
+    The encoding is a snapshot - the span should not change after it was encoded.
+    """
+
+    __slots__ = ("encoded",)
+
+    def __init__(self, span: dict, encoded: str):
+        super().__init__(span)
+        self.encoded = encoded
+
+
+def _encode_span(span: dict) -> str:
+    if isinstance(span, EncodedSpan):
+        return span.encoded
+    return aws_dump(span)
+
+
+def _join_encoded_spans(encoded_spans: List[str]) -> str:
+    """
+    Assemble an already serialized list of spans. The result is equal to `aws_dump(spans)`.
+    """
+    return "[" + ", ".join(encoded_spans) + "]"
 
 
 def _create_request_body(
@@ -270,37 +667,205 @@ def _create_request_body(
     max_size: int = MAX_SIZE_FOR_REQUEST,
     too_big_spans_threshold: int = TOO_BIG_SPANS_THRESHOLD,
 ) -> str:
+    """
+    This function creates the body of the request to the edge.
+    Every span is serialized at most once, and the body is assembled from the serialized spans,
+        so the result is always a valid json that is not bigger than `max_size`.
 
-    if not prune_size_flag or (
-        len(msgs) < NUMBER_OF_SPANS_IN_REPORT_OPTIMIZATION
-        and _get_event_base64_size(msgs) < max_size  # noqa
-    ):
-        return aws_dump(msgs)[:max_size]
-
-    end_span = msgs[-1]
-    ordered_spans = sorted(msgs[:-1], key=_is_span_has_error, reverse=True)
-
-    spans_to_send: list = [end_span]
-    current_size = _get_event_base64_size(end_span)
+    :param prune_size_flag: If False, we send the spans by their original order until the budget is full.
+        Otherwise, we prefer the last span (the function's end span) and the spans with errors.
+    """
+    encoded_spans: List[Optional[str]] = [None] * len(msgs)
+    if not prune_size_flag or len(msgs) < NUMBER_OF_SPANS_IN_REPORT_OPTIMIZATION:
+        encoded_spans = [_encode_span(msg) for msg in msgs]
+        # The total length also counts the separators (", ") and the brackets
+        total_size = sum(len(encoded) for encoded in encoded_spans) + 2 * len(msgs)  # type: ignore
+        if not prune_size_flag:
+            if total_size <= max_size:
+                return _join_encoded_spans(encoded_spans)  # type: ignore
+            return _join_encoded_spans(_take_encoded_spans_until_full(encoded_spans, max_size))
+        if not msgs or _get_base64_size(total_size) < max_size:
+            return _join_encoded_spans(encoded_spans)  # type: ignore
+
+    end_span = encoded_spans[-1] or _encode_span(msgs[-1])
+    spans_to_send: List[str] = []
+    current_size = 0
+    if _get_base64_size(len(end_span)) < max_size:
+        spans_to_send.append(end_span)
+        current_size = _get_base64_size(len(end_span))
     too_big_spans = 0
-    for span in ordered_spans:
-        span_size = _get_event_base64_size(span)
+    for index in _get_pruning_order(msgs)[1:]:
+        encoded_span = encoded_spans[index] or _encode_span(msgs[index])
+        span_size = _get_base64_size(len(encoded_span))
         if current_size + span_size < max_size:
-            spans_to_send.append(span)
+            spans_to_send.append(encoded_span)
             current_size += span_size
         else:
             # This is an optimization step. If the spans are too big, don't try to send them.
             too_big_spans += 1
             if too_big_spans == too_big_spans_threshold:
                 break
-    return aws_dump(spans_to_send)[:max_size]
+    return _join_encoded_spans(spans_to_send)
+
+
+def _get_pruning_order(msgs: List[dict]) -> List[int]:
+    """
+    :return: The indexes of the spans by their sending priority:
+        the last span (the function's end span), then the spans with errors, then the rest.
+    """
+    if not msgs:
+        return []
+    ordered_spans = sorted(
+        range(len(msgs) - 1), key=lambda index: _is_span_has_error(msgs[index]), reverse=True
+    )
+    return [len(msgs) - 1] + ordered_spans
+
+
+def _get_envelope_wrapping(envelope_header: Optional[bytes]) -> Tuple[bytes, bytes]:
+    """
+    :return: The bytes before and after the serialized spans in the body of the request.
+    """
+    if envelope_header is None:
+        return b"[", b"]"
+    return b'{"header": ' + envelope_header + b', "spans": [', b"]}"
+
+
+def expand_envelope(payload: Union[bytes, str, dict, list]) -> List[dict]:
+    """
+    This function converts a compact envelope (a header with the shared fields, and the spans without them)
+        to the regular list of full spans.
+    """
+    from lumigo_tracer.parsing_utils import recursive_json_join
+
+    parsed = json.loads(payload) if isinstance(payload, (bytes, str)) else payload
+    if isinstance(parsed, list):
+        return parsed
+    return [recursive_json_join(span, parsed["header"]) for span in parsed["spans"]]
+
+
+class _RequestBodyBuilder:
+    """
+    This class builds a json list of already serialized spans, under the (base64) size budget.
+    It has the same interface as `_CompressedBodyBuilder`.
+    """
+
+    def __init__(self, max_size: int, envelope_header: Optional[bytes] = None):
+        self._max_size = max_size
+        self._prefix, self._suffix = _get_envelope_wrapping(envelope_header)
+        self._encoded_spans: List[bytes] = []
+        self._size = _get_base64_size(len(self._prefix) + len(self._suffix))
+        self.spans_count = 0
+
+    def try_add(self, encoded_span: bytes) -> bool:
+        span_size = _get_base64_size(len(encoded_span))
+        if self._size + span_size >= self._max_size:
+            return False
+        self._encoded_spans.append(encoded_span)
+        self._size += span_size
+        self.spans_count += 1
+        return True
+
+    def build(self) -> bytes:
+        return self._prefix + b", ".join(self._encoded_spans) + self._suffix
+
+
+class _CompressedBodyBuilder:
+    """
+    This class builds a compressed json list of spans, and keeps its compressed size under the budget.
+    The compressor is incremental, so every span is serialized and compressed exactly once.
+    We flush the compressor only when the upper bound of the result gets close to the budget,
+        so most of the spans are added without losing compression ratio.
+    """
+
+    def __init__(self, compression: str, max_size: int, envelope_header: Optional[bytes] = None):
+        wbits = zlib.MAX_WBITS | 16 if compression == "gzip" else zlib.MAX_WBITS
+        self._compressor = zlib.compressobj(wbits=wbits)
+        self._max_size = max_size
+        prefix, self._suffix = _get_envelope_wrapping(envelope_header)
+        self._chunks: List[bytes] = [self._compressor.compress(prefix)]
+        self._compressed_size = len(self._chunks[0])
+        self._raw_since_flush = len(prefix) + len(self._suffix)
+        self.spans_count = 0
+
+    @staticmethod
+    def _compressed_upper_bound(size: int) -> int:
+        # zlib's `compressBound`
+        return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+    def _fits(self, raw_size: int) -> bool:
+        upper_bound = self._compressed_size + self._compressed_upper_bound(raw_size)
+        return upper_bound + COMPRESSION_OVERHEAD <= self._max_size
+
+    def try_add(self, encoded_span: bytes) -> bool:
+        data = (b", " + encoded_span) if self.spans_count else encoded_span
+        if not self._fits(self._raw_since_flush + len(data)):
+            # Flushing makes the compressed size exact, and we can re-check the remaining budget
+            self._append(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+            self._raw_since_flush = 0
+            if not self._fits(len(data)):
+                return False
+        self._append(self._compressor.compress(data))
+        self._raw_since_flush += len(data)
+        self.spans_count += 1
+        return True
+
+    def _append(self, chunk: bytes) -> None:
+        if chunk:
+            self._chunks.append(chunk)
+            self._compressed_size += len(chunk)
+
+    def build(self) -> bytes:
+        self._chunks.append(self._compressor.compress(self._suffix))
+        self._chunks.append(self._compressor.flush())
+        return b"".join(self._chunks)
+
+
+def _create_compressed_request_body(
+    msgs: List[dict],
+    prune_size_flag: bool,
+    compression: str,
+    max_size: int = MAX_SIZE_FOR_REQUEST,
+    too_big_spans_threshold: int = TOO_BIG_SPANS_THRESHOLD,
+    envelope_header: Optional[bytes] = None,
+) -> bytes:
+    """
+    This function creates a compressed body of the request to the edge.
+    The size budget is applied on the compressed bytes.
+    """
+    builder = _CompressedBodyBuilder(compression, max_size, envelope_header)
+    order = _get_pruning_order(msgs) if prune_size_flag else range(len(msgs))
+    too_big_spans = 0
+    for index in order:
+        if not builder.try_add(_encode_span(msgs[index]).encode()):
+            if not prune_size_flag:
+                break
+            # This is an optimization step. If the spans are too big, don't try to send them.
+            too_big_spans += 1
+            if too_big_spans == too_big_spans_threshold:
+                break
+    return builder.build()
+
+
+def _take_encoded_spans_until_full(encoded_spans: List[Optional[str]], max_size: int) -> List[str]:
+    spans_to_send: List[str] = []
+    current_size = 2  # The brackets
+    for encoded_span in encoded_spans:
+        span_size = len(encoded_span) + (2 if spans_to_send else 0)  # type: ignore
+        if current_size + span_size > max_size:
+            break
+        spans_to_send.append(encoded_span)  # type: ignore
+        current_size += span_size
+    return spans_to_send
 
 
 def establish_connection(host=None):
     try:
         if not host:
             host = get_edge_host(os.environ.get("AWS_REGION"))
-        return http.client.HTTPSConnection(host, timeout=EDGE_TIMEOUT)
+        if Configuration.host.startswith(HTTP_PREFIX):
+            # Plain http is supported only for a local edge (e.g. in the benchmarks)
+            return http.client.HTTPConnection(host, timeout=InternalState.get_edge_timeout())
+        return http.client.HTTPSConnection(host, timeout=InternalState.get_edge_timeout())
     except Exception as e:
         get_logger().exception(f"Could not establish connection to {host}", exc_info=e)
     return None
@@ -311,13 +876,19 @@ def get_edge_host(region: Optional[str] = None) -> str:
     host = Configuration.host or EDGE_HOST.format(region=region or get_region())
     if host.startswith(HTTPS_PREFIX):
         host = host[len(HTTPS_PREFIX) :]  # noqa: E203
+    elif host.startswith(HTTP_PREFIX):
+        host = host[len(HTTP_PREFIX) :]  # noqa: E203
     if host.endswith(EDGE_PATH):
         host = host[: -len(EDGE_PATH)]
     return host
 
 
 def report_json(
-    region: Optional[str], msgs: List[dict], should_retry: bool = True, is_start_span=False
+    region: Optional[str],
+    msgs: List[dict],
+    should_retry: bool = True,
+    is_start_span=False,
+    base_msg: Optional[dict] = None,
 ) -> int:
     """
     This function sends the information back to the edge.
@@ -327,61 +898,350 @@ def report_json(
     :param should_retry: False to disable the default retry on unsuccessful sending
     :param is_start_span: a flag to indicate if this is the start_span
      of spans that will be written
+    :param base_msg: the fields that are shared by all the spans, and are missing from them.
+        If given, we send them once in the header of the request.
     :return: The duration of reporting (in milliseconds),
                 or 0 if we didn't send (due to configuration or fail).
     """
     if not InternalState.should_report_to_edge():
         get_logger().info("Skip sending messages due to previous timeout")
+        if Configuration.should_report and Configuration.spill_to_disk:
+            with lumigo_safe_execute("report json: spill skipped spans"):
+                for to_send in _create_payloads(msgs, base_msg):
+                    SpillJournal.spill(to_send)
         return 0
     if not Configuration.should_report:
         return 0
-    get_logger().info(f"reporting the messages: {msgs[:10]}")
+    if is_debug_enabled():
+        get_logger().info("reporting the messages: %s", msgs[:10])
     try:
-        prune_trace: bool = not os.environ.get("LUMIGO_PRUNE_TRACE_OFF", "").lower() == "true"
-        to_send = _create_request_body(msgs, prune_trace).encode()
+        bodies = _create_payloads(msgs, base_msg, region)
     except Exception as e:
         get_logger().exception("Failed to create request: A span was lost.", exc_info=e)
         return 0
     if should_use_tracer_extension():
         with lumigo_safe_execute("report json file: writing spans to file"):
+            if base_msg is not None:
+                msgs = expand_envelope({"header": base_msg, "spans": msgs})
             write_spans_to_files(spans=msgs, is_start_span=is_start_span)
         return 0
+    if Configuration.async_reporting:
+        for to_send in bodies:
+            BackgroundReporter.enqueue(region, to_send)
+        return 0
+    if len(bodies) == 1:
+        # The start span is sent before the handler runs, so we don't delay it with the spill journal
+        return _send_to_edge(
+            region, bodies[0], should_retry=should_retry, drain_spill=not is_start_span
+        )
+    return _send_bodies_to_edge(region, bodies, drain_spill=not is_start_span)
+
+
+def _send_bodies_to_edge(
+    region: Optional[str], bodies: List[bytes], drain_spill: bool = False
+) -> int:
+    """
+    This function sends several requests to the edge, in the reporting time budget.
+    The first request (that contains the end span and the errors) is always sent.
+    The requests that we didn't have time to send are dropped (or kept in the spill journal, if it's on).
+    If all the requests were sent, we drain the spill journal (if `drain_spill`).
+
+    :return: The duration of reporting (in milliseconds).
+    """
+    start_time = time.time()
+    deadline = time.monotonic() + Configuration.reporting_time_budget
+    if InternalState.invocation_deadline:
+        deadline = min(deadline, time.monotonic() + InternalState.invocation_deadline - start_time)
+    _send_to_edge(region, bodies[0])
+    if Configuration.edge_connections > 1 and region != CHINA_REGION:
+        executor = _get_edge_executor()
+        futures = {
+            executor.submit(_send_in_edge_pool, region, body, deadline): body for body in bodies[1:]
+        }
+        not_done = concurrent.futures.wait(
+            futures, timeout=max(deadline - time.monotonic(), 0)
+        ).not_done
+        # We wait for the requests that already started (their socket timeout is capped by the
+        #   invocation's remaining time), so the lambda isn't frozen in the middle of a request
+        concurrent.futures.wait([future for future in not_done if not future.cancel()])
+        dropped = [
+            body for future, body in futures.items() if future.cancelled() or not future.result()
+        ]
+    else:
+        dropped = [
+            body for body in bodies[1:] if not _send_to_edge_before_deadline(region, body, deadline)
+        ]
+    if dropped:
+        get_logger().warning(f"Reporting time budget is over, dropped {len(dropped)} requests")
+        if Configuration.spill_to_disk and region != CHINA_REGION:
+            for to_send in dropped:
+                SpillJournal.spill(to_send)
+    elif drain_spill and Configuration.spill_to_disk and InternalState.should_report_to_edge():
+        SpillJournal.drain()
+    return int((time.time() - start_time) * 1000)
+
+
+def _send_to_edge_before_deadline(region: Optional[str], to_send: bytes, deadline: float) -> bool:
+    """
+    :return: False if the request was dropped due to the deadline.
+    """
+    if time.monotonic() >= deadline:
+        return False
+    _send_to_edge(region, to_send)
+    return True
+
+
+def _send_in_edge_pool(region: Optional[str], to_send: bytes, deadline: float) -> bool:
+    _edge_pool_local.is_worker = True
+    return _send_to_edge_before_deadline(region, to_send, deadline)
+
+
+def _get_edge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global edge_executor
+    if not edge_executor:
+        edge_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=Configuration.edge_connections - 1
+        )
+    return edge_executor
+
+
+def _is_edge_pool_worker() -> bool:
+    return bool(getattr(_edge_pool_local, "is_worker", False))
+
+
+def _get_edge_connection() -> Optional[http.client.HTTPConnection]:
+    """
+    The threads of the connection pool have their own connections. The rest use the global connection.
+    """
+    if _is_edge_pool_worker():
+        return getattr(_edge_pool_local, "connection", None)
+    return edge_connection
+
+
+def _set_edge_connection(connection: Optional[http.client.HTTPConnection]) -> None:
+    global edge_connection
+    if _is_edge_pool_worker():
+        _edge_pool_local.connection = connection
+    else:
+        edge_connection = connection
+
+
+def _create_request_bodies(
+    msgs: List[dict],
+    max_size: int = MAX_SIZE_FOR_REQUEST,
+    envelope_header: Optional[bytes] = None,
+    compression: Optional[str] = None,
+) -> List[bytes]:
+    """
+    This function splits the spans into several requests, each of them in the size budget.
+    The spans are ordered by their priority, so the first request contains the end span and the errors.
+    A span is dropped only if it doesn't fit in a request by itself.
+    """
+    bodies: List[bytes] = []
+
+    def new_builder():
+        if compression:
+            return _CompressedBodyBuilder(compression, max_size, envelope_header)
+        return _RequestBodyBuilder(max_size, envelope_header)
+
+    builder = new_builder()
+    for index in _get_pruning_order(msgs):
+        encoded_span = _encode_span(msgs[index]).encode()
+        if builder.try_add(encoded_span):
+            continue
+        if builder.spans_count:
+            bodies.append(builder.build())
+            builder = new_builder()
+            if builder.try_add(encoded_span):
+                continue
+        get_logger().info("A span is bigger than the request size limit. A span was lost.")
+    if builder.spans_count:
+        bodies.append(builder.build())
+    return bodies
+
+
+def _create_payloads(
+    msgs: List[dict], base_msg: Optional[dict] = None, region: Optional[str] = None
+) -> List[bytes]:
+    """
+    :param region: The records of the Kinesis in the China region have no content encoding,
+        and its consumer expects a list of full spans, so we publish them uncompressed and without an envelope.
+    """
+    if region == CHINA_REGION and base_msg is not None:
+        msgs, base_msg = expand_envelope({"header": base_msg, "spans": msgs}), None
+    envelope_header = aws_dump(base_msg).encode() if base_msg is not None else None
+    compression = None if region == CHINA_REGION else Configuration.edge_compression
+    if Configuration.chunked_reporting:
+        return _create_request_bodies(
+            msgs, envelope_header=envelope_header, compression=compression
+        )
+    return [_create_payload(msgs, envelope_header, compression)]
+
+
+def _create_payload(
+    msgs: List[dict], envelope_header: Optional[bytes] = None, compression: Optional[str] = None
+) -> bytes:
+    prune_trace = Configuration.prune_trace
+    if compression:
+        return _create_compressed_request_body(
+            msgs, prune_trace, compression, envelope_header=envelope_header
+        )
+    if envelope_header is None:
+        return _create_request_body(msgs, prune_trace).encode()
+    prefix, suffix = _get_envelope_wrapping(envelope_header)
+    max_size = MAX_SIZE_FOR_REQUEST - _get_base64_size(len(prefix) + len(suffix))
+    spans = _create_request_body(msgs, prune_trace, max_size=max_size).encode()
+    return prefix + spans[1:-1] + suffix
+
+
+def _is_connected_to(connection: http.client.HTTPConnection, host: str) -> bool:
+    # The connection keeps the port separately
+    return host in (connection.host, f"{connection.host}:{connection.port}")
+
+
+def _get_edge_headers() -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if Configuration.edge_compression:
+        headers["Content-Encoding"] = Configuration.edge_compression
+    return headers
+
+
+def _send_to_edge(
+    region: Optional[str], to_send: bytes, should_retry: bool = True, drain_spill: bool = False
+) -> int:
+    """
+    This function sends an already serialized payload to the edge.
+    If it was sent and `drain_spill`, we also send the payloads of the spill journal.
+
+    :return: The duration of reporting (in milliseconds), or 0 if we didn't send.
+    """
     if region == CHINA_REGION:
         return _publish_spans_to_kinesis(to_send, CHINA_REGION)
     host = None
-    global edge_connection
     with lumigo_safe_execute("report json: establish connection"):
         host = get_edge_host(region)
         duration = 0
-        if not edge_connection or edge_connection.host != host:
-            edge_connection = establish_connection(host)
-            if not edge_connection:
+        connection = _get_edge_connection()
+        if not connection or not _is_connected_to(connection, host):
+            _set_edge_connection(establish_connection(host))
+            if not _get_edge_connection():
                 get_logger().warning("Can not establish connection. Skip sending span.")
                 return duration
     try:
-        start_time = time.time()
-        edge_connection.request(
-            "POST", EDGE_PATH, to_send, headers={"Content-Type": "application/json"}
-        )
-        response = edge_connection.getresponse()
-        response.read()  # We most read the response to keep the connection available
-        duration = int((time.time() - start_time) * 1000)
-        get_logger().info(f"successful reporting, code: {getattr(response, 'code', 'unknown')}")
+        duration = _post_to_edge(to_send)
+        if drain_spill and Configuration.spill_to_disk:
+            SpillJournal.drain()
     except socket.timeout:
         get_logger().exception(f"Timeout while connecting to {host}")
         InternalState.mark_timeout_to_edge()
         internal_analytics_message("report: socket.timeout")
+        if Configuration.spill_to_disk:
+            SpillJournal.spill(to_send)
     except Exception as e:
         if should_retry:
             get_logger().exception(f"Could not report to {host}. Retrying.", exc_info=e)
-            edge_connection = establish_connection(host)
-            report_json(region, msgs, should_retry=False)
+            _set_edge_connection(establish_connection(host))
+            _send_to_edge(region, to_send, should_retry=False, drain_spill=drain_spill)
         else:
             get_logger().exception("Could not report: A span was lost.", exc_info=e)
             internal_analytics_message(f"report: {type(e)}")
+            if Configuration.spill_to_disk:
+                SpillJournal.spill(to_send)
     return duration
 
 
+def _post_to_edge(to_send: bytes) -> int:
+    """
+    Send the payload using the existing edge connection. Raise on failure.
+
+    :return: The duration of reporting (in milliseconds).
+    """
+    connection = _get_edge_connection()
+    timeout = InternalState.get_edge_timeout(len(to_send))
+    connection.timeout = timeout  # type: ignore
+    if connection.sock:  # type: ignore
+        connection.sock.settimeout(timeout)  # type: ignore
+    start_time = time.time()
+    connection.request("POST", EDGE_PATH, to_send, headers=_get_edge_headers())  # type: ignore
+    response = connection.getresponse()  # type: ignore
+    response.read()  # We most read the response to keep the connection available
+    duration = time.time() - start_time
+    InternalState.mark_edge_success(duration)
+    get_logger().info("successful reporting, code: %s", getattr(response, "code", "unknown"))
+    return int(duration * 1000)
+
+
+class SpillJournal:
+    """
+    This class keeps the payloads that we failed to send in a bounded journal on the disk.
+    The journal is drained after a successful reporting, in the next invocations of the container.
+    When the journal is full, the oldest payloads are evicted.
+    """
+
+    @staticmethod
+    def _list_entries() -> List[os.DirEntry]:
+        if not os.path.isdir(Configuration.spill_dir):
+            return []
+        # The file names start with a timestamp, so this is the order of the writes
+        return sorted(
+            (e for e in os.scandir(Configuration.spill_dir) if e.name.endswith(SPILL_SUFFIX)),
+            key=lambda e: e.name,
+        )
+
+    @staticmethod
+    def spill(to_send: bytes) -> None:
+        with lumigo_safe_execute("spill journal: write"):
+            if len(to_send) > Configuration.spill_max_bytes:
+                get_logger().info("The payload is too big for the spill journal. A span was lost.")
+                return
+            Path(Configuration.spill_dir).mkdir(parents=True, exist_ok=True)
+            file_name = f"{int(time.time() * 1_000_000):020d}_{uuid.uuid4().hex}"
+            temp_path = os.path.join(Configuration.spill_dir, file_name)
+            with open(temp_path, "wb") as spill_file:
+                spill_file.write(to_send)
+            os.rename(temp_path, temp_path + SPILL_SUFFIX)
+            SpillJournal._evict()
+
+    @staticmethod
+    def _evict() -> None:
+        entries = SpillJournal._list_entries()
+        total_size = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total_size <= Configuration.spill_max_bytes:
+                break
+            total_size -= entry.stat().st_size
+            os.remove(entry.path)
+            get_logger().info("Evicted a payload from the spill journal. A span was lost.")
+
+    @staticmethod
+    def drain() -> int:
+        """
+        Send the spilled payloads (oldest first) until the journal is empty or the time budget is over.
+        We stop on the first failure, as the edge probably still has problems.
+
+        :return: The number of payloads that were sent.
+        """
+        sent = 0
+        deadline = time.monotonic() + Configuration.spill_drain_budget
+        with lumigo_safe_execute("spill journal: drain"):
+            for entry in SpillJournal._list_entries():
+                if time.monotonic() >= deadline:
+                    break
+                with open(entry.path, "rb") as spill_file:
+                    to_send = spill_file.read()
+                try:
+                    _post_to_edge(to_send)
+                except socket.timeout:
+                    InternalState.mark_timeout_to_edge()
+                    break
+                except Exception as e:
+                    get_logger().info("Could not drain the spill journal: %s", e)
+                    break
+                os.remove(entry.path)
+                sent += 1
+        return sent
+
+
 def get_span_file_name(span_type: str):
     unique_name = str(uuid.uuid4())
     return os.path.join(get_extension_dir(), f"{unique_name}_{span_type}")
@@ -393,7 +1253,7 @@ def write_extension_file(data: List[Dict], span_type: str):
     file_path = get_span_file_name(span_type)
     with open(file_path, "wb") as span_file:
         span_file.write(to_send)
-        get_logger().info(f"Wrote span to file to [{file_path}][{len(to_send)}]")
+        get_logger().info("Wrote span to file to [%s][%s]", file_path, len(to_send))
 
 
 def write_spans_to_files(
@@ -469,6 +1329,15 @@ def _send_data_to_kinesis(
     get_logger().info("Successful sending to Kinesis")
 
 
+@lru_cache(maxsize=1)
+def is_debug_enabled() -> bool:
+    """
+    `LUMIGO_DEBUG` is resolved once, so the hot paths can skip building their debug logs with a single check.
+    Note that the logs themselves should be formatted lazily (`logger.info("%s", value)`).
+    """
+    return os.environ.get("LUMIGO_DEBUG", "").lower() == "true"
+
+
 def get_logger(logger_name="lumigo"):
     """
     This function returns lumigo's logger.
@@ -483,7 +1352,7 @@ def get_logger(logger_name="lumigo"):
         _logger[logger_name].propagate = False
         handler = logging.StreamHandler()
         handler.setFormatter(logging.Formatter(LOG_FORMAT))
-        if os.environ.get("LUMIGO_DEBUG", "").lower() == "true":
+        if is_debug_enabled():
             _logger[logger_name].setLevel(logging.DEBUG)
         else:
             _logger[logger_name].setLevel(logging.CRITICAL)
@@ -557,6 +1426,8 @@ class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, decimal.Decimal):
             return float(o)
+        if isinstance(o, LazyDump):
+            return o.dump()
         raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
 
 
@@ -573,8 +1444,63 @@ def get_omitting_regex() -> Optional[Pattern[str]]:
     return re.compile(fr"({'|'.join(given_regexes)})", re.IGNORECASE)
 
 
+class MaskedKeysCache:
+    """
+    This class memoizes whether a key should be masked by the active omitting regex.
+    We see the same keys (headers, common fields) over and over again, so we match each one only once.
+    The cache is cleared when the regex changes, and when it gets too big.
+    """
+
+    regex: Optional[Pattern[str]] = None
+    keys: Dict[str, bool] = {}
+
+    @staticmethod
+    def is_masked(regex: Pattern[str], key: str) -> bool:
+        if regex is not MaskedKeysCache.regex:
+            MaskedKeysCache.regex = regex
+            MaskedKeysCache.keys = {}
+        masked = MaskedKeysCache.keys.get(key)
+        if masked is None:
+            masked = regex.match(key) is not None
+            if len(MaskedKeysCache.keys) >= MASKED_KEYS_CACHE_SIZE:
+                MaskedKeysCache.keys.clear()
+            MaskedKeysCache.keys[key] = masked
+        return masked
+
+
+class InvocationScopedDict(OrderedDict):
+    """
+    A mapping that keeps only the `max_size` most recently set items (LRU),
+        and is cleared at the beginning of every invocation (see `clear_all`).
+    It's used for the bookkeeping of the wrappers (e.g. connection -> span id),
+        which otherwise grows forever on long living containers.
+
+    :param max_size: The maximum number of items, or None to keep all the items of the invocation.
+    """
+
+    _instances: "weakref.WeakValueDictionary[int, InvocationScopedDict]" = (
+        weakref.WeakValueDictionary()
+    )
+
+    def __init__(self, max_size: Optional[int] = INVOCATION_MAPPING_MAX_SIZE):
+        super().__init__()
+        self.max_size = max_size
+        InvocationScopedDict._instances[id(self)] = self
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if self.max_size is not None and len(self) > self.max_size:
+            self.popitem(last=False)
+
+    @staticmethod
+    def clear_all() -> None:
+        for mapping in list(InvocationScopedDict._instances.values()):
+            mapping.clear()
+
+
 def warn_client(msg: str) -> None:
-    if os.environ.get("LUMIGO_WARNINGS") != "off":
+    if Configuration.client_warnings:
         print(f"{WARN_CLIENT_PREFIX}: {msg}")
 
 
@@ -609,9 +1535,20 @@ def create_step_function_span(message_id: str):
 
 
 def get_timeout_buffer(remaining_time: float):
+    """
+    The buffer (in seconds) before the timeout, in which we send the spans.
+    It is based on the measured duration of the previous flushes, or 10% of the remaining time before we have one.
+    """
     buffer = Configuration.timeout_timer_buffer
     if not buffer:
-        buffer = max(0.5, min(0.1 * remaining_time, 3))
+        flush_duration = InternalState.flush_duration
+        if flush_duration is not None:
+            buffer = max(
+                MIN_TIMEOUT_BUFFER,
+                min(TIMEOUT_BUFFER_FLUSH_FACTOR * flush_duration, MAX_TIMEOUT_BUFFER),
+            )
+        else:
+            buffer = max(0.5, min(0.1 * remaining_time, MAX_TIMEOUT_BUFFER))
     return buffer
 
 
@@ -651,7 +1588,12 @@ def _recursive_omitting(
     if key in SKIP_SCRUBBING_KEYS:
         new_value = value
         free_space -= len(value) if isinstance(value, str) else len(aws_dump({key: value}))
-    elif isinstance(key, str) and regex and regex.match(key) and not should_skip_key:
+    elif (
+        isinstance(key, str)
+        and regex  # noqa
+        and not should_skip_key  # noqa
+        and MaskedKeysCache.is_masked(regex, key)  # noqa
+    ):
         new_value = "****"
         free_space -= 4
     elif isinstance(value, (dict, OrderedDict)):
@@ -719,10 +1661,362 @@ def omit_keys(
     return omitted, size < 0
 
 
+class _UnsupportedKeyError(Exception):
+    pass
+
+
+_NO_ITEM: Any = object()
+_JSON_KEYS_CONSTANTS = {True: "true", False: "false", None: "null"}
+
+
+def _json_key(key: Any) -> str:
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, bool):
+        return _JSON_KEYS_CONSTANTS[key]
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        return json.dumps(key)
+    raise _UnsupportedKeyError()
+
+
+def _parse_json_item(item: Any) -> Any:
+    if isinstance(item, bytes):
+        try:
+            item = item.decode()
+        except Exception:
+            return str(item)
+    if isinstance(item, str) and item.startswith("{"):
+        try:
+            return json.loads(item)
+        except Exception:
+            pass
+    return item
+
+
+def _scrubbing_dumps(
+    value: Any,
+    max_size: int,
+    regex: Optional[Pattern[str]],
+    enforce_jsonify: bool,
+    omit_skip_path: Optional[List[str]] = None,
+    parse_json_items: bool = False,
+) -> str:
+    """
+    This function serializes the value to json, omitting the values of the keys that match the regex.
+    The value is traversed iteratively and serialized directly, and we stop as soon as we wrote `max_size`
+        characters, so the cost is bounded by `max_size` and not by the size of the value.
+
+    :param parse_json_items: If the value is a list, decode its bytes items and parse its json-string items.
+    :return: The serialized value, or its first `max_size` characters with the truncation suffix.
+    """
+    chunks: List[str] = []
+    size = 0
+    # Every frame is [items iterator, is dict, omit_skip_path, is first item, should scrub]
+    stack: List[list] = []
+    current, path, scrub = value, omit_skip_path, regex is not None
+    while True:
+        if isinstance(current, dict):
+            chunk = "{"
+            stack.append([iter(current.items()), True, path, True, scrub])
+        elif isinstance(current, (list, tuple)):
+            chunk = "["
+            items = map(_parse_json_item, current) if parse_json_items else iter(current)
+            stack.append([items, False, path, True, scrub])
+        elif isinstance(current, str):
+            # Every character is written as at least one character, so the rest will be truncated anyway
+            chunk = encode_basestring_ascii(current[: max_size - size])
+        elif current is None or isinstance(current, bool):
+            chunk = _JSON_KEYS_CONSTANTS[current]
+        elif isinstance(current, int):
+            chunk = int.__repr__(current)
+        elif isinstance(current, (float, decimal.Decimal)):
+            chunk = json.dumps(float(current))
+        else:
+            if enforce_jsonify:
+                raise TypeError(
+                    f"Object of type {current.__class__.__name__} is not JSON serializable"
+                )
+            chunk = encode_basestring_ascii(str(current)[: max_size - size])
+        chunks.append(chunk)
+        size += len(chunk)
+        # Only the items of the root list are parsed
+        parse_json_items = False
+
+        current = _NO_ITEM
+        while stack and size < max_size:
+            frame = stack[-1]
+            item = next(frame[0], _NO_ITEM)
+            if item is _NO_ITEM:
+                stack.pop()
+                chunks.append("}" if frame[1] else "]")
+                size += 1
+                continue
+            separator = "" if frame[3] else ", "
+            frame[3] = False
+            path, scrub = frame[2], frame[4]
+            if not frame[1]:
+                chunks.append(separator)
+                size += len(separator)
+                current = item
+                break
+            key, current = item
+            chunk = separator + encode_basestring_ascii(_json_key(key)) + ": "
+            chunks.append(chunk)
+            size += len(chunk)
+            should_skip_key = bool(path) and path[0] == key  # type: ignore
+            path = path[1:] if should_skip_key else None  # type: ignore
+            if key in SKIP_SCRUBBING_KEYS:
+                scrub = False
+            elif (
+                scrub
+                and isinstance(key, str)  # noqa
+                and not should_skip_key  # noqa
+                and MaskedKeysCache.is_masked(regex, key)  # type: ignore # noqa
+            ):
+                current = "****"
+            break
+        if current is _NO_ITEM or size >= max_size:
+            break
+    result = "".join(chunks)
+    return (result[:max_size] + TRUNCATE_SUFFIX) if size >= max_size else result
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+_INCOMPLETE_ESCAPE = re.compile(r"(\\+)(u[0-9a-fA-F]{0,3})?$")
+
+
+class _WindowExhaustedError(Exception):
+    pass
+
+
+def _scan_json_scalar(text: str, pos: int) -> Tuple[str, int]:
+    """
+    This function scans a json scalar in the window, and returns it the way `json.dumps` would have written it.
+    If the scalar is cut by the end of the window, we return the prefix of a string, or raise `_WindowExhaustedError`.
+
+    :return: The serialized scalar, and the position after it (the end of the window for a partial string).
+    """
+    if text[pos] == '"':
+        try:
+            value, end = scanstring(text, pos + 1)
+            return encode_basestring_ascii(value), end
+        except json.JSONDecodeError as e:
+            if not e.msg.startswith("Unterminated string") and e.pos < len(text) - 6:
+                raise
+        raw = text[pos + 1 :]  # noqa: E203
+        incomplete_escape = _INCOMPLETE_ESCAPE.search(raw)
+        if incomplete_escape and len(incomplete_escape.group(1)) % 2:
+            raw = raw[: incomplete_escape.end(1) - 1]
+        value, _ = scanstring(raw + '"', 0)
+        return encode_basestring_ascii(value)[:-1], len(text)
+    number = NUMBER_RE.match(text, pos)
+    if number:
+        if number.end() == len(text) or text[number.end()] in ".eE":
+            raise _WindowExhaustedError()  # The number may continue after the window
+        integer, frac, exp = number.groups()
+        if frac or exp:
+            return json.dumps(float(number.group())), number.end()
+        return int.__repr__(int(integer)), number.end()
+    for literal in _JSON_LITERALS:
+        if text.startswith(literal, pos):
+            return literal, pos + len(literal)
+        if pos + len(literal) > len(text) and literal.startswith(text[pos:]):
+            raise _WindowExhaustedError()
+    raise ValueError(f"Unexpected character at {pos}")
+
+
+def _scan_json_key(text: str, pos: int) -> Tuple[str, int]:
+    try:
+        return scanstring(text, pos + 1)
+    except json.JSONDecodeError as e:
+        if e.msg.startswith("Unterminated string") or e.pos >= len(text) - 6:
+            raise _WindowExhaustedError()
+        raise
+
+
+def _scrubbing_dumps_json_window(
+    text: str, max_size: int, regex: Optional[Pattern[str]], omit_skip_path: Optional[List[str]]
+) -> Optional[str]:
+    """
+    This function dumps the beginning (window) of a json document, the way `lumigo_dumps` dumps the parsed document.
+    The json is parsed incrementally and re-written with the standard separators, omitting the secret values.
+
+    :raise ValueError: If the window is not a valid beginning of a json.
+    :return: The dump, or None if the window was not enough to fill the budget.
+    """
+    chunks: List[str] = []
+    size = 0
+    # Every frame is [is object, omit_skip_path, should scrub, should write, is first item]
+    stack: List[list] = []
+    path, scrub, write = omit_skip_path, regex is not None, True
+    pos, expect_value = 0, True
+    try:
+        while size < max_size:
+            pos = _JSON_WHITESPACE.match(text, pos).end()  # type: ignore
+            if pos >= len(text):
+                return None
+            if expect_value:
+                if text[pos] in "{[":
+                    stack.append([text[pos] == "{", path, scrub, write, True])
+                    chunk = text[pos]
+                    pos += 1
+                else:
+                    chunk, pos = _scan_json_scalar(text, pos)
+                if write:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                expect_value = False
+                continue
+            if not stack:
+                raise ValueError("Extra data")
+            frame = stack[-1]
+            if text[pos] == ("}" if frame[0] else "]"):
+                stack.pop()
+                if frame[3]:
+                    chunks.append(text[pos])
+                    size += 1
+                pos += 1
+                continue
+            if not frame[4]:
+                if text[pos] != ",":
+                    raise ValueError(f"Expecting ',' delimiter at {pos}")
+                pos = _JSON_WHITESPACE.match(text, pos + 1).end()  # type: ignore
+                if frame[3]:
+                    chunks.append(", ")
+                    size += 2
+            frame[4] = False
+            path, scrub, write = frame[1], frame[2], frame[3]
+            expect_value = True
+            if not frame[0]:
+                continue
+            if text[pos] != '"':
+                raise ValueError(f"Expecting property name at {pos}")
+            key, pos = _scan_json_key(text, pos)
+            pos = _JSON_WHITESPACE.match(text, pos).end()  # type: ignore
+            if text[pos] != ":":
+                raise ValueError(f"Expecting ':' delimiter at {pos}")
+            pos += 1
+            if write:
+                chunk = encode_basestring_ascii(key) + ": "
+                chunks.append(chunk)
+                size += len(chunk)
+            should_skip_key = bool(path) and path[0] == key  # type: ignore
+            path = path[1:] if should_skip_key else None  # type: ignore
+            if key in SKIP_SCRUBBING_KEYS:
+                scrub = False
+            elif scrub and not should_skip_key and MaskedKeysCache.is_masked(regex, key):  # type: ignore
+                if write:
+                    chunks.append('"****"')
+                    size += 6
+                write = False
+    except (_WindowExhaustedError, IndexError):
+        return None  # The window ended in the middle of a token
+    return "".join(chunks)[:max_size] + TRUNCATE_SUFFIX
+
+
+def _dumps_window(
+    d: Union[bytes, str],
+    max_size: int,
+    regex: Optional[Pattern[str]],
+    omit_skip_path: Optional[List[str]],
+) -> Optional[str]:
+    """
+    This function dumps a big body by decoding and scanning only its beginning.
+
+    :return: The dump, or None if the beginning was not enough (then the whole body should be dumped).
+    """
+    window = d[: max_size * PREFIX_WINDOW_FACTOR]
+    if isinstance(window, bytes):
+        try:
+            text = codecs.getincrementaldecoder("utf-8")().decode(window, final=False)
+        except UnicodeDecodeError:
+            return _scrubbing_dumps(str(window), max_size, None, False)
+    else:
+        text = window
+    if text.startswith("{"):
+        try:
+            return _scrubbing_dumps_json_window(text, max_size, regex, omit_skip_path)
+        except ValueError:
+            pass  # Not a json - dump it as a string
+    return _scrubbing_dumps(text, max_size, None, False)
+
+
 def aws_dump(d: Any, decimal_safe=False, **kwargs) -> str:
     if decimal_safe:
         return json.dumps(d, cls=DecimalEncoder, **kwargs)
-    return json.dumps(d, **kwargs)
+    return json.dumps(d, default=_dump_lazy_value, **kwargs)
+
+
+class LazyDump:
+    """
+    A field of a span that is dumped only when the span is reported (by `aws_dump`), or when it is read.
+    Most of the spans are never sent (e.g. `send_only_if_error` or sampling), so we don't dump them in advance.
+
+    The arguments should be a snapshot that the user's code can't change (e.g. bytes or a copy).
+    """
+
+    __slots__ = ("dump_function", "args", "kwargs", "_dumped")
+
+    def __init__(self, dump_function: Callable[..., str], *args, **kwargs):
+        self.dump_function = dump_function
+        self.args = args
+        self.kwargs = kwargs
+        self._dumped: Optional[str] = None
+
+    def dump(self) -> str:
+        if self._dumped is None:
+            self._dumped = self.dump_function(*self.args, **self.kwargs)
+            self.args = self.kwargs = None  # type: ignore
+        return self._dumped  # type: ignore
+
+    def __eq__(self, other: Any) -> bool:
+        return self.dump() == materialize(other)
+
+    def __hash__(self) -> int:
+        return hash(self.dump())
+
+    def __repr__(self) -> str:
+        return repr(self.dump())
+
+
+def _dump_lazy_value(o: Any) -> str:
+    if isinstance(o, LazyDump):
+        return o.dump()
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+
+def materialize(value: Any) -> Any:
+    """
+    :return: The value with its lazy fields dumped (see `LazyDump`). Dicts and lists are copied if needed.
+    """
+    if isinstance(value, LazyDump):
+        return value.dump()
+    if isinstance(value, dict):
+        return {k: materialize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [materialize(v) for v in value]
+    return value
+
+
+_IMMUTABLE_SCALARS = (str, bytes, int, float, bool, type(None))
+
+
+def lumigo_lazy_dumps(d: Any, **kwargs) -> Union[str, LazyDump]:
+    """
+    This function is `lumigo_dumps` that is deferred until the span is reported (see `LazyDump`).
+    Strings, bytes and flat dicts/lists of them (which are copied) are kept for later.
+    The rest are dumped now, so the user's changes in these objects after the call won't leak into the span.
+    """
+    if isinstance(d, (str, bytes)):
+        return LazyDump(lumigo_dumps, d, **kwargs)
+    if isinstance(d, dict) and all(isinstance(v, _IMMUTABLE_SCALARS) for v in d.values()):
+        return LazyDump(lumigo_dumps, dict(d), **kwargs)
+    if isinstance(d, (list, tuple)) and all(isinstance(v, _IMMUTABLE_SCALARS) for v in d):
+        return LazyDump(lumigo_dumps, d.copy() if isinstance(d, list) else d, **kwargs)
+    return lumigo_dumps(d, **kwargs)
 
 
 def lumigo_dumps(
@@ -735,18 +2029,39 @@ def lumigo_dumps(
 ) -> str:
     regexes = regexes or get_omitting_regex()
     max_size = max_size if max_size is not None else Configuration.max_entry_size
-    is_truncated = False
+    if Configuration.should_scrub_known_services:
+        omit_skip_path = None
 
-    if isinstance(d, bytes):
-        try:
-            d = d.decode()
-        except Exception:
-            d = str(d)
-    if isinstance(d, str) and d.startswith("{"):
+    if (
+        isinstance(d, (bytes, str))
+        and len(d) > max_size * PREFIX_WINDOW_FACTOR  # noqa
+        and not d.endswith(TRUNCATE_SUFFIX if isinstance(d, str) else TRUNCATE_SUFFIX.encode())  # type: ignore # noqa
+    ):
+        dumped = _dumps_window(d, max_size, regexes, omit_skip_path)
+        if dumped is not None:
+            return dumped
+    d = _parse_json_item(d)
+    if isinstance(d, str) and d.endswith(TRUNCATE_SUFFIX):
+        return d
+    if isinstance(d, (str, dict, list)):
         try:
-            d = json.loads(d)
-        except Exception:
-            pass
+            return _scrubbing_dumps(
+                d, max_size, regexes, enforce_jsonify, omit_skip_path, parse_json_items=True
+            )
+        except _UnsupportedKeyError:
+            pass  # Keys that are not supported by json - fallback to the full serialization
+    return _legacy_lumigo_dumps(d, max_size, regexes, enforce_jsonify, decimal_safe, omit_skip_path)
+
+
+def _legacy_lumigo_dumps(
+    d: Any,
+    max_size: int,
+    regexes: Optional[Pattern[str]],
+    enforce_jsonify: bool,
+    decimal_safe: bool,
+    omit_skip_path: Optional[List[str]],
+) -> str:
+    is_truncated = False
     if isinstance(d, dict) and regexes:
         d, is_truncated = omit_keys(
             d,
@@ -1,11 +1,10 @@
 import json
 import re
 import urllib.parse
-from typing import Tuple, Dict, Union, List, Any, Optional
+from typing import Tuple, Dict, Union, List, Any, Optional, Sequence
+from xml.parsers import expat
 
-from lumigo_tracer.libs import xmltodict
 import functools
-import itertools
 from collections.abc import Iterable
 
 from lumigo_tracer.lumigo_utils import Configuration, get_logger
@@ -66,6 +65,118 @@ def safe_key_from_json(json_str: bytes, key: object, default=None) -> Union[str,
         return default
 
 
+XML_PATHS_CACHE_SIZE = 64
+
+
+class _XmlPathsFound(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=XML_PATHS_CACHE_SIZE)
+def _compile_xml_path(key: str) -> Tuple[Tuple[str, Optional[int]], ...]:
+    """
+    This function compiles a key of `safe_key_from_xml` to a tuple of (element name, index among its siblings).
+    """
+    steps: List[Tuple[str, Optional[int]]] = []
+    for sub_key in key.split("/"):
+        if steps and sub_key.isdigit():
+            steps[-1] = (steps[-1][0], int(sub_key))
+        else:
+            steps.append((sub_key, None))
+    return tuple(steps)
+
+
+class _XmlPathsExtractor:
+    """
+    This class reads the texts of the given paths in a single pass of expat, without building the XML tree.
+    The parsing stops as soon as all the paths were found, or can not be found anymore.
+    A path may be nested in another path, so every open target element has its own text and children flag.
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        self.paths = [_compile_xml_path(key) for key in keys]
+        self.results: List[Optional[str]] = [None] * len(keys)
+        self.pending = set(range(len(keys)))
+        self.matched_depth = [0] * len(keys)
+        self.siblings_counters: List[Dict[str, int]] = [{}]
+        # The open target elements by their depth: [texts, has children]
+        self.open_targets: Dict[int, list] = {}
+
+    def extract(self, xml_str: Union[bytes, str]) -> List[Optional[str]]:
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        try:
+            parser.Parse(xml_str, True)
+        except _XmlPathsFound:
+            pass
+        return self.results
+
+    def _start_element(self, name: str, attributes: dict) -> None:
+        depth = len(self.siblings_counters)
+        counter = self.siblings_counters[-1]
+        index = counter.get(name, 0)
+        counter[name] = index + 1
+        self.siblings_counters.append({})
+        for target in self.open_targets.values():
+            target[1] = True
+        for i in tuple(self.pending):
+            path = self.paths[i]
+            if self.matched_depth[i] != depth - 1 or depth > len(path):
+                continue
+            step_name, step_index = path[depth - 1]
+            if step_name == name and step_index in (None, index):
+                self.matched_depth[i] = depth
+                if depth == len(path):
+                    self.open_targets[depth] = [[], False]
+            elif depth == 1:
+                self.pending.discard(i)  # There is only one root
+        self._stop_if_done()
+
+    def _end_element(self, name: str) -> None:
+        depth = len(self.siblings_counters) - 1
+        self.siblings_counters.pop()
+        for i in tuple(self.pending):
+            path = self.paths[i]
+            if self.matched_depth[i] != depth:
+                continue
+            self.matched_depth[i] = depth - 1
+            if depth == len(path):
+                texts, has_children = self.open_targets[depth]
+                text = "".join(texts).strip()
+                self.results[i] = text if text and not has_children else None
+                self.pending.discard(i)
+            elif path[depth - 1][1] is not None:
+                # The indexed element ended, so the path can't be found anymore
+                self.pending.discard(i)
+        self.open_targets.pop(depth, None)
+        self._stop_if_done()
+
+    def _character_data(self, data: str) -> None:
+        for texts, _ in self.open_targets.values():
+            texts.append(data)
+
+    def _stop_if_done(self) -> None:
+        if not self.pending:
+            raise _XmlPathsFound()
+
+
+def safe_keys_from_xml(xml_str: bytes, keys: Sequence[str], default=None) -> List[Any]:
+    """
+    This function tries to read the given str as XML, and returns the values of the desired keys (in one pass).
+    If a key doesn't found or the input string is not a valid XML, its value is the default.
+
+    See `safe_key_from_xml` for the format of the keys.
+    """
+    try:
+        results = _XmlPathsExtractor(keys).extract(xml_str)
+    except expat.ExpatError:
+        return [default] * len(keys)
+    return [result or default for result in results]
+
+
 def safe_key_from_xml(xml_str: bytes, key: str, default=None):
     """
     This function tries to read the given str as XML, and returns the value of the desired key.
@@ -74,18 +185,10 @@ def safe_key_from_xml(xml_str: bytes, key: str, default=None):
     We accept keys with hierarchy by `/` (i.e. we accept keys with the format `outer/inner`)
     If there are some keys with the same name at the same hierarchy, they can be accessed as index in list,
         e.g: <a><b>val0</b><b>val1</b></a> will be accessed with "a/b/0" or "a/b/1".
+    Without an index, the first element that contains the rest of the path is used.
+    Only the text of elements without children is returned.
     """
-    try:
-        result = functools.reduce(
-            lambda prev, sub_key: safe_get_list(prev, sub_key)
-            if isinstance(prev, list)
-            else prev.get(sub_key, {}),
-            key.split("/"),
-            xmltodict.parse(xml_str),
-        )
-        return result or default
-    except xmltodict.expat.ExpatError:
-        return default
+    return safe_keys_from_xml(xml_str, [key], default)[0]
 
 
 def safe_key_from_query(body: bytes, key: str, default=None) -> str:
@@ -129,14 +232,14 @@ def recursive_json_join(d1: Optional[dict], d2: Optional[dict]):
     * if key in d1 and is not dictionary, then the value is d1[key]
     * if key in d2 and is not dictionary, then the value is d2[key]
     * otherwise, join d1[key] and d2[key]
+    Note that only the overlapping dictionaries are copied, the other values are shared with the inputs.
     """
     if d1 is None or d2 is None:
         return d1 or d2
-    d = {}
-    for key in set(itertools.chain(d1.keys(), d2.keys())):
-        value = d1.get(key, d2.get(key))
+    d = dict(d2)
+    for key, value in d1.items():
         if isinstance(value, dict):
-            d[key] = recursive_json_join(d1.get(key), d2.get(key))  # type: ignore
+            d[key] = recursive_json_join(value, d2.get(key))
         else:
             d[key] = value
     return d
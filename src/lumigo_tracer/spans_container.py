@@ -1,12 +1,19 @@
+import bisect
 import copy
+import hashlib
+import heapq
 import inspect
+import math
 import os
+import random
+from collections import deque
 from datetime import datetime
 
 import time
 import uuid
 import signal
-from typing import List, Dict, Optional, Callable, Set
+import threading
+from typing import List, Dict, Optional, Callable, Set, Deque, Union
 
 from lumigo_tracer.event.event_dumper import EventDumper
 from lumigo_tracer.lumigo_utils import (
@@ -26,15 +33,36 @@ from lumigo_tracer.lumigo_utils import (
     get_stacktrace,
     write_extension_file,
     should_use_tracer_extension,
+    should_post_to_edge,
+    lumigo_safe_execute,
+    aws_dump,
+    EncodedSpan,
+    InternalState,
+    TIMEOUT_MECHANISM_SIGNAL,
+    LazyDump,
+    lumigo_lazy_dumps,
+    materialize,
 )
 from lumigo_tracer import lumigo_utils
-from lumigo_tracer.parsing_utils import parse_trace_id, safe_split_get, recursive_json_join
+from lumigo_tracer.parsing_utils import (
+    parse_trace_id,
+    safe_split_get,
+    recursive_json_join,
+    safe_get,
+)
 from lumigo_tracer.event.event_trigger import parse_triggered_by
 
 _VERSION_PATH = os.path.join(os.path.dirname(__file__), "VERSION")
 MAX_LAMBDA_TIME = 15 * 60 * 1000
 FUNCTION_TYPE = "function"
 MALFORMED_TXID = "000000000000000000000000"
+AGGREGATED_SPAN_ID_SUFFIX = "_aggregated"
+# The upper bounds (ms) of the buckets of the aggregated spans' durations. The last bucket is unbounded.
+AGGREGATION_HISTOGRAM_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TAIL_SAMPLING_WINDOW_SIZE = 200
+TAIL_SAMPLING_MIN_SAMPLES = 20
+# The max time (seconds) to wait for a running timeout flush when the invocation ends (the max timeout buffer)
+WATCHDOG_STOP_TIMEOUT = 3
 
 
 class SpansContainer:
@@ -59,8 +87,9 @@ class SpansContainer:
         trigger_by: dict = None,
         max_finish_time: int = None,
         is_new_invocation: bool = False,
-        event: str = None,
-        envs: str = None,
+        event: Union[str, LazyDump] = None,
+        envs: Union[str, LazyDump] = None,
+        is_sampled: bool = True,
     ):
         version = open(_VERSION_PATH, "r").read() if os.path.exists(_VERSION_PATH) else "unknown"
         version = version.strip()
@@ -74,6 +103,7 @@ class SpansContainer:
             malformed_txid = True
         self.transaction_id = transaction_id
         self.max_finish_time = max_finish_time
+        self.is_sampled = is_sampled
         self.base_msg = {
             "lambda_container_id": SpansContainer.lambda_container_id,
             "started": started,
@@ -107,9 +137,31 @@ class SpansContainer:
         )
         self.span_ids_to_send: Set[str] = set()
         self.spans: Dict[str, Dict] = {}
+        self.span_finalizers: Dict[str, Callable[[], None]] = {}
+        # The checkpoint: the finished spans that were already encoded, and the spans that changed since
+        self.encoded_spans: Dict[str, EncodedSpan] = {}
+        self.changed_span_ids: Set[str] = set()
         if is_new_invocation:
             SpansContainer.is_cold = False
 
+    def _generate_summary_span(self, dropped_spans: int) -> dict:
+        """
+        The summary of an invocation that was not sampled: only the function's timing.
+        """
+        return self._join_base_msg(
+            {
+                "id": self.function_span["id"],
+                "type": FUNCTION_TYPE,
+                "name": self.name,
+                "started": self.function_span["started"],
+                "ended": self.function_span.get("ended"),
+                "readiness": self.function_span["readiness"],
+                "isSampled": False,
+                "droppedSpans": dropped_spans,
+                "error": self.function_span.get("error"),
+            }
+        )
+
     def _generate_start_span(self) -> dict:
         to_send = self.function_span.copy()
         to_send["id"] = f"{to_send['id']}_started"
@@ -119,9 +171,14 @@ class SpansContainer:
 
     def start(self, event=None, context=None):
         to_send = self._generate_start_span()
-        if not Configuration.send_only_if_error:
+        if not self.is_sampled:
+            get_logger().debug("Skip sending start because the invocation was not sampled")
+        elif not Configuration.send_only_if_error:
             report_duration = lumigo_utils.report_json(
-                region=self.region, msgs=[to_send], is_start_span=True
+                region=self.region,
+                msgs=[to_send],
+                is_start_span=True,
+                base_msg=self._get_envelope_header(),
             )
             self.function_span["reporter_rtt"] = report_duration
         else:
@@ -129,12 +186,31 @@ class SpansContainer:
         self.start_timeout_timer(context)
 
     def handle_timeout(self, *args):
+        """
+        This function sends the spans before the lambda times out.
+        Note that it may run in the watchdog thread, while the user's code keeps changing the spans.
+            In that case we don't run the finalizers (they change the spans and the http state),
+            and send the checkpoints of the finished spans and the in-flight spans as they are.
+        """
         get_logger().info("The tracer reached the end of the timeout timer")
-        to_send = [self.spans[span_id] for span_id in self.span_ids_to_send]
-        self.span_ids_to_send.clear()
-        if Configuration.send_only_if_error:
+        if threading.current_thread() is not WatchdogTimer._thread:
+            self.finalize_spans()
+        flush_start = time.monotonic()
+        should_mark_flush = should_post_to_edge()
+        span_ids = list(self.span_ids_to_send)
+        self.span_ids_to_send.difference_update(span_ids)
+        spans = [self._pop_span_to_send(span_id) for span_id in span_ids]
+        # The user's code may have popped a span in the meantime (e.g. to parse its response)
+        to_send = _aggregate_spans([span for span in spans if span is not None])
+        if Configuration.send_only_if_error or not self.is_sampled:
             to_send.append(self._generate_start_span())
-        lumigo_utils.report_json(region=self.region, msgs=to_send)
+        lumigo_utils.report_json(
+            region=self.region, msgs=to_send, base_msg=self._get_envelope_header()
+        )
+        if Configuration.async_reporting:
+            lumigo_utils.BackgroundReporter.flush()
+        if should_mark_flush:
+            InternalState.mark_flush_duration(time.monotonic() - flush_start)
 
     def start_timeout_timer(self, context=None) -> None:
         if Configuration.timeout_timer:
@@ -152,21 +228,84 @@ class SpansContainer:
         """
         This function parses an request event and add it to the span.
         """
-        new_span = recursive_json_join(span, self.base_msg)
+        if self._should_checkpoint():
+            self._checkpoint_finished_spans()
+        new_span = self._join_base_msg(span)
         span_id = new_span["id"]
         self.spans[span_id] = new_span
         self.span_ids_to_send.add(span_id)
+        self._mark_span_changed(span_id)
         return new_span
 
+    def _should_checkpoint(self) -> bool:
+        """
+        The encoded spans are useful only if the spans are going to be sent, and we may send them on timeout.
+        """
+        if not Configuration.timeout_timer or not self.is_sampled:
+            return False
+        return not Configuration.send_only_if_error and Configuration.tail_sampling_rate is None
+
+    def _checkpoint_finished_spans(self) -> None:
+        """
+        This function encodes the spans that ended since the last checkpoint, so the timeout flush
+            (and the report at the end) encodes only the spans that are still in-flight.
+        The spans are changed only through the container (see `_mark_span_changed`), so the encodings are up to date.
+        """
+        for span_id in list(self.changed_span_ids):
+            span = self.spans.get(span_id)
+            if span is None:
+                self.changed_span_ids.discard(span_id)
+            elif span.get("ended") and span_id in self.span_ids_to_send:
+                with lumigo_safe_execute("checkpoint span"):
+                    self.encoded_spans[span_id] = EncodedSpan(span, aws_dump(span))
+                    self.changed_span_ids.discard(span_id)
+
+    def _mark_span_changed(self, span_id: str) -> None:
+        self.encoded_spans.pop(span_id, None)
+        self.changed_span_ids.add(span_id)
+
+    def _pop_span_to_send(self, span_id: str) -> Optional[dict]:
+        return self.encoded_spans.pop(span_id, None) or self.spans.get(span_id)
+
+    def add_span_finalizer(self, key: str, finalizer: Callable[[], None]) -> None:
+        """
+        The finalizer runs once, before the spans are reported (e.g. to dump a body that was sent in chunks).
+        A finalizer with an existing key replaces the previous one.
+        """
+        self.span_finalizers[key] = finalizer
+
+    def finalize_spans(self) -> None:
+        finalizers, self.span_finalizers = self.span_finalizers, {}
+        for finalizer in finalizers.values():
+            with lumigo_safe_execute("finalize span"):
+                finalizer()
+
+    def _join_base_msg(self, span: dict) -> dict:
+        """
+        In the compact envelope mode, the shared fields are sent once in the header of the request.
+        """
+        if Configuration.compact_envelope:
+            return span
+        return recursive_json_join(span, self.base_msg)
+
+    def _get_envelope_header(self) -> Optional[dict]:
+        return self.base_msg if Configuration.compact_envelope else None
+
     def get_span_by_id(self, span_id: Optional[str]) -> Optional[dict]:
-        if not span_id:
+        """
+        Note that the returned span may be changed by the caller, so it is not considered as finished.
+        """
+        if not span_id or span_id not in self.spans:
             return None
-        return self.spans.get(span_id)
+        self._mark_span_changed(span_id)
+        return self.spans[span_id]
 
     def pop_span(self, span_id: Optional[str]) -> Optional[dict]:
         if not span_id:
             return None
         self.span_ids_to_send.discard(span_id)
+        self.encoded_spans.pop(span_id, None)
+        self.changed_span_ids.discard(span_id)
         return self.spans.pop(span_id, None)
 
     def update_event_end_time(self, span_id: str) -> None:
@@ -176,6 +315,7 @@ class SpansContainer:
         if span_id in self.spans:
             self.spans[span_id]["ended"] = get_current_ms_time()
             self.span_ids_to_send.add(span_id)
+            self._mark_span_changed(span_id)
         else:
             get_logger().warning(f"update_event_end_time: Got unknown span id: {span_id}")
 
@@ -193,6 +333,7 @@ class SpansContainer:
             end_timestamp = end_time.timestamp() if end_time else time.time()
             self.spans[span_id]["started"] = int(start_timestamp * 1000)
             self.spans[span_id]["ended"] = int(end_timestamp * 1000)
+            self._mark_span_changed(span_id)
         else:
             get_logger().warning(f"update_event_times: Got unknown span id: {span_id}")
 
@@ -231,11 +372,11 @@ class SpansContainer:
         message_id = str(uuid.uuid4())
         step_function_span = create_step_function_span(message_id)
         span_id = step_function_span["id"]
-        self.spans[span_id] = recursive_json_join(step_function_span, self.base_msg)
+        self.spans[span_id] = self._join_base_msg(step_function_span)
         self.span_ids_to_send.add(span_id)
         if isinstance(ret_val, dict):
             ret_val[LUMIGO_EVENT_KEY] = {STEP_FUNCTION_UID_KEY: message_id}
-            get_logger().debug(f"Added key {LUMIGO_EVENT_KEY} to the user's return value")
+            get_logger().debug("Added key %s to the user's return value", LUMIGO_EVENT_KEY)
 
     def get_tags_len(self) -> int:
         return len(self.function_span[EXECUTION_TAGS_KEY])
@@ -245,11 +386,14 @@ class SpansContainer:
 
     def end(self, ret_val=None, event: Optional[dict] = None, context=None) -> Optional[int]:
         TimeoutMechanism.stop()
+        self.finalize_spans()
         reported_rtt = None
         self.previous_request = None
         self.function_span.update({"ended": get_current_ms_time()})
         if Configuration.is_step_function:
             self.add_step_end_event(ret_val)
+        if not self.is_sampled:
+            return self._end_unsampled()
         parsed_ret_val = None
         if Configuration.verbose:
             try:
@@ -271,16 +415,51 @@ class SpansContainer:
         ) or _is_span_has_error(self.function_span)
 
         if (not Configuration.send_only_if_error) or spans_contain_errors:
-            to_send = [self.function_span] + [
-                span for span_id, span in self.spans.items() if span_id in self.span_ids_to_send
+            flush_start = time.monotonic()
+            # Only flushes that post the whole trace to the edge estimate the next flush duration
+            should_mark_flush = should_post_to_edge()
+            spans = [
+                self.encoded_spans.get(span_id) or span
+                for span_id, span in self.spans.items()
+                if span_id in self.span_ids_to_send
             ]
-            reported_rtt = lumigo_utils.report_json(region=self.region, msgs=to_send)
+            if TailSampler.should_send_trace(self.function_span, spans_contain_errors):
+                to_send = [self.function_span] + _aggregate_spans(spans)
+            else:
+                get_logger().debug("The invocation was not sampled, sending only its summary")
+                to_send = [self._generate_summary_span(dropped_spans=len(spans))]
+                should_mark_flush = False
+            reported_rtt = lumigo_utils.report_json(
+                region=self.region, msgs=to_send, base_msg=self._get_envelope_header()
+            )
+            if Configuration.async_reporting:
+                lumigo_utils.BackgroundReporter.flush()
+            if should_mark_flush:
+                InternalState.mark_flush_duration(time.monotonic() - flush_start)
         else:
             get_logger().debug(
                 "No Spans were sent, `Configuration.send_only_if_error` is on and no span has error"
             )
             if should_use_tracer_extension():
                 write_extension_file([{}], "stop")
+            if Configuration.async_reporting:
+                lumigo_utils.BackgroundReporter.flush()
+        return reported_rtt
+
+    def _end_unsampled(self) -> Optional[int]:
+        """
+        We send only the timing of the invocations that were not sampled (see `Configuration.sampling_rate`).
+        """
+        reported_rtt = None
+        if not Configuration.send_only_if_error or _is_span_has_error(self.function_span):
+            get_logger().debug("The invocation was not sampled, sending only its timing")
+            reported_rtt = lumigo_utils.report_json(
+                region=self.region,
+                msgs=[self._generate_summary_span(dropped_spans=len(self.span_ids_to_send))],
+                base_msg=self._get_envelope_header(),
+            )
+        if Configuration.async_reporting:
+            lumigo_utils.BackgroundReporter.flush()
         return reported_rtt
 
     def _set_error_extra_data(self, event):
@@ -320,14 +499,18 @@ class SpansContainer:
             return cls._span
         # copy the event to ensure that we will not change it
         event = copy.deepcopy(event)
+        trace_root, transaction_id, suffix = parse_trace_id(os.environ.get("_X_AMZN_TRACE_ID", ""))
+        is_sampled = is_transaction_sampled(transaction_id)
         additional_info = {}
-        if Configuration.verbose:
+        if Configuration.verbose and is_sampled:
             additional_info.update(
-                {"event": EventDumper.dump_event(event), "envs": _get_envs_for_span()}
+                {"event": LazyDump(EventDumper.dump_event, event), "envs": _get_envs_for_span()}
             )
 
-        trace_root, transaction_id, suffix = parse_trace_id(os.environ.get("_X_AMZN_TRACE_ID", ""))
         remaining_time = getattr(context, "get_remaining_time_in_millis", lambda: MAX_LAMBDA_TIME)()
+        if is_new_invocation:
+            lumigo_utils.InternalState.invocation_deadline = time.time() + remaining_time / 1000
+            lumigo_utils.InvocationScopedDict.clear_all()
         cls._span = SpansContainer(
             started=get_current_ms_time(),
             name=os.environ.get("AWS_LAMBDA_FUNCTION_NAME"),
@@ -344,28 +527,257 @@ class SpansContainer:
             trigger_by=parse_triggered_by(event),
             max_finish_time=get_current_ms_time() + remaining_time,
             is_new_invocation=is_new_invocation,
+            is_sampled=is_sampled,
             **additional_info,
         )
         return cls._span
 
 
+def is_transaction_sampled(transaction_id: Optional[str]) -> bool:
+    """
+    This function decides whether to trace the invocation (see `Configuration.sampling_rate`).
+    The decision is a hash of the transaction id, so all the functions in the transaction take the same decision.
+    """
+    rate = Configuration.sampling_rate
+    if rate >= 1:
+        return True
+    if not transaction_id or transaction_id == MALFORMED_TXID:
+        return random.random() < rate
+    digest = hashlib.md5(transaction_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") < rate * 2**64
+
+
+class TailSampler:
+    """
+    This class decides at the end of the invocation whether to send its full trace (see `Configuration.tail_sampling_rate`).
+    We always send the invocations with errors, and the slow invocations - above a percentile of the recent durations
+        in this container. From the rest, we send a random fraction.
+    """
+
+    durations: Deque[int] = deque(maxlen=TAIL_SAMPLING_WINDOW_SIZE)
+
+    @staticmethod
+    def should_send_trace(function_span: dict, has_error: bool) -> bool:
+        if Configuration.tail_sampling_rate is None or has_error:
+            return True
+        duration = function_span["ended"] - function_span["started"]
+        threshold = TailSampler.get_duration_percentile(Configuration.tail_sampling_percentile)
+        TailSampler.durations.append(duration)
+        if threshold is None or duration >= threshold:
+            return True
+        return random.random() < Configuration.tail_sampling_rate
+
+    @staticmethod
+    def get_duration_percentile(percentile: float) -> Optional[int]:
+        """
+        :return: The percentile of the recent durations, or None if there are not enough of them yet.
+        """
+        if len(TailSampler.durations) < TAIL_SAMPLING_MIN_SAMPLES:
+            return None
+        durations = sorted(TailSampler.durations)
+        index = math.ceil(len(durations) * percentile / 100) - 1
+        return durations[min(max(index, 0), len(durations) - 1)]
+
+    @staticmethod
+    def reset():
+        TailSampler.durations.clear()
+
+
+class SignalTimer:
+    """
+    This timer runs the callback in a SIGALRM handler, on the main thread (in the middle of the user's code).
+    """
+
+    @staticmethod
+    def start(seconds: float, to_exec: Callable):
+        signal.signal(signal.SIGALRM, to_exec)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    @staticmethod
+    def stop():
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+    @staticmethod
+    def is_activated() -> bool:
+        return signal.getsignal(signal.SIGALRM) != signal.SIG_DFL
+
+
+class WatchdogTimer:
+    """
+    This timer runs the callback in a daemon thread, when a monotonic deadline passes.
+    The thread is reused by all the invocations of the container, so (re)arming the timer doesn't create a thread.
+    """
+
+    _condition = threading.Condition()
+    _thread: Optional[threading.Thread] = None
+    _deadline: Optional[float] = None
+    _to_exec: Optional[Callable] = None
+    _executing: bool = False
+
+    @staticmethod
+    def start(seconds: float, to_exec: Callable):
+        with WatchdogTimer._condition:
+            WatchdogTimer._deadline = time.monotonic() + seconds
+            WatchdogTimer._to_exec = to_exec
+            if not WatchdogTimer._thread or not WatchdogTimer._thread.is_alive():
+                WatchdogTimer._thread = threading.Thread(
+                    target=WatchdogTimer._watch, name="lumigo-timeout-watchdog", daemon=True
+                )
+                WatchdogTimer._thread.start()
+            WatchdogTimer._condition.notify_all()
+
+    @staticmethod
+    def stop(timeout: float = WATCHDOG_STOP_TIMEOUT):
+        """
+        Disarm the timer. If the callback is already running, wait for it (up to the timeout),
+            so we don't send the spans twice at the same time.
+        """
+        with WatchdogTimer._condition:
+            WatchdogTimer._deadline = WatchdogTimer._to_exec = None
+            WatchdogTimer._condition.notify_all()
+            if threading.current_thread() is not WatchdogTimer._thread:
+                WatchdogTimer._condition.wait_for(lambda: not WatchdogTimer._executing, timeout)
+
+    @staticmethod
+    def is_activated() -> bool:
+        return WatchdogTimer._deadline is not None
+
+    @staticmethod
+    def _watch() -> None:
+        condition = WatchdogTimer._condition
+        while True:
+            with condition:
+                while WatchdogTimer._deadline is None or time.monotonic() < WatchdogTimer._deadline:
+                    condition.wait(
+                        WatchdogTimer._deadline - time.monotonic()
+                        if WatchdogTimer._deadline is not None
+                        else None
+                    )
+                to_exec = WatchdogTimer._to_exec
+                WatchdogTimer._deadline = WatchdogTimer._to_exec = None
+                WatchdogTimer._executing = True
+            try:
+                with lumigo_safe_execute("timeout watchdog"):
+                    to_exec()  # type: ignore
+            finally:
+                with condition:
+                    WatchdogTimer._executing = False
+                    condition.notify_all()
+
+
 class TimeoutMechanism:
     @staticmethod
-    def start(seconds: int, to_exec: Callable):
+    def _get_timer():
+        if Configuration.timeout_mechanism == TIMEOUT_MECHANISM_SIGNAL:
+            return SignalTimer
+        return WatchdogTimer
+
+    @staticmethod
+    def start(seconds: float, to_exec: Callable):
         if Configuration.timeout_timer:
-            signal.signal(signal.SIGALRM, to_exec)
-            signal.setitimer(signal.ITIMER_REAL, seconds)
+            TimeoutMechanism._get_timer().start(seconds, to_exec)
 
     @staticmethod
     def stop():
         if Configuration.timeout_timer:
-            signal.alarm(0)
-            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            TimeoutMechanism._get_timer().stop()
 
     @staticmethod
     def is_activated():
-        return Configuration.timeout_timer and signal.getsignal(signal.SIGALRM) != signal.SIG_DFL
-
-
-def _get_envs_for_span(has_error: bool = False) -> str:
-    return lumigo_dumps(dict(os.environ), Configuration.get_max_entry_size(has_error))
+        return Configuration.timeout_timer and TimeoutMechanism._get_timer().is_activated()
+
+
+def _get_envs_for_span(has_error: bool = False) -> Union[str, LazyDump]:
+    return lumigo_lazy_dumps(dict(os.environ), max_size=Configuration.get_max_entry_size(has_error))
+
+
+def _get_aggregation_key(span: dict) -> Optional[tuple]:
+    """
+    Spans with the same key are similar calls: the same type, host/resource and method/command.
+    Only ended spans without errors can be aggregated.
+    """
+    if not span.get("ended") or _is_span_has_error(span):
+        return None
+    info = span.get("info") or {}
+    http_info = info.get("httpInfo") or {}
+    host = (
+        http_info.get("host")
+        or safe_get(span, ["connectionOptions", "host"])  # noqa
+        or safe_get(span, ["connectionParameters", "host"])  # noqa
+        or span.get("databaseName")  # noqa
+    )
+    method = (
+        info.get("dynamodbMethod")
+        or safe_get(http_info, ["request", "method"])  # noqa
+        or span.get("requestCommand")  # noqa
+        or span.get("commandName")  # noqa
+        or materialize(span.get("query"))  # noqa
+    )
+    return span.get("type"), host, info.get("resourceName"), method
+
+
+def _get_span_duration(span: dict) -> int:
+    return span["ended"] - (span.get("started") or span["ended"])
+
+
+def _create_aggregated_span(spans: List[dict]) -> dict:
+    durations = [_get_span_duration(span) for span in spans]
+    histogram = [0] * (len(AGGREGATION_HISTOGRAM_BUCKETS) + 1)
+    for duration in durations:
+        histogram[bisect.bisect_left(AGGREGATION_HISTOGRAM_BUCKETS, duration)] += 1
+    aggregated_span = dict(spans[0])
+    aggregated_span.update(
+        {
+            "id": f"{spans[0]['id']}{AGGREGATED_SPAN_ID_SUFFIX}",
+            "started": min(span.get("started") or span["ended"] for span in spans),
+            "ended": max(span["ended"] for span in spans),
+            "aggregation": {
+                "count": len(spans),
+                "totalDuration": sum(durations),
+                "minDuration": min(durations),
+                "maxDuration": max(durations),
+                "histogram": {
+                    "bucketsBounds": list(AGGREGATION_HISTOGRAM_BUCKETS),
+                    "counts": histogram,
+                },
+            },
+        }
+    )
+    return aggregated_span
+
+
+def _aggregate_spans(spans: List[dict]) -> List[dict]:
+    """
+    This function collapses the similar spans after `Configuration.span_aggregation_threshold` of them into a single
+        aggregated span (which is based on the first collapsed span).
+    The spans with errors and the slowest `Configuration.span_aggregation_keep_slowest` spans are kept as is.
+    """
+    threshold = Configuration.span_aggregation_threshold
+    keep_slowest = Configuration.span_aggregation_keep_slowest
+    if not threshold:
+        return spans
+    with lumigo_safe_execute("aggregate spans"):
+        groups: Dict[tuple, List[int]] = {}
+        for index, span in enumerate(spans):
+            key = _get_aggregation_key(span)
+            if key:
+                groups.setdefault(key, []).append(index)
+        replacements: Dict[int, Optional[dict]] = {}
+        for indexes in groups.values():
+            if len(indexes) <= threshold + keep_slowest:
+                continue
+            candidates = indexes[threshold:]
+            slowest = set(
+                heapq.nlargest(keep_slowest, candidates, key=lambda i: _get_span_duration(spans[i]))
+            )
+            collapsed = [index for index in candidates if index not in slowest]
+            replacements.update(dict.fromkeys(collapsed))
+            replacements[collapsed[0]] = _create_aggregated_span([spans[i] for i in collapsed])
+        aggregated_spans = []
+        for index, span in enumerate(spans):
+            replacement = replacements.get(index, span)
+            if replacement is not None:
+                aggregated_spans.append(replacement)
+        return aggregated_spans
+    return spans
@@ -3,6 +3,7 @@ from .pymongo.pymongo_wrapper import wrap_pymongo
 from .redis.redis_wrapper import wrap_redis
 from .sql.sqlalchemy_wrapper import wrap_sqlalchemy
 from .aiohttp.aiohttp_wrapper import wrap_aiohttp
+from .botocore.botocore_wrapper import wrap_botocore
 
 
 already_wrapped = False
@@ -13,6 +14,7 @@ def wrap(force: bool = False):
     if not already_wrapped:
         # Never wrap http calls twice - it will create duplicate body
         wrap_http_calls()
+        wrap_botocore()
     if force or not already_wrapped:
         wrap_pymongo()
         wrap_redis()
@@ -1,8 +1,13 @@
-from lumigo_tracer.lumigo_utils import lumigo_safe_execute, get_logger, concat_old_body_to_new
+from lumigo_tracer.lumigo_utils import lumigo_safe_execute, get_logger
 from lumigo_tracer.libs.wrapt import wrap_function_wrapper
 from lumigo_tracer.spans_container import SpansContainer
 from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
-from lumigo_tracer.wrappers.http.sync_http_wrappers import add_request_event, update_event_response
+from lumigo_tracer.wrappers.http.sync_http_wrappers import (
+    add_request_event,
+    update_event_response,
+    add_request_body_chunk,
+    add_response_body_chunk,
+)
 
 try:
     import aiohttp
@@ -25,6 +30,8 @@ def aiohttp_trace_configs_wrapper(trace_config):
 
 
 async def on_request_start(session, trace_config_ctx, params):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("aiohttp on_request_start"):
         span = add_request_event(
             span_id=None,
@@ -40,16 +47,16 @@ async def on_request_start(session, trace_config_ctx, params):
 
 
 async def on_request_chunk_sent(session, trace_config_ctx, params):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("aiohttp on_request_chunk_sent"):
         span_id = getattr(trace_config_ctx, LUMIGO_SPAN_ID_KEY)
-        span = SpansContainer.get_span().get_span_by_id(span_id)
-        http_info = span.get("info", {}).get("httpInfo", {})
-        http_info["request"]["body"] = concat_old_body_to_new(
-            http_info.get("request", {}).get("body"), params.chunk
-        )
+        add_request_body_chunk(span_id, params.chunk)
 
 
 async def on_request_end(session, trace_config_ctx, params):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("aiohttp on_request_end"):
         span_id = getattr(trace_config_ctx, LUMIGO_SPAN_ID_KEY)
         update_event_response(
@@ -58,16 +65,16 @@ async def on_request_end(session, trace_config_ctx, params):
 
 
 async def on_response_chunk_received(session, trace_config_ctx, params):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("aiohttp on_response_chunk_received"):
         span_id = getattr(trace_config_ctx, LUMIGO_SPAN_ID_KEY)
-        span = SpansContainer.get_span().get_span_by_id(span_id)
-        http_info = span.get("info", {}).get("httpInfo", {})
-        http_info["response"]["body"] = concat_old_body_to_new(
-            http_info.get("response", {}).get("body"), params.chunk
-        )
+        add_response_body_chunk(span_id, params.chunk)
 
 
 async def on_request_exception(session, trace_config_ctx, params):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("aiohttp on_request_exception"):
         span_id = getattr(trace_config_ctx, LUMIGO_SPAN_ID_KEY)
         span = SpansContainer.get_span().get_span_by_id(span_id)
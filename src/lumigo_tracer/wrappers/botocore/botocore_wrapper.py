@@ -0,0 +1,91 @@
+import importlib.util
+from typing import Dict
+
+from lumigo_tracer.libs.wrapt import wrap_function_wrapper
+from lumigo_tracer.lumigo_utils import lumigo_safe_execute, get_logger, Configuration
+from lumigo_tracer.parsing_utils import recursive_json_join
+from lumigo_tracer.spans_container import SpansContainer
+from lumigo_tracer.wrappers.http.http_data_classes import BotocoreState, ClaimedAwsCall
+from lumigo_tracer.wrappers.http.http_parser import (
+    Parser,
+    DynamoParser,
+    SnsParser,
+    SqsParser,
+    KinesisParser,
+    EventBridgeParser,
+)
+
+LUMIGO_API_PARAMS_KEY = "_lumigo_api_params"
+LUMIGO_HOOK_ID_PREFIX = "lumigo-"
+
+# The services that their span fields can be taken from botocore's parameters and parsed responses
+PARSERS_BY_SERVICE: Dict[str, Parser] = {
+    "dynamodb": DynamoParser(),
+    "sns": SnsParser(),
+    "sqs": SqsParser(),
+    "kinesis": KinesisParser(),
+    "events": EventBridgeParser(),
+}
+
+
+def _before_parameter_build(params, context, **kwargs):
+    with lumigo_safe_execute("botocore before-parameter-build"):
+        # Other handlers (e.g. boto3's dynamodb types) may still change the parameters in place
+        context[LUMIGO_API_PARAMS_KEY] = params
+
+
+def _before_call(model, context, **kwargs):
+    if not SpansContainer.get_span().is_sampled:
+        return
+    with lumigo_safe_execute("botocore before-call"):
+        parser = PARSERS_BY_SERVICE.get(model.service_model.service_name)
+        if parser:
+            params = context.get(LUMIGO_API_PARAMS_KEY) or {}
+            request_info = parser.parse_api_request(model.name, params)
+            BotocoreState.set_current_call(ClaimedAwsCall(type(parser), request_info))
+
+
+def _after_call(model, parsed, **kwargs):
+    with lumigo_safe_execute("botocore after-call"):
+        aws_call = BotocoreState.get_current_call()
+        BotocoreState.set_current_call(None)
+        parser = PARSERS_BY_SERVICE.get(model.service_model.service_name)
+        if aws_call and parser and isinstance(parsed, dict):
+            aws_call.response_info = parser.parse_api_response(model.name, parsed)
+            span = SpansContainer.get_span().pop_span(aws_call.span_id)
+            if span:
+                SpansContainer.get_span().add_span(
+                    recursive_json_join(aws_call.response_info, span)
+                )
+
+
+def _after_call_error(**kwargs):
+    BotocoreState.set_current_call(None)
+
+
+def _create_client_wrapper(func, instance, args, kwargs):
+    client = func(*args, **kwargs)
+    if not Configuration.botocore_instrumentation:
+        return client
+    with lumigo_safe_execute("botocore register hooks"):
+        for event_name, handler in (
+            ("before-parameter-build", _before_parameter_build),
+            ("before-call", _before_call),
+            ("after-call", _after_call),
+            ("after-call-error", _after_call_error),
+        ):
+            client.meta.events.register(
+                event_name, handler, unique_id=f"{LUMIGO_HOOK_ID_PREFIX}{event_name}"
+            )
+    return client
+
+
+def wrap_botocore():
+    if not Configuration.botocore_instrumentation:
+        return
+    with lumigo_safe_execute("wrap botocore"):
+        if importlib.util.find_spec("botocore"):
+            get_logger().debug("wrapping botocore")
+            wrap_function_wrapper(
+                "botocore.session", "Session.create_client", _create_client_wrapper
+            )
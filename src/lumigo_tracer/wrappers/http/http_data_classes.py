@@ -1,8 +1,12 @@
+import threading
 from copy import deepcopy
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Union, Type, Any
+
+from lumigo_tracer.lumigo_utils import get_current_ms_time, InvocationScopedDict
 
 
 class HttpRequest:
+    __slots__ = ("host", "method", "uri", "headers", "body", "instance_id")
     host: str
     method: str
     uri: str
@@ -25,15 +29,99 @@ class HttpRequest:
         return clone_obj
 
 
+class HttpBodyAccumulator:
+    """
+    Collects the raw chunks of a body, up to `max_size` bytes, in O(1) per chunk.
+    The body is dumped once, when the span is finalized.
+    """
+
+    __slots__ = ("max_size", "size", "ended", "_chunks")
+
+    def __init__(self, max_size: int, body: Optional[Union[bytes, str]] = b""):
+        self.max_size = max_size
+        self.size = 0
+        self.ended: Optional[int] = None
+        self._chunks: List[bytes] = []
+        self._add(body)
+
+    def append(self, chunk: Optional[Union[bytes, str]]) -> None:
+        self._add(chunk)
+        self.ended = get_current_ms_time()
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._chunks)
+
+    def _add(self, chunk: Optional[Union[bytes, str]]) -> None:
+        if not chunk or self.size >= self.max_size:
+            return
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        chunk = chunk[: self.max_size - self.size]
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+
+
 class HttpState:
     previous_request: Optional[HttpRequest] = None
     previous_span_id: Optional[str] = None
     omit_skip_path: Optional[List[str]] = None
-    request_id_to_span_id: Dict[int, str] = {}
-    response_id_to_span_id: Dict[int, str] = {}
+    request_id_to_span_id: Dict[int, str] = InvocationScopedDict()
+    response_id_to_span_id: Dict[int, str] = InvocationScopedDict()
+    # An evicted accumulator would leave its span without a body, so these are bounded only by the invocation
+    request_bodies: Dict[str, HttpBodyAccumulator] = InvocationScopedDict(max_size=None)
+    response_bodies: Dict[str, HttpBodyAccumulator] = InvocationScopedDict(max_size=None)
 
     @staticmethod
     def clear():
         HttpState.previous_request = None
         HttpState.request_id_to_span_id.clear()
         HttpState.response_id_to_span_id.clear()
+        HttpState.request_bodies.clear()
+        HttpState.response_bodies.clear()
+
+
+class ClaimedAwsCall:
+    """
+    An AWS call that is made by botocore. We take its span fields from botocore's parameters and parsed response
+        (see the botocore wrapper), so the http wrappers don't parse its bodies.
+
+    :param parser: The parser class of the call's host, the claim applies only to http requests with this parser.
+    """
+
+    __slots__ = ("parser", "request_info", "response_info", "span_id", "raw_response")
+
+    def __init__(self, parser: Type[Any], request_info: dict):
+        self.parser = parser
+        self.request_info = request_info
+        self.response_info: dict = {}
+        self.span_id: Optional[str] = None
+        # The (host, status code, headers, body) of the last attempt's response, in case botocore retries the call
+        self.raw_response: Optional[tuple] = None
+
+
+class BotocoreState:
+    _current = threading.local()
+    spans_to_calls: Dict[str, ClaimedAwsCall] = InvocationScopedDict()
+
+    @staticmethod
+    def get_current_call() -> Optional[ClaimedAwsCall]:
+        return getattr(BotocoreState._current, "call", None)
+
+    @staticmethod
+    def set_current_call(call: Optional[ClaimedAwsCall]) -> None:
+        BotocoreState._current.call = call
+
+    @staticmethod
+    def claim_span(call: ClaimedAwsCall, span_id: str) -> None:
+        """
+        A call claims a single span: the previous span id (before the response, or of a previous attempt) is released.
+        """
+        if call.span_id and call.span_id != span_id:
+            BotocoreState.spans_to_calls.pop(call.span_id, None)
+        call.span_id = span_id
+        BotocoreState.spans_to_calls[span_id] = call
+
+    @staticmethod
+    def clear():
+        BotocoreState.set_current_call(None)
+        BotocoreState.spans_to_calls.clear()
@@ -1,12 +1,15 @@
 import json
+import re
 import uuid
-from typing import Type, Optional, List
+from functools import lru_cache
+from typing import Type, Optional, List, Tuple, Pattern, Dict
 from urllib.parse import unquote
 
 from lumigo_tracer.parsing_utils import (
     safe_split_get,
     safe_key_from_json,
     safe_key_from_xml,
+    safe_keys_from_xml,
     safe_key_from_query,
     recursive_json_join,
     safe_get,
@@ -15,7 +18,7 @@ from lumigo_tracer.parsing_utils import (
 )
 from lumigo_tracer.lumigo_utils import (
     Configuration,
-    lumigo_dumps,
+    lumigo_lazy_dumps,
     md5hash,
     get_logger,
     get_current_ms_time,
@@ -46,8 +49,10 @@ class Parser:
         if Configuration.verbose and parse_params and not should_scrub_domain(parse_params.host):
             HttpState.omit_skip_path = self.get_omit_skip_path()
             additional_info = {
-                "headers": lumigo_dumps(parse_params.headers),
-                "body": lumigo_dumps(parse_params.body, omit_skip_path=HttpState.omit_skip_path)
+                "headers": lumigo_lazy_dumps(parse_params.headers),
+                "body": lumigo_lazy_dumps(
+                    parse_params.body, omit_skip_path=HttpState.omit_skip_path
+                )
                 if parse_params.body
                 else "",
                 "method": parse_params.method,
@@ -77,8 +82,8 @@ class Parser:
         max_size = Configuration.get_max_entry_size(has_error=is_error_code(status_code))
         if Configuration.verbose and not should_scrub_domain(url):
             additional_info = {
-                "headers": lumigo_dumps(headers, max_size),
-                "body": lumigo_dumps(body, max_size) if body else "",
+                "headers": lumigo_lazy_dumps(headers, max_size=max_size),
+                "body": lumigo_lazy_dumps(body, max_size=max_size) if body else "",
                 "statusCode": status_code,
             }
         else:
@@ -94,6 +99,19 @@ class Parser:
     def get_omit_skip_path() -> Optional[List[str]]:
         return None
 
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        """
+        This function returns the fields that we can take from botocore's parameters of the call.
+        When botocore gives us these fields, we don't parse the request body (see the botocore wrapper).
+        """
+        return {}
+
+    def parse_api_response(self, operation: str, parsed: dict) -> dict:
+        """
+        This function returns the fields that we can take from botocore's parsed response.
+        """
+        return {}
+
 
 class ServerlessAWSParser(Parser):
     # Override this field to add message id using the amz headers
@@ -147,16 +165,18 @@ class DynamoParser(ServerlessAWSParser):
             parsed_body = {}
 
         return recursive_json_join(
-            {
-                "info": {
-                    "resourceName": self._extract_table_name(parsed_body, method),
-                    "dynamodbMethod": method,
-                    "messageId": self._extract_message_id(parsed_body, method),
-                }
-            },
-            super().parse_request(parse_params),
+            self.parse_api_request(method, parsed_body), super().parse_request(parse_params)
         )
 
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        return {
+            "info": {
+                "resourceName": self._extract_table_name(params, operation),
+                "dynamodbMethod": operation,
+                "messageId": self._extract_message_id(params, operation),
+            }
+        }
+
     @staticmethod
     def get_omit_skip_path() -> Optional[List[str]]:
         return ["Key"]
@@ -184,6 +204,13 @@ class SnsParser(ServerlessAWSParser):
             super().parse_response(url, status_code, headers, body),
         )
 
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        topic_arn = params.get("TopicArn")
+        return {"info": {"resourceName": topic_arn, "targetArn": topic_arn}}
+
+    def parse_api_response(self, operation: str, parsed: dict) -> dict:
+        return {"info": {"messageId": parsed.get("MessageId")}}
+
 
 class LambdaParser(ServerlessAWSParser):
     def parse_request(self, parse_params: HttpRequest) -> dict:
@@ -224,6 +251,15 @@ class KinesisParser(ServerlessAWSParser):
     def get_omit_skip_path() -> Optional[List[str]]:
         return ["PartitionKey"]
 
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        return {"info": {"resourceName": params.get("StreamName")}}
+
+    def parse_api_response(self, operation: str, parsed: dict) -> dict:
+        message_id = parsed.get("SequenceNumber") or safe_get(
+            parsed, ["Records", 0, "SequenceNumber"]
+        )
+        return {"info": {"messageId": message_id}}
+
 
 class SqsParser(ServerlessAWSParser):
     def parse_request(self, parse_params: HttpRequest) -> dict:
@@ -240,12 +276,21 @@ class SqsParser(ServerlessAWSParser):
 
     @staticmethod
     def _extract_message_id(response_body: bytes) -> Optional[str]:
-        return safe_key_from_xml(
-            response_body, "SendMessageResponse/SendMessageResult/MessageId"  # Single.
-        ) or safe_key_from_xml(
+        single, batch = safe_keys_from_xml(
             response_body,
-            "SendMessageBatchResponse/SendMessageBatchResult/SendMessageBatchResultEntry/0/MessageId",  # Batch.
+            [
+                "SendMessageResponse/SendMessageResult/MessageId",  # Single.
+                "SendMessageBatchResponse/SendMessageBatchResult/SendMessageBatchResultEntry/0/MessageId",  # Batch.
+            ],
         )
+        return single or batch
+
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        return {"info": {"resourceName": params.get("QueueUrl")}}
+
+    def parse_api_response(self, operation: str, parsed: dict) -> dict:
+        message_id = parsed.get("MessageId") or safe_get(parsed, ["Successful", 0, "MessageId"])
+        return {"info": {"messageId": message_id}}
 
 
 class S3Parser(Parser):
@@ -274,30 +319,33 @@ class EventBridgeParser(Parser):
                 "Error while trying to parse eventBridge request body", exc_info=e
             )
             parsed_body = {}
-        resource_names = set()
-        if isinstance(parsed_body.get("Entries"), list):
-            resource_names = {
-                e["EventBusName"] for e in parsed_body["Entries"] if e.get("EventBusName")
-            }
         return recursive_json_join(
-            {"info": {"resourceNames": list(resource_names) or None}},
-            super().parse_request(parse_params),
+            self.parse_api_request("PutEvents", parsed_body), super().parse_request(parse_params)
         )
 
+    def parse_api_request(self, operation: str, params: dict) -> dict:
+        resource_names = set()
+        if isinstance(params.get("Entries"), list):
+            resource_names = {e["EventBusName"] for e in params["Entries"] if e.get("EventBusName")}
+        return {"info": {"resourceNames": list(resource_names) or None}}
+
     def parse_response(self, url: str, status_code: int, headers, body: bytes) -> dict:
         try:
             parsed_body = json.loads(body)
         except json.JSONDecodeError as e:
             get_logger().debug("Error while trying to parse eventBridge request body", exc_info=e)
             parsed_body = {}
-        message_ids = []
-        if isinstance(parsed_body.get("Entries"), list):
-            message_ids = [e["EventId"] for e in parsed_body["Entries"] if e.get("EventId")]
         return recursive_json_join(
-            {"info": {"messageIds": message_ids}},
+            self.parse_api_response("PutEvents", parsed_body),
             super().parse_response(url, status_code, headers, body),
         )
 
+    def parse_api_response(self, operation: str, parsed: dict) -> dict:
+        message_ids = []
+        if isinstance(parsed.get("Entries"), list):
+            message_ids = [e["EventId"] for e in parsed["Entries"] if e.get("EventId")]
+        return {"info": {"messageIds": message_ids}}
+
 
 class ApiGatewayV2Parser(ServerlessAWSParser):
     # API-GW V1 covered by ServerlessAWSParser
@@ -312,9 +360,40 @@ class ApiGatewayV2Parser(ServerlessAWSParser):
         )
 
 
+PARSERS_CACHE_SIZE = 256
+_registered_parsers: List[Tuple[Pattern[str], Type[Parser]]] = []
+_parsers_instances: Dict[Type[Parser], Parser] = {}
+
+
+def register_parser(host_regex: str, parser: Type[Parser]) -> None:
+    """
+    Use this function to parse the http calls to the matching hosts with your own parser.
+    The registered parsers are checked before the built-in ones, the last registered first.
+    Note that the parsers should be stateless, since we reuse a single instance of every parser.
+    """
+    _registered_parsers.insert(0, (re.compile(host_regex), parser))
+    _resolve_parser.cache_clear()
+
+
 def get_parser(url: str, headers: Optional[dict] = None) -> Type[Parser]:
     if should_use_tracer_extension():
         return Parser
+    return _resolve_parser(url, bool(headers and headers.get("x-amzn-requestid")))
+
+
+def get_parser_instance(url: str, headers: Optional[dict] = None) -> Parser:
+    parser_class = get_parser(url, headers)
+    parser = _parsers_instances.get(parser_class)
+    if parser is None:
+        parser = _parsers_instances[parser_class] = parser_class()
+    return parser
+
+
+@lru_cache(maxsize=PARSERS_CACHE_SIZE)
+def _resolve_parser(url: str, has_amzn_request_id: bool) -> Type[Parser]:
+    for host_regex, parser in _registered_parsers:
+        if host_regex.match(url):
+            return parser
     service = safe_split_get(url, ".", 0)
     if service == "dynamodb":
         return DynamoParser
@@ -333,6 +412,6 @@ def get_parser(url: str, headers: Optional[dict] = None) -> Type[Parser]:
         return SqsParser
     elif "execute-api" in url:
         return ApiGatewayV2Parser
-    elif url.endswith("amazonaws.com") or (headers and headers.get("x-amzn-requestid")):
+    elif url.endswith("amazonaws.com") or has_amzn_request_id:
         return ServerlessAWSParser
     return Parser
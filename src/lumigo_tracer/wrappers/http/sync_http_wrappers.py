@@ -13,6 +13,8 @@ from lumigo_tracer.lumigo_utils import (
     ensure_str,
     Configuration,
     lumigo_dumps,
+    lumigo_lazy_dumps,
+    materialize,
     get_size_upper_bound,
     is_error_code,
     get_edge_host,
@@ -21,10 +23,16 @@ from lumigo_tracer.lumigo_utils import (
     EDGE_SUFFIX,
 )
 from lumigo_tracer.spans_container import SpansContainer
-from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest, HttpState
+from lumigo_tracer.wrappers.http.http_data_classes import (
+    HttpRequest,
+    HttpState,
+    HttpBodyAccumulator,
+    BotocoreState,
+    ClaimedAwsCall,
+)
 from collections import namedtuple
 
-from lumigo_tracer.wrappers.http.http_parser import get_parser, HTTP_TYPE
+from lumigo_tracer.wrappers.http.http_parser import get_parser_instance, HTTP_TYPE
 
 _BODY_HEADER_SPLITTER = b"\r\n\r\n"
 _FLAGS_HEADER_SPLITTER = b"\r\n"
@@ -47,16 +55,44 @@ def add_request_event(span_id: Optional[str], parse_params: HttpRequest) -> Dict
     """
     if is_lumigo_edge(parse_params.host):
         return {}
-    parser = get_parser(parse_params.host)()
-    msg = parser.parse_request(parse_params)
+    parser = get_parser_instance(parse_params.host)
+    aws_call = BotocoreState.get_current_call()
+    if aws_call and type(parser) is aws_call.parser:
+        # botocore already gave us the parameters, so we skip the parsing of the body
+        msg = recursive_json_join(
+            aws_call.request_info,
+            super(type(parser), parser).parse_request(parse_params),  # type: ignore
+        )
+    else:
+        aws_call = None
+        msg = parser.parse_request(parse_params)
     if span_id:
         msg["id"] = span_id
     HttpState.previous_request = parse_params
     new_span = SpansContainer.get_span().add_span(msg)
     HttpState.previous_span_id = new_span["id"]
+    if aws_call:
+        if aws_call.span_id:
+            _release_previous_attempt(aws_call)
+        BotocoreState.claim_span(aws_call, new_span["id"])
     return new_span
 
 
+def _release_previous_attempt(aws_call: ClaimedAwsCall) -> None:
+    """
+    botocore retries the call with a new http request, and gives us only the response of the last attempt.
+    The span of the previous attempt is no longer claimed, so we parse its response as a regular http response.
+    """
+    span_id = aws_call.span_id
+    BotocoreState.spans_to_calls.pop(span_id, None)  # type: ignore
+    raw_response, aws_call.raw_response = aws_call.raw_response, None
+    if raw_response:
+        last_event = SpansContainer.get_span().pop_span(span_id)
+        if last_event:
+            host, status_code, headers, body = raw_response
+            _parse_response(last_event, host, status_code, headers, body, last_event.get("ended"))
+
+
 def add_unparsed_request(span_id: Optional[str], parse_params: HttpRequest) -> Optional[Dict]:
     """
     This function handle the case where we got a request the is not fully formatted as we expected,
@@ -73,16 +109,72 @@ def add_unparsed_request(span_id: Optional[str], parse_params: HttpRequest) -> O
             http_info = last_event.get("info", {}).get("httpInfo", {})
             if http_info.get("host") == parse_params.host:
                 if "response" not in http_info:
-                    SpansContainer.get_span().get_span_by_id(span_id)
-                    http_info["request"]["body"] = concat_old_body_to_new(
-                        http_info.get("request", {}).get("body"), parse_params.body
-                    )
-                    if HttpState.previous_span_id == span_id and HttpState.previous_request:
-                        HttpState.previous_request.body += parse_params.body
+                    add_request_body_chunk(span_id, parse_params.body)  # type: ignore
                     return last_event
     return add_request_event(span_id, parse_params)
 
 
+def add_request_body_chunk(span_id: str, chunk: bytes) -> None:
+    """
+    The chunks are accumulated raw, and the body is dumped once - when the response arrives or
+        when the spans are reported.
+    """
+    accumulator = HttpState.request_bodies.get(span_id)
+    if not accumulator:
+        span = SpansContainer.get_span().get_span_by_id(span_id)
+        if not span:
+            return
+        if HttpState.previous_span_id == span_id and HttpState.previous_request:
+            body = HttpState.previous_request.body
+        else:
+            old_body = materialize(
+                span.get("info", {}).get("httpInfo", {}).get("request", {}).get("body")
+            )
+            if old_body and old_body.endswith(TRUNCATE_SUFFIX):
+                return
+            body = (old_body or "").encode().strip(b'"')
+        accumulator = HttpBodyAccumulator(get_size_upper_bound(), body)
+        HttpState.request_bodies[span_id] = accumulator
+        SpansContainer.get_span().add_span_finalizer(
+            f"{span_id}_request_body", lambda: _finalize_request_body(span_id)
+        )
+    accumulator.append(chunk)
+
+
+def add_response_body_chunk(span_id: Optional[str], chunk: bytes) -> bool:
+    """
+    :return: False if the response of this span was not parsed yet.
+    """
+    accumulator = HttpState.response_bodies.get(span_id) if span_id else None
+    if not accumulator:
+        return False
+    accumulator.append(chunk)
+    return True
+
+
+def _finalize_request_body(span_id: Optional[str]) -> None:
+    accumulator = HttpState.request_bodies.pop(span_id, None) if span_id else None
+    if accumulator is None:
+        return  # the body was already finalized, don't mark the span as changed
+    span = SpansContainer.get_span().get_span_by_id(span_id)
+    if span:
+        body = accumulator.getvalue()
+        span["info"]["httpInfo"]["request"]["body"] = lumigo_lazy_dumps(body)
+        if HttpState.previous_span_id == span_id and HttpState.previous_request:
+            HttpState.previous_request.body = body
+
+
+def _finalize_response_body(span_id: str, host: str, status_code: int, headers: dict) -> None:
+    accumulator = HttpState.response_bodies.pop(span_id, None)
+    if not accumulator or not accumulator.ended:
+        return  # no chunks since the response was parsed
+    last_event = SpansContainer.get_span().pop_span(span_id)
+    if last_event:
+        _parse_response(
+            last_event, host, status_code, headers, accumulator.getvalue(), accumulator.ended
+        )
+
+
 def update_event_response(
     span_id: str, host: Optional[str], status_code: int, headers: dict, body: bytes
 ) -> str:
@@ -93,34 +185,70 @@ def update_event_response(
     """
     if is_lumigo_edge(host):
         return span_id
+    if not host and add_response_body_chunk(span_id, body):
+        return span_id
+    _finalize_request_body(span_id)
+    HttpState.response_bodies.pop(span_id, None)
     last_event = SpansContainer.get_span().pop_span(span_id)
     if last_event:
         http_info = last_event.get("info", {}).get("httpInfo", {})
         if not host:
             host = http_info.get("host", "unknown")
-        old_body = http_info.get("response", {}).get("body")
-        if old_body:
-            body = concat_old_body_to_new(old_body, body).encode()
-
-        has_error = is_error_code(status_code)
-        max_size = Configuration.get_max_entry_size(has_error)
-        headers = {k.lower(): v for k, v in headers.items()} if headers else {}
-        parser = get_parser(host, headers)()  # type: ignore
-        if has_error:
-            _update_request_data_increased_size_limit(http_info, max_size)
-        update = parser.parse_response(  # type: ignore
-            host, status_code, headers, body  # type: ignore
+            old_body = materialize(http_info.get("response", {}).get("body"))
+            if old_body:
+                body = concat_old_body_to_new(old_body, body).encode()
+        new_span_id = _parse_response(last_event, host, status_code, headers, body)  # type: ignore
+        HttpState.response_bodies[new_span_id] = HttpBodyAccumulator(get_size_upper_bound(), body)
+        SpansContainer.get_span().add_span_finalizer(
+            f"{new_span_id}_response_body",
+            lambda: _finalize_response_body(new_span_id, host, status_code, headers),  # type: ignore
         )
-        SpansContainer.get_span().add_span(recursive_json_join(update, last_event))
-        return update.get("id", span_id)
+        return new_span_id
     return span_id
 
 
+def _parse_response(
+    last_event: dict,
+    host: str,
+    status_code: int,
+    headers: dict,
+    body: bytes,
+    ended: Optional[int] = None,
+) -> str:
+    http_info = last_event.get("info", {}).get("httpInfo", {})
+    has_error = is_error_code(status_code)
+    max_size = Configuration.get_max_entry_size(has_error)
+    headers = {k.lower(): v for k, v in headers.items()} if headers else {}
+    parser = get_parser_instance(host, headers)
+    if has_error:
+        _update_request_data_increased_size_limit(http_info, max_size)
+    aws_call = BotocoreState.spans_to_calls.get(last_event["id"])
+    if aws_call and type(parser) is aws_call.parser:
+        # botocore parses the response, see the botocore wrapper
+        update = recursive_json_join(
+            aws_call.response_info,
+            super(type(parser), parser).parse_response(  # type: ignore
+                host, status_code, headers, body
+            ),
+        )
+        aws_call.raw_response = (host, status_code, headers, body)
+    else:
+        aws_call = None
+        update = parser.parse_response(host, status_code, headers, body)
+    if ended:
+        update["ended"] = ended
+    SpansContainer.get_span().add_span(recursive_json_join(update, last_event))
+    new_span_id = update.get("id", last_event["id"])
+    if aws_call:
+        BotocoreState.claim_span(aws_call, new_span_id)
+    return new_span_id
+
+
 def _update_request_data_increased_size_limit(http_info: dict, max_size: int) -> None:
     if not HttpState.previous_request or not http_info.get("request"):
         return
     if not HttpState.previous_request.body.startswith(
-        http_info["request"].get("body", "").encode()[: len(TRUNCATE_SUFFIX)]
+        materialize(http_info["request"].get("body", "")).encode()[: len(TRUNCATE_SUFFIX)]
     ):
         return  # this is a different request (non-sync case)
     http_info["request"].update(
@@ -163,6 +291,8 @@ def _http_send_wrapper(func, instance, args, kwargs):
     This is the wrapper of the requests. it parses the http's message to conclude the url, headers, and body.
     Finally, it add an event to the span, and run the wrapped function (http.client.HTTPConnection.send).
     """
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     data = safe_get_list(args, 0)
     with lumigo_safe_execute("parse requested streams"):
         if hasattr(data, "read"):
@@ -240,6 +370,8 @@ def _headers_reminder_wrapper(func, instance, args, kwargs):
     This is the wrapper of the function `http.client.HTTPConnection.request` that gets the headers.
     Remember the headers helps us to improve performances on requests that use this flow.
     """
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     with lumigo_safe_execute("add hooked data"):
         setattr(
             instance,
@@ -256,6 +388,8 @@ def _requests_wrapper(func, instance, args, kwargs):
         which creates a gap from the traditional http.client wrapping.
     Moreover, these "extra" steps may raise exceptions. We should attach the error to the http span.
     """
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     start_time = datetime.now()
     try:
         ret_val = func(*args, **kwargs)
@@ -295,6 +429,8 @@ def _response_wrapper(func, instance, args, kwargs):
     This is the wrapper of the function that can be called only after that the http request was sent.
     Note that we don't examine the response data because it may change the original behaviour (ret_val.peek()).
     """
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     ret_val = func(*args, **kwargs)
     with lumigo_safe_execute("parse response"):
         span_id = HttpState.request_id_to_span_id.get(get_lumigo_connection_id(instance))
@@ -311,6 +447,8 @@ def _read_wrapper(func, instance, args, kwargs):
     """
     This is the wrapper of the function that can be called only after `getresponse` was called.
     """
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     ret_val = func(*args, **kwargs)
     if ret_val:
         with lumigo_safe_execute("parse response.read"):
@@ -322,6 +460,8 @@ def _read_wrapper(func, instance, args, kwargs):
 
 
 def _read_stream_wrapper(func, instance, args, kwargs):
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     ret_val = func(*args, **kwargs)
     return _read_stream_wrapper_generator(ret_val, instance)
 
@@ -5,7 +5,9 @@ from lumigo_tracer.lumigo_utils import (
     lumigo_safe_execute,
     get_logger,
     lumigo_dumps,
+    lumigo_lazy_dumps,
     get_current_ms_time,
+    InvocationScopedDict,
 )
 from lumigo_tracer.spans_container import SpansContainer
 
@@ -19,10 +21,12 @@ if not monitoring:
 else:
 
     class LumigoMongoMonitoring(monitoring.CommandListener):  # type: ignore
-        request_to_span_id: Dict[str, str] = {}
+        request_to_span_id: Dict[str, str] = InvocationScopedDict()
         MONGO_SPAN = "mongoDb"
 
         def started(self, event):
+            if not SpansContainer.get_span().is_sampled:
+                return
             with lumigo_safe_execute("pymongo started"):
                 span_id = str(uuid.uuid4())
                 LumigoMongoMonitoring.request_to_span_id[event.request_id] = span_id
@@ -33,7 +37,7 @@ else:
                         "started": get_current_ms_time(),
                         "databaseName": event.database_name,
                         "commandName": event.command_name,
-                        "request": lumigo_dumps(event.command),
+                        "request": lumigo_lazy_dumps(event.command),
                         "mongoRequestId": event.request_id,
                         "mongoOperationId": event.operation_id,
                         "mongoConnectionId": event.connection_id,
@@ -41,6 +45,8 @@ else:
                 )
 
         def succeeded(self, event):
+            if not SpansContainer.get_span().is_sampled:
+                return
             with lumigo_safe_execute("pymongo succeed"):
                 if event.request_id not in LumigoMongoMonitoring.request_to_span_id:
                     get_logger().warning("Mongo span ended without a record on its start")
@@ -50,11 +56,13 @@ else:
                 span.update(
                     {
                         "ended": span["started"] + (event.duration_micros / 1000),
-                        "response": lumigo_dumps(event.reply),
+                        "response": lumigo_lazy_dumps(event.reply),
                     }
                 )
 
         def failed(self, event):
+            if not SpansContainer.get_span().is_sampled:
+                return
             with lumigo_safe_execute("pymongo failed"):
                 if event.request_id not in LumigoMongoMonitoring.request_to_span_id:
                     get_logger().warning("Mongo span ended without a record on its start")
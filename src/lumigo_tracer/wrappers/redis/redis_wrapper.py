@@ -9,6 +9,7 @@ from lumigo_tracer.lumigo_utils import (
     get_logger,
     lumigo_dumps,
     get_current_ms_time,
+    LazyDump,
 )
 from lumigo_tracer.spans_container import SpansContainer
 
@@ -28,7 +29,7 @@ def command_started(
             "type": REDIS_SPAN,
             "started": get_current_ms_time(),
             "requestCommand": command,
-            "requestArgs": lumigo_dumps(copy.deepcopy(request_args)),
+            "requestArgs": LazyDump(lumigo_dumps, copy.deepcopy(request_args)),
             "connectionOptions": {"host": host, "port": port},
         }
     )
@@ -42,7 +43,10 @@ def command_finished(span_id: str, ret_val: Dict):
             get_logger().warning("Redis span ended without a record on its start")
             return
         span.update(
-            {"ended": get_current_ms_time(), "response": lumigo_dumps(copy.deepcopy(ret_val))}
+            {
+                "ended": get_current_ms_time(),
+                "response": LazyDump(lumigo_dumps, copy.deepcopy(ret_val)),
+            }
         )
 
 
@@ -58,6 +62,8 @@ def command_failed(span_id: str, exception: Exception):
 
 
 def execute_command_wrapper(func, instance, args, kwargs):
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     span_id = None
     with lumigo_safe_execute("redis start"):
         command = args[0] if args else None
@@ -74,6 +80,8 @@ def execute_command_wrapper(func, instance, args, kwargs):
 
 
 def execute_wrapper(func, instance, args, kwargs):
+    if not SpansContainer.get_span().is_sampled:
+        return func(*args, **kwargs)
     span_id = None
     with lumigo_safe_execute("redis start"):
         commands = instance.command_stack
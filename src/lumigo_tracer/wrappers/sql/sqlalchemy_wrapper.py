@@ -8,6 +8,7 @@ from lumigo_tracer.lumigo_utils import (
     lumigo_safe_execute,
     get_logger,
     lumigo_dumps,
+    lumigo_lazy_dumps,
     get_current_ms_time,
 )
 from lumigo_tracer.spans_container import SpansContainer
@@ -24,6 +25,8 @@ _last_span_id: Optional[str] = None
 
 def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
     global _last_span_id
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("handle sqlalchemy before execute"):
         _last_span_id = str(uuid.uuid4())
         SpansContainer.get_span().add_span(
@@ -37,13 +40,15 @@ def _before_cursor_execute(conn, cursor, statement, parameters, context, execute
                     "database": conn.engine.url.database,
                     "user": conn.engine.url.username,
                 },
-                "query": lumigo_dumps(statement),
-                "values": lumigo_dumps(parameters),
+                "query": lumigo_lazy_dumps(statement),
+                "values": lumigo_lazy_dumps(parameters),
             }
         )
 
 
 def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("handle sqlalchemy after execute"):
         span = SpansContainer.get_span().get_span_by_id(_last_span_id)
         if not span:
@@ -53,6 +58,8 @@ def _after_cursor_execute(conn, cursor, statement, parameters, context, executem
 
 
 def _handle_error(context):
+    if not SpansContainer.get_span().is_sampled:
+        return
     with lumigo_safe_execute("handle sqlalchemy error"):
         span = SpansContainer.get_span().get_span_by_id(_last_span_id)
         if not span:
@@ -0,0 +1,28 @@
+import logging
+
+import pytest
+
+from lumigo_tracer import lumigo_utils
+from lumigo_tracer.lumigo_utils import config, get_edge_host, get_logger
+from .edge_server import LocalEdge
+
+
+@pytest.fixture(scope="session")
+def local_edge():
+    with LocalEdge() as edge:
+        yield edge
+
+
+@pytest.fixture
+def report_to_local_edge(monkeypatch, local_edge, token):
+    """
+    This fixture sends the spans to the local edge, and keeps the logger quiet so it won't be measured.
+    """
+    local_edge.latency = local_edge.error_rate = local_edge.timeout_rate = 0
+    config(edge_host=local_edge.host, should_report=True, token=token)
+    get_edge_host.cache_clear()
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    get_logger().setLevel(logging.WARNING)
+    local_edge.reset_stats()
+    yield local_edge
+    get_edge_host.cache_clear()
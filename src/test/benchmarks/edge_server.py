@@ -0,0 +1,154 @@
+"""
+A local stand-in for the lumigo edge, to measure the reporting path without the real edge.
+
+Run it standalone and point the tracer to it with `LUMIGO_TRACER_HOST=http://127.0.0.1:<port>`:
+    python -m test.benchmarks.edge_server --port 8080 --latency 0.05 --error-rate 0.1
+"""
+import argparse
+import gzip
+import json
+import random
+import ssl
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import List, Optional
+
+from lumigo_tracer.lumigo_utils import EDGE_PATH
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalEdge:
+    """
+    :param latency: Seconds to wait before every response.
+    :param error_rate: The fraction of the requests that get `error_status`.
+    :param timeout_rate: The fraction of the requests that never get a response (until the server stops).
+    :param certfile: Serve https with this certificate (and `keyfile`). Otherwise, serve plain http.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        error_rate: float = 0,
+        error_status: int = 500,
+        timeout_rate: float = 0,
+        certfile: Optional[str] = None,
+        keyfile: Optional[str] = None,
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.requests_count = 0
+        self.bytes_received = 0
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = _ThreadingHTTPServer(("127.0.0.1", port), self._create_handler())
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            self.scheme = "https"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"{self.scheme}://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "LocalEdge":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests_count = 0
+            self.bytes_received = 0
+            self.spans = []
+
+    def __enter__(self) -> "LocalEdge":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _record(self, body: bytes, encoding: Optional[str]) -> None:
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        payload = json.loads(body)
+        spans = payload["spans"] if isinstance(payload, dict) else payload
+        with self._lock:
+            self.spans.extend(spans)
+
+    def _create_handler(self):
+        edge = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with edge._lock:
+                    edge.requests_count += 1
+                    edge.bytes_received += len(body)
+                if self.path == EDGE_PATH:
+                    edge._record(body, self.headers.get("Content-Encoding"))
+                if random.random() < edge.timeout_rate:
+                    edge._stopped.wait()
+                    return
+                time.sleep(edge.latency)
+                status = edge.error_status if random.random() < edge.error_rate else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the lumigo edge")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--timeout-rate", type=float, default=0)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+    edge = LocalEdge(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        timeout_rate=args.timeout_rate,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        port=args.port,
+    )
+    print(f"Listening on {edge.host}")
+    edge.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        edge.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+from lumigo_tracer.spans_container import SpansContainer
+from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
+from lumigo_tracer.wrappers.http.sync_http_wrappers import add_request_event, update_event_response
+
+pytestmark = pytest.mark.benchmark
+
+ITERATIONS = 5000
+
+
+class _CountingEnviron(dict):
+    reads = 0
+
+    def __getitem__(self, key):
+        _CountingEnviron.reads += 1
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        _CountingEnviron.reads += 1
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        _CountingEnviron.reads += 1
+        return super().__contains__(key)
+
+
+def _http_call(index: int) -> None:
+    request = HttpRequest(
+        host="api.example.com",
+        method="POST",
+        uri=f"api.example.com/orders/{index}",
+        headers={"content-type": "application/json"},
+        body=b'{"order": 1}',
+    )
+    span = add_request_event(None, request)
+    update_event_response(span["id"], request.host, 200, {"content-length": "2"}, b"{}")
+
+
+def test_http_call_instrumentation_overhead(monkeypatch, capsys):
+    SpansContainer.create_span(is_new_invocation=True)
+    # warm the caches (a finished span is encoded when the next one starts)
+    _http_call(0)
+    _http_call(1)
+    monkeypatch.setattr(os, "environ", _CountingEnviron(os.environ))
+
+    start = time.process_time()
+    for index in range(ITERATIONS):
+        _http_call(index)
+    per_call = (time.process_time() - start) / ITERATIONS
+
+    with capsys.disabled():
+        print(
+            f"\nhttp call instrumentation: {per_call * 1e6:.1f}us per call, "
+            f"{_CountingEnviron.reads / ITERATIONS:.1f} environment reads per call"
+        )
+    assert _CountingEnviron.reads == 0
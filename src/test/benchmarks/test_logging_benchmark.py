@@ -0,0 +1,41 @@
+import logging
+import time
+
+import pytest
+
+from lumigo_tracer import lumigo_utils
+from lumigo_tracer.lumigo_utils import Configuration, get_logger, report_json
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.dont_mock_lumigo_utils_reporter]
+
+ITERATIONS = 2000
+
+
+def _measure_report_json(span_size: int) -> float:
+    msgs = [{"id": str(i), "body": "x" * span_size, "info": {"a": [1] * 100}} for i in range(10)]
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        report_json(region="us-east-1", msgs=msgs)
+    return (time.process_time() - start) / ITERATIONS
+
+
+def test_report_json_overhead_with_debug_off(monkeypatch, capsys):
+    """
+    With the debug logs off, the overhead of `report_json` (without building and sending the payloads)
+        should not depend on the size of the spans.
+    """
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(lumigo_utils, "_create_payloads", lambda msgs, base_msg: [b"{}"])
+    monkeypatch.setattr(lumigo_utils, "_send_to_edge", lambda *args, **kwargs: 0)
+    monkeypatch.setattr(lumigo_utils, "is_debug_enabled", lambda: False)
+    get_logger().setLevel(logging.CRITICAL)
+
+    small = _measure_report_json(span_size=10)
+    big = _measure_report_json(span_size=1_000_000)
+
+    with capsys.disabled():
+        print(
+            f"\nreport_json overhead: {small * 1e6:.1f}us with small spans, "
+            f"{big * 1e6:.1f}us with 1MB spans"
+        )
+    assert big < small * 2
@@ -0,0 +1,103 @@
+import json
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Tuple
+
+import pytest
+
+from lumigo_tracer.spans_container import SpansContainer
+from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
+from lumigo_tracer.wrappers.http.sync_http_wrappers import add_request_event, update_event_response
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.dont_mock_lumigo_utils_reporter]
+
+ITERATIONS = 5
+EVENT = {"requestContext": {"requestId": "123"}, "body": json.dumps({"items": list(range(50))})}
+
+
+def _dynamo_call(index: int):
+    body = json.dumps({"TableName": "users", "Key": {"id": {"S": str(index)}}}).encode()
+    request = HttpRequest(
+        host="dynamodb.us-east-1.amazonaws.com",
+        method="POST",
+        uri="dynamodb.us-east-1.amazonaws.com/",
+        headers={"x-amz-target": "DynamoDB_20120810.GetItem", "content-type": "application/json"},
+        body=body,
+    )
+    response = json.dumps({"Item": {"id": {"S": str(index)}, "name": {"S": "x" * 200}}}).encode()
+    return request, 200, response
+
+
+def _api_call(index: int):
+    request = HttpRequest(
+        host="api.example.com",
+        method="POST",
+        uri=f"api.example.com/orders/{index}",
+        headers={"content-type": "application/json", "authorization": "Bearer token"},
+        body=json.dumps({"order": index, "items": [{"sku": "a" * 20, "amount": 3}] * 5}).encode(),
+    )
+    status_code = 500 if index % 50 == 0 else 200
+    return request, status_code, json.dumps({"status": "ok", "id": index}).encode()
+
+
+def _run_invocation(spans_count: int) -> Tuple[float, float]:
+    """
+    :return: The CPU and wall times (in seconds) of the end of the invocation, that includes the reporting.
+    """
+    context = SimpleNamespace(aws_request_id="1234", get_remaining_time_in_millis=lambda: 1000 * 60)
+    SpansContainer.create_span(EVENT, context, is_new_invocation=True)
+    SpansContainer.get_span().start(EVENT, context)
+    for index in range(spans_count):
+        request, status_code, response = (_dynamo_call if index % 2 else _api_call)(index)
+        span = add_request_event(None, request)
+        update_event_response(span["id"], request.host, status_code, request.headers, response)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    SpansContainer.get_span().end({"statusCode": 200, "body": "ok"}, EVENT, context)
+    return time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+def _report(capsys, title: str, edge, results):
+    cpu_times, wall_times = zip(*results)
+    with capsys.disabled():
+        print(
+            f"\n{title}: cpu {statistics.median(cpu_times) * 1000:.2f}ms, "
+            f"wall {statistics.median(wall_times) * 1000:.2f}ms, "
+            f"{edge.bytes_received // ITERATIONS} bytes in "
+            f"{edge.requests_count / ITERATIONS:.1f} requests per invocation"
+        )
+
+
+@pytest.mark.parametrize("spans_count", [10, 200, 2000])
+def test_end_of_invocation_reporting(capsys, report_to_local_edge, spans_count):
+    results = [_run_invocation(spans_count) for _ in range(ITERATIONS)]
+
+    _report(capsys, f"{spans_count} spans", report_to_local_edge, results)
+    assert report_to_local_edge.spans
+
+
+@pytest.mark.parametrize(
+    "latency, error_rate", [(0.05, 0), (0, 1)], ids=["slow_edge", "failing_edge"]
+)
+def test_end_of_invocation_reporting_degraded_edge(
+    capsys, report_to_local_edge, latency, error_rate
+):
+    report_to_local_edge.latency = latency
+    report_to_local_edge.error_rate = error_rate
+
+    results = [_run_invocation(200) for _ in range(ITERATIONS)]
+
+    _report(
+        capsys, f"200 spans, latency {latency}s, errors {error_rate}", report_to_local_edge, results
+    )
+    assert report_to_local_edge.requests_count >= ITERATIONS
+
+
+def test_end_of_invocation_reporting_edge_timeout(capsys, report_to_local_edge):
+    report_to_local_edge.timeout_rate = 1
+
+    results = [_run_invocation(200) for _ in range(ITERATIONS)]
+
+    _report(capsys, "200 spans, edge timeout", report_to_local_edge, results)
+    # After the first timeout, the tracer skips the edge until the cooldown is over
+    assert report_to_local_edge.requests_count == 1
@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+from lumigo_tracer.spans_container import SignalTimer, WatchdogTimer
+
+pytestmark = pytest.mark.benchmark
+
+ITERATIONS = 20000
+
+
+def _start_stop_cost(timer) -> float:
+    timer.start(60, lambda *args: None)  # warm up (the watchdog creates its thread once)
+    timer.stop()
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        timer.start(60, lambda *args: None)
+        timer.stop()
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+@pytest.mark.parametrize("timer", [SignalTimer, WatchdogTimer])
+def test_timeout_timer_start_stop_overhead(timer, capsys):
+    per_invocation = _start_stop_cost(timer)
+
+    with capsys.disabled():
+        print(f"\n{timer.__name__} start+stop: {per_invocation * 1e6:.1f}us per invocation")
+    assert not timer.is_activated()
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from lumigo_tracer.libs import xmltodict
+from lumigo_tracer.parsing_utils import safe_get
+from lumigo_tracer.wrappers.http.http_parser import SqsParser
+
+pytestmark = pytest.mark.benchmark
+
+ITERATIONS = 500
+ENTRY = (
+    "<SendMessageBatchResultEntry><Id>{index}</Id><MessageId>message-{index}</MessageId>"
+    "<MD5OfMessageBody>0e024d309850c78cba5eabbeff7cae71</MD5OfMessageBody>"
+    "</SendMessageBatchResultEntry>"
+)
+ENTRIES = "".join(ENTRY.format(index=i) for i in range(1000))
+BATCH_RESPONSE = (
+    '<SendMessageBatchResponse xmlns="http://queue.amazonaws.com/doc/2012-11-05/">'
+    f"<SendMessageBatchResult>{ENTRIES}</SendMessageBatchResult>"
+    "<ResponseMetadata><RequestId>request-id</RequestId></ResponseMetadata>"
+    "</SendMessageBatchResponse>"
+).encode()
+
+
+def _measure(func) -> float:
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        assert func(BATCH_RESPONSE) == "message-0"
+    return (time.process_time() - start) / ITERATIONS
+
+
+def test_sqs_batch_message_id_extraction(capsys):
+    with_tree = _measure(
+        lambda body: safe_get(
+            xmltodict.parse(body),
+            ["SendMessageBatchResponse", "SendMessageBatchResult", "SendMessageBatchResultEntry"],
+        )[0]["MessageId"]
+    )
+    streaming = _measure(SqsParser._extract_message_id)
+
+    with capsys.disabled():
+        print(
+            f"\nsqs batch message id: {with_tree * 1e6:.0f}us with the full tree, "
+            f"{streaming * 1e6:.0f}us with the streaming extraction"
+        )
+    assert streaming < with_tree
@@ -15,8 +15,8 @@ from lumigo_tracer.lumigo_utils import (
     get_edge_host,
     InternalState,
 )
-from lumigo_tracer.spans_container import SpansContainer
-from lumigo_tracer.wrappers.http.http_data_classes import HttpState
+from lumigo_tracer.spans_container import SpansContainer, TailSampler, WatchdogTimer
+from lumigo_tracer.wrappers.http.http_data_classes import HttpState, BotocoreState
 
 USE_TRACER_EXTENSION = "LUMIGO_USE_TRACER_EXTENSION"
 
@@ -40,6 +40,7 @@ def cancel_timeout_mechanism(monkeypatch):
 @pytest.fixture()
 def with_extension(monkeypatch):
     monkeypatch.setenv(USE_TRACER_EXTENSION, "TRUE")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
 
 
 @pytest.fixture(autouse=True)
@@ -57,7 +58,10 @@ def restart_global_span():
     yield
     SpansContainer._span = None
     HttpState.clear()
+    BotocoreState.clear()
     InternalState.reset()
+    TailSampler.reset()
+    WatchdogTimer.stop()
 
 
 @pytest.yield_fixture(autouse=True)
@@ -81,15 +85,17 @@ def verbose_logger():
 
 def pytest_addoption(parser):
     parser.addoption("--all", action="store_true", default=False, help="run components tests")
+    parser.addoption("--benchmark", action="store_true", default=False, help="run benchmarks")
 
 
 def pytest_collection_modifyitems(config, items):
-    if config.getoption("--all"):
-        return  # don't skip!
     skip_slow = pytest.mark.skip(reason="need --all option to run")
+    skip_benchmark = pytest.mark.skip(reason="need --benchmark option to run")
     for item in items:
-        if "slow" in item.keywords:
+        if "slow" in item.keywords and not config.getoption("--all"):
             item.add_marker(skip_slow)
+        if item.get_closest_marker("benchmark") and not config.getoption("--benchmark"):
+            item.add_marker(skip_benchmark)
 
 
 @pytest.fixture(autouse=True)
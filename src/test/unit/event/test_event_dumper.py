@@ -416,7 +416,7 @@ def test_parse_event_sqs():
 
 
 def test_parse_event_sqs_with_extension(monkeypatch):
-    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "TRUE")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
     not_order_sqs_event = {
         "Records": [
             {
@@ -8,6 +8,8 @@ from decimal import Decimal
 import datetime
 import http.client
 import socket
+import time
+import zlib
 from unittest.mock import Mock
 
 import boto3
@@ -17,8 +19,13 @@ import pytest
 from lumigo_tracer import lumigo_utils
 from lumigo_tracer.lumigo_utils import (
     _create_request_body,
+    _create_compressed_request_body,
+    _create_request_bodies,
+    _create_payloads,
+    expand_envelope,
     _is_span_has_error,
     _get_event_base64_size,
+    _get_base64_size,
     MAX_VARS_SIZE,
     format_frames,
     _truncate_locals,
@@ -50,6 +57,16 @@ from lumigo_tracer.lumigo_utils import (
     concat_old_body_to_new,
     TRUNCATE_SUFFIX,
     DEFAULT_AUTO_TAG_KEY,
+    BackgroundReporter,
+    SpillJournal,
+    MaskedKeysCache,
+    should_use_tracer_extension,
+    InvocationScopedDict,
+    LazyDump,
+    EncodedSpan,
+    lumigo_lazy_dumps,
+    materialize,
+    aws_dump,
 )
 import json
 
@@ -115,6 +132,71 @@ def test_create_request_body_take_error_first(dummy_span, error_span, function_e
     assert _create_request_body(input, True, size) == json.dumps(expected_result)
 
 
+@pytest.mark.parametrize("prune_size_flag", [True, False])
+def test_create_request_body_always_valid_json(prune_size_flag):
+    spans = [{"id": i, "body": "a" * 100} for i in range(300)]
+
+    result = _create_request_body(spans, prune_size_flag, max_size=1000)
+
+    assert len(result) <= 1000
+    assert 0 < len(json.loads(result)) < 300
+
+
+def test_create_request_body_serialize_each_span_once(monkeypatch):
+    spans = [{"id": i, "body": "a" * 100} for i in range(300)] + [{"error": "Error"}]
+    dump_mock = Mock(side_effect=lumigo_utils.aws_dump)
+    monkeypatch.setattr(lumigo_utils, "aws_dump", dump_mock)
+
+    result = _create_request_body(spans, True, max_size=10_000)
+
+    assert dump_mock.call_count <= len(spans)
+    assert json.loads(result)[0] == {"error": "Error"}
+
+
+@pytest.mark.parametrize("compression, wbits", [("gzip", 31), ("deflate", 15)])
+def test_create_compressed_request_body(compression, wbits, dummy_span, error_span):
+    spans = [dummy_span, error_span, dummy_span]
+
+    result = _create_compressed_request_body(spans, False, compression)
+
+    assert zlib.decompress(result, wbits) == json.dumps(spans).encode()
+
+
+def test_create_compressed_request_body_budget_on_compressed_size(error_span, function_end_span):
+    spans = [{"id": i, "body": "a" * 1000} for i in range(300)] + [error_span, function_end_span]
+    max_size = 10_000
+
+    result = _create_compressed_request_body(spans, True, "gzip", max_size=max_size)
+
+    assert len(result) <= max_size
+    sent_spans = json.loads(zlib.decompress(result, 31))
+    assert sent_spans[:2] == [function_end_span, error_span]
+    assert len(sent_spans) > len(json.loads(_create_request_body(spans, True, max_size)))
+
+
+def test_report_json_with_compression(monkeypatch, reporter_mock):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "compression_host")
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "edge_compression", "gzip")
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("compression_host")
+    connection.host = "compression_host"
+
+    report_json(None, [{"a": "b"}])
+
+    _, _, body = connection.request.call_args[0]
+    assert connection.request.call_args[1]["headers"]["Content-Encoding"] == "gzip"
+    assert zlib.decompress(body, 31) == b'[{"a": "b"}]'
+
+
+def test_config_edge_compression_unsupported(monkeypatch, capsys):
+    monkeypatch.setenv("LUMIGO_EDGE_COMPRESSION", "brotli")
+    config()
+    assert Configuration.edge_compression is None
+    assert "Unsupported edge compression" in capsys.readouterr().out
+
+
 @pytest.mark.parametrize(
     ("f_locals", "expected"),
     [
@@ -279,6 +361,94 @@ def test_lumigo_dumps(value, output):
     assert lumigo_dumps(value, max_size=100) == output
 
 
+@pytest.mark.parametrize("max_size", [1, 10, 37, 100, 1000])
+def test_lumigo_dumps_is_a_prefix_of_the_full_dump(max_size):
+    value = {"a": [1, 2.5, None, True, {"b": "é" * 20, "password": "p"}], "c": {"d": "e" * 30}}
+    full = json.dumps(
+        {"a": [1, 2.5, None, True, {"b": "é" * 20, "password": "****"}], "c": {"d": "e" * 30}}
+    )
+
+    result = lumigo_dumps(value, max_size=max_size)
+
+    if len(full) < max_size:
+        assert result == full
+    else:
+        assert result == full[:max_size] + TRUNCATE_SUFFIX
+
+
+def test_lumigo_dumps_big_value_cost_is_bounded():
+    value = {"body": "a" * 6_000_000, "items": [{"key": i} for i in range(100_000)]}
+
+    start_time = time.time()
+    result = lumigo_dumps(value, max_size=2048)
+
+    assert time.time() - start_time < 0.05
+    assert result == '{"body": "' + "a" * 2038 + TRUNCATE_SUFFIX
+
+
+def test_lumigo_dumps_self_reference():
+    value = {"a": "b"}
+    value["self"] = value
+
+    assert lumigo_dumps(value, max_size=30) == '{"a": "b", "self": {"a": "b", ' + TRUNCATE_SUFFIX
+
+
+def test_lumigo_dumps_parses_only_the_root_list_items():
+    assert lumigo_dumps(['{"x": 1}', ['{"x": 1}']], max_size=100) == '[{"x": 1}, ["{\\"x\\": 1}"]]'
+
+    result = lumigo_dumps({"c": ['{"x": 1}'], "d": ['{"x": 1}']}, max_size=100)
+
+    assert result == '{"c": ["{\\"x\\": 1}"], "d": ["{\\"x\\": 1}"]}'
+
+
+def test_lumigo_dumps_unsupported_keys_fallback():
+    assert lumigo_dumps({(1, 2): "a"}, max_size=100) == "{(1, 2): 'a'}"
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"a": "b" * 10_000},
+        {"password": "p", "a": [1, -2.5e-3, None, True, "é😀\\n"] * 1000},
+        {"a": {"key": "v", "b": {"c": 1}}, "list": list(range(10_000))},
+        {"Key": "v", "a": {"key": "v"}, "b": "b" * 10_000},
+    ],
+)
+@pytest.mark.parametrize("encode", [True, False])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_lumigo_dumps_big_body_window(monkeypatch, value, encode, indent):
+    body = json.dumps(value, indent=indent, ensure_ascii=False)
+    body = body.encode() if encode else body
+    expected = lumigo_dumps(json.loads(body), max_size=100, omit_skip_path=["Key"])
+    decode_mock = Mock(side_effect=json.loads)
+    monkeypatch.setattr(json, "loads", decode_mock)
+
+    assert lumigo_dumps(body, max_size=100, omit_skip_path=["Key"]) == expected
+    decode_mock.assert_not_called()
+
+
+def test_lumigo_dumps_big_body_window_too_small():
+    body = json.dumps({"password": "p" * 10_000, "a": "b"}).encode()
+
+    assert lumigo_dumps(body, max_size=100) == '{"password": "****", "a": "b"}'
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (b"\xff" + b"a" * 10_000, "\"b'\\\\xffaaa"),  # Not utf-8
+        (b"{'a': 1}" + b"a" * 10_000, "\"{'a': 1}aaa"),  # Not json
+        ("a" * 10_000, '"aaa'),
+    ],
+)
+def test_lumigo_dumps_big_body_not_json(body, expected):
+    result = lumigo_dumps(body, max_size=20)
+
+    assert result.startswith(expected)
+    assert result.endswith(TRUNCATE_SUFFIX)
+    assert len(result) == 20 + len(TRUNCATE_SUFFIX)
+
+
 def test_lumigo_dumps_fails_on_non_jsonable():
     with pytest.raises(TypeError):
         lumigo_utils({"set"})
@@ -339,6 +509,35 @@ def test_lumigo_dumps_omit_keys_environment(monkeypatch):
     assert lumigo_dumps(value, max_size=100) == '{"password": "abc", "evilPlan": "****"}'
 
 
+def test_lazy_dump_dumped_once_when_reported():
+    dump_function = Mock(return_value='{"a": "b"}')
+    lazy = LazyDump(dump_function, {"a": "b"}, max_size=100)
+    span = {"id": "1", "request": lazy}
+    assert not dump_function.called
+
+    assert json.loads(aws_dump(span)) == {"id": "1", "request": '{"a": "b"}'}
+    assert materialize(span) == {"id": "1", "request": '{"a": "b"}'}
+    assert lazy == '{"a": "b"}'
+    dump_function.assert_called_once_with({"a": "b"}, max_size=100)
+
+
+def test_lumigo_lazy_dumps_snapshot_of_the_value():
+    value = {"password": "abc", "a": "b"}
+    lazy = lumigo_lazy_dumps(value, max_size=100)
+    value["a"] = "changed"
+
+    assert isinstance(lazy, LazyDump)
+    assert materialize(lazy) == '{"password": "****", "a": "b"}'
+
+
+def test_lumigo_lazy_dumps_nested_values_dumped_now():
+    value = {"a": {"b": "c"}}
+    dumped = lumigo_lazy_dumps(value, max_size=100)
+    value["a"]["b"] = "changed"
+
+    assert dumped == '{"a": {"b": "c"}}'
+
+
 def test_format_frame():
     try:
         a = "A"  # noqa F841
@@ -379,6 +578,41 @@ def test_get_omitting_regexes_fallback(monkeypatch):
     assert get_omitting_regex().pattern == expected
 
 
+def test_masked_keys_cache_invalidated_on_regex_change(monkeypatch):
+    assert lumigo_dumps({"password": "abc", "evilPlan": 1}) == '{"password": "****", "evilPlan": 1}'
+    assert MaskedKeysCache.keys["password"] is True
+    assert MaskedKeysCache.keys["evilPlan"] is False
+
+    monkeypatch.setenv(LUMIGO_SECRET_MASKING_REGEX, '[".*evilPlan.*"]')
+    config()
+    result = lumigo_dumps({"password": "abc", "evilPlan": 1})
+
+    assert result == '{"password": "abc", "evilPlan": "****"}'
+    assert MaskedKeysCache.keys["password"] is False
+    assert MaskedKeysCache.keys["evilPlan"] is True
+
+
+def test_masked_keys_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(lumigo_utils, "MASKED_KEYS_CACHE_SIZE", 10)
+
+    lumigo_dumps({f"key{i}": i for i in range(25)}, max_size=1000)
+
+    assert len(MaskedKeysCache.keys) <= 10
+
+
+def test_invocation_scoped_dict_keeps_the_most_recent_items():
+    mapping = InvocationScopedDict(max_size=3)
+    for i in range(5):
+        mapping[i] = str(i)
+    mapping[2] = "updated"
+    mapping[5] = "5"
+
+    assert list(mapping.items()) == [(4, "4"), (2, "updated"), (5, "5")]
+
+    InvocationScopedDict.clear_all()
+    assert not mapping
+
+
 def test_omit_keys_environment(monkeypatch):
     monkeypatch.setenv(LUMIGO_SECRET_MASKING_REGEX, '[".*evilPlan.*"]')
     value = {"password": "abc", "evilPlan": {"take": "over", "the": "world"}}
@@ -429,6 +663,29 @@ def test_config_timeout_timer_buffer_with_exception(monkeypatch):
     assert Configuration.timeout_timer_buffer is None
 
 
+@pytest.mark.parametrize(
+    "env, expected",
+    [(None, "thread"), ("signal", "signal"), ("THREAD", "thread"), ("other", "thread")],
+)
+def test_config_timeout_mechanism(monkeypatch, env, expected):
+    if env:
+        monkeypatch.setenv("LUMIGO_TIMEOUT_MECHANISM", env)
+    config()
+    assert Configuration.timeout_mechanism == expected
+
+
+def test_config_snapshot_refreshes_only_on_config(monkeypatch):
+    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "true")
+    monkeypatch.setenv("LUMIGO_PRUNE_TRACE_OFF", "true")
+    assert should_use_tracer_extension() is False
+    assert Configuration.prune_trace is True
+
+    config()
+
+    assert should_use_tracer_extension() is True
+    assert Configuration.prune_trace is False
+
+
 def test_warn_client_print(capsys):
     warn_client("message")
     assert capsys.readouterr().out.startswith(f"{WARN_CLIENT_PREFIX}: message")
@@ -436,6 +693,7 @@ def test_warn_client_print(capsys):
 
 def test_warn_client_dont_print(capsys, monkeypatch):
     monkeypatch.setenv("LUMIGO_WARNINGS", "off")
+    config()
     warn_client("message")
     assert capsys.readouterr().out == ""
 
@@ -449,20 +707,61 @@ def test_get_timeout_buffer(remaining_time, conf, expected):
     assert get_timeout_buffer(remaining_time) == expected
 
 
+def test_get_timeout_buffer_from_flush_duration():
+    Configuration.timeout_timer_buffer = None
+    InternalState.mark_flush_duration(0.2)
+    assert get_timeout_buffer(900) == pytest.approx(0.6)
+
+    InternalState.mark_flush_duration(1.2)  # moving average: 0.2 * 1.2 + 0.8 * 0.2
+    assert get_timeout_buffer(900) == pytest.approx(1.2)
+
+    InternalState.mark_flush_duration(20)
+    assert get_timeout_buffer(900) == 3
+    InternalState.reset()
+    InternalState.mark_flush_duration(0.001)
+    assert get_timeout_buffer(900) == 0.5
+
+
+def test_create_request_body_uses_encoded_spans():
+    msgs = [EncodedSpan({"id": "1"}, '{"id": "1", "cached": true}'), {"id": "2"}]
+
+    assert json.loads(_create_request_body(msgs, True)) == [
+        {"id": "1", "cached": True},
+        {"id": "2"},
+    ]
+
+
 @pytest.mark.parametrize(
     ["arg", "host"],
-    [("https://a.com", "a.com"), (f"https://b.com{EDGE_PATH}", "b.com"), ("h.com", "h.com")],
+    [
+        ("https://a.com", "a.com"),
+        (f"https://b.com{EDGE_PATH}", "b.com"),
+        ("h.com", "h.com"),
+        ("http://127.0.0.1:8080", "127.0.0.1:8080"),
+    ],
 )
 def test_get_edge_host(arg, host, monkeypatch):
     monkeypatch.setattr(Configuration, "host", arg)
     assert get_edge_host("region") == host
 
 
+@pytest.mark.parametrize(
+    "host, connection_class",
+    [("http://127.0.0.1:8080", http.client.HTTPConnection), ("a.com", http.client.HTTPSConnection)],
+)
+def test_establish_connection_scheme(monkeypatch, host, connection_class):
+    monkeypatch.setattr(Configuration, "host", host)
+    connection = lumigo_utils.establish_connection(get_edge_host())
+
+    assert type(connection) is connection_class
+    assert lumigo_utils._is_connected_to(connection, get_edge_host())
+
+
 def test_report_json_extension_spans_mode(monkeypatch, reporter_mock, tmpdir):
     extension_dir = tmpdir.mkdir("tmp")
     monkeypatch.setattr(uuid, "uuid4", lambda *args, **kwargs: "span_name")
     monkeypatch.setattr(Configuration, "should_report", True)
-    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "TRUE")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
     monkeypatch.setenv("LUMIGO_EXTENSION_SPANS_DIR_KEY", extension_dir)
     mocked_urandom = MagicMock(hex=MagicMock(return_value="my_mocked_data"))
     monkeypatch.setattr(os, "urandom", lambda *args, **kwargs: mocked_urandom)
@@ -520,6 +819,329 @@ def test_report_json_fast_failure_after_timeout(monkeypatch, reporter_mock, capl
     assert caplog.records[-1].msg == "Timeout while connecting to host"
 
 
+def test_report_json_async_reporting_doesnt_block(monkeypatch, reporter_mock):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "async_host")
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "async_reporting", True)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("async_host")
+    connection.host = "async_host"
+
+    assert report_json(None, [{"a": "b"}]) == 0
+    assert BackgroundReporter.flush(timeout=5) is True
+
+    connection.request.assert_called_once()
+    assert connection.request.call_args[0][2] == b'[{"a": "b"}]'
+
+
+def test_background_reporter_flush_timeout(monkeypatch):
+    sent = []
+
+    def slow_send(region, to_send, **kwargs):
+        time.sleep(0.2)
+        sent.append(to_send)
+
+    monkeypatch.setattr(lumigo_utils, "_send_to_edge", slow_send)
+
+    assert BackgroundReporter.enqueue(None, b"1") is True
+    assert BackgroundReporter.flush(timeout=0.01) is False
+    assert BackgroundReporter.flush(timeout=5) is True
+    assert sent == [b"1"]
+
+
+def test_config_async_reporting_with_envs(monkeypatch):
+    monkeypatch.setenv("LUMIGO_ASYNC_REPORTING", "true")
+    config()
+    assert Configuration.async_reporting is True
+
+
+@pytest.mark.parametrize(
+    "env, expected",
+    [("0.3", 0.3), ("not float", lumigo_utils.DEFAULT_ASYNC_REPORTING_FLUSH_TIMEOUT)],
+)
+def test_config_async_reporting_flush_timeout(monkeypatch, env, expected):
+    monkeypatch.setenv("LUMIGO_ASYNC_REPORTING_FLUSH_TIMEOUT", env)
+    config()
+    assert Configuration.async_reporting_flush_timeout == expected
+
+
+def test_config_spill_journal_invalid_values(monkeypatch):
+    monkeypatch.setenv("LUMIGO_SPILL_MAX_BYTES", "not int")
+    monkeypatch.setenv("LUMIGO_SPILL_DIR", "/tmp/other-spill")
+    config()
+    assert Configuration.spill_max_bytes == lumigo_utils.DEFAULT_SPILL_MAX_BYTES
+    assert Configuration.spill_drain_budget == lumigo_utils.DEFAULT_SPILL_DRAIN_BUDGET
+    assert Configuration.spill_dir == "/tmp/other-spill"
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_create_request_bodies_splits_instead_of_dropping(compression):
+    spans = [{"id": str(i), "a": os.urandom(100).hex()} for i in range(100)]
+    spans.append({"id": "error", "error": "e"})
+    spans.append({"id": "end"})
+
+    bodies = _create_request_bodies(spans, max_size=3000, compression=compression)
+
+    assert len(bodies) > 1
+    decode = (lambda b: zlib.decompress(b, zlib.MAX_WBITS | 16)) if compression else (lambda b: b)
+    requests = [json.loads(decode(body)) for body in bodies]
+    assert all(len(body) < 3000 for body in bodies)
+    assert [s["id"] for s in requests[0][:2]] == ["end", "error"]
+    assert sorted(s["id"] for r in requests for s in r) == sorted(s["id"] for s in spans)
+
+
+def test_create_request_bodies_drops_only_huge_spans():
+    bodies = _create_request_bodies([{"a": "b" * 1000}, {"a": "c"}], max_size=100)
+
+    assert [json.loads(body) for body in bodies] == [[{"a": "c"}]]
+
+
+@pytest.mark.parametrize("edge_connections", [1, 3])
+def test_report_json_chunked_reporting(monkeypatch, reporter_mock, edge_connections):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "chunked_host")
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "chunked_reporting", True)
+    monkeypatch.setattr(Configuration, "edge_connections", edge_connections)
+    monkeypatch.setattr(lumigo_utils, "edge_executor", None)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    http.client.HTTPSConnection("chunked_host").host = "chunked_host"
+
+    report_json(None, [{"id": str(i), "a": "b" * 40_000} for i in range(20)])
+
+    requests = http.client.HTTPSConnection("chunked_host").request.call_args_list
+    assert len(requests) > 1
+    assert len({s["id"] for r in requests for s in json.loads(r.args[2])}) == 20
+
+
+def test_report_json_chunked_reporting_time_budget(monkeypatch, reporter_mock, caplog):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "chunked_host")
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "chunked_reporting", True)
+    monkeypatch.setattr(Configuration, "reporting_time_budget", 0.05)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("chunked_host")
+    connection.host = "chunked_host"
+    connection.getresponse.side_effect = lambda: time.sleep(0.03)
+
+    report_json(None, [{"id": str(i), "a": "b" * 40_000} for i in range(30)])
+
+    assert connection.request.call_count == 2
+    assert "Reporting time budget is over" in caplog.text
+
+
+def test_config_chunked_reporting_with_envs(monkeypatch):
+    monkeypatch.setenv("LUMIGO_CHUNKED_REPORTING", "true")
+    monkeypatch.setenv("LUMIGO_EDGE_CONNECTIONS", "4")
+    config()
+    assert Configuration.chunked_reporting is True
+    assert Configuration.edge_connections == 4
+
+
+@pytest.mark.parametrize("compression", [None, "deflate"])
+@pytest.mark.parametrize("chunked", [False, True])
+def test_create_payloads_compact_envelope(monkeypatch, compression, chunked):
+    monkeypatch.setattr(Configuration, "edge_compression", compression)
+    monkeypatch.setattr(Configuration, "chunked_reporting", chunked)
+    base_msg = {"token": "t_123", "info": {"tracer": {"version": "1"}}}
+    spans = [{"id": "1", "info": {"httpInfo": {"host": "a"}}}, {"id": "2"}]
+
+    (body,) = _create_payloads(spans, base_msg)
+
+    payload = json.loads(zlib.decompress(body) if compression else body)
+    assert payload["header"] == base_msg
+    assert sorted(expand_envelope(payload), key=lambda span: span["id"]) == [
+        {
+            "id": "1",
+            "token": "t_123",
+            "info": {"tracer": {"version": "1"}, "httpInfo": {"host": "a"}},
+        },
+        {"id": "2", "token": "t_123", "info": {"tracer": {"version": "1"}}},
+    ]
+
+
+def test_expand_envelope_regular_format():
+    assert expand_envelope(b'[{"id": "1"}]') == [{"id": "1"}]
+
+
+def test_create_payloads_compact_envelope_respects_size_limit(monkeypatch):
+    base_msg = {"token": "t" * 1000}
+    spans = [{"id": str(i), "a": "b" * 10_000} for i in range(100)]
+
+    (body,) = _create_payloads(spans, base_msg)
+
+    assert _get_base64_size(len(body)) <= lumigo_utils.MAX_SIZE_FOR_REQUEST
+    assert len(expand_envelope(body)) < 100
+
+
+@pytest.fixture
+def spill_journal(monkeypatch, tmpdir):
+    monkeypatch.setattr(Configuration, "spill_dir", str(tmpdir.join("spill")))
+    monkeypatch.setattr(Configuration, "spill_to_disk", True)
+    return SpillJournal
+
+
+def test_report_json_spill_on_timeout_and_drain_later(monkeypatch, reporter_mock, spill_journal):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "spill_host")
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("spill_host")
+    connection.host = "spill_host"
+    connection.getresponse.side_effect = socket.timeout
+
+    report_json(None, [{"a": "b"}])
+    report_json(None, [{"c": "d"}])  # Skipped due to the previous timeout
+    assert len(spill_journal._list_entries()) == 2
+
+    connection.getresponse.side_effect = None
+    InternalState.reset()
+    report_json(None, [{"e": "f"}])
+
+    assert [c[0][2] for c in connection.request.call_args_list[-3:]] == [
+        b'[{"e": "f"}]',
+        b'[{"a": "b"}]',
+        b'[{"c": "d"}]',
+    ]
+    assert spill_journal._list_entries() == []
+
+
+@pytest.mark.parametrize("edge_connections", [1, 2])
+def test_report_json_chunked_reporting_spills_dropped_requests(
+    monkeypatch, reporter_mock, spill_journal, caplog, edge_connections
+):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "chunked_host")
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    monkeypatch.setattr(lumigo_utils, "edge_executor", None)
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "chunked_reporting", True)
+    monkeypatch.setattr(Configuration, "edge_connections", edge_connections)
+    monkeypatch.setattr(Configuration, "reporting_time_budget", 0.05)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("chunked_host")
+    connection.host = "chunked_host"
+    connection.getresponse.side_effect = lambda: time.sleep(0.03) or Mock()
+    spans = [{"id": str(i), "a": "b" * 40_000} for i in range(30)]
+
+    report_json(None, spans)
+
+    # The request that started before the deadline is completed, the rest are spilled
+    assert connection.request.call_count == 2
+    spilled = [json.loads(open(e.path, "rb").read()) for e in spill_journal._list_entries()]
+    assert f"dropped {len(spilled)} requests" in caplog.text
+    sent = [json.loads(c.args[2]) for c in connection.request.call_args_list]
+    assert sorted(s["id"] for r in sent + spilled for s in r) == sorted(s["id"] for s in spans)
+
+
+def test_report_json_doesnt_drain_spill_journal_on_start_span(
+    monkeypatch, reporter_mock, spill_journal
+):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    monkeypatch.setattr(Configuration, "host", "spill_host")
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("spill_host")
+    connection.host = "spill_host"
+    SpillJournal.spill(b'[{"a": "b"}]')
+
+    report_json(None, [{"c": "d"}], is_start_span=True)
+    assert len(spill_journal._list_entries()) == 1
+
+    report_json(None, [{"e": "f"}])
+    assert spill_journal._list_entries() == []
+    assert [c[0][2] for c in connection.request.call_args_list[-3:]] == [
+        b'[{"c": "d"}]',
+        b'[{"e": "f"}]',
+        b'[{"a": "b"}]',
+    ]
+
+
+def test_spill_journal_evict_oldest(monkeypatch, spill_journal):
+    monkeypatch.setattr(Configuration, "spill_max_bytes", 10)
+
+    for payload in (b"1111", b"2222", b"3333"):
+        SpillJournal.spill(payload)
+
+    entries = SpillJournal._list_entries()
+    assert [open(e.path, "rb").read() for e in entries] == [b"2222", b"3333"]
+
+
+def test_spill_journal_drain_stops_on_failure(monkeypatch, spill_journal):
+    SpillJournal.spill(b"1")
+    SpillJournal.spill(b"2")
+    monkeypatch.setattr(lumigo_utils, "_post_to_edge", Mock(side_effect=[1, ValueError]))
+
+    assert SpillJournal.drain() == 1
+    assert len(SpillJournal._list_entries()) == 1
+
+
+def test_internal_state_cooldown_grows_on_consecutive_timeouts():
+    InternalState.mark_timeout_to_edge()
+    assert InternalState.get_cooldown() == datetime.timedelta(seconds=1)
+    InternalState.mark_timeout_to_edge()
+    assert InternalState.get_cooldown() == datetime.timedelta(seconds=2)
+    for _ in range(10):
+        InternalState.mark_timeout_to_edge()
+    assert InternalState.get_cooldown() == datetime.timedelta(seconds=10)
+
+
+def test_internal_state_half_open_success_closes_the_circuit():
+    InternalState.mark_timeout_to_edge()
+    assert InternalState.should_report_to_edge() is False
+
+    InternalState.timeout_on_connection = datetime.datetime(2016, 1, 1)
+    assert InternalState.should_report_to_edge() is True  # half open
+
+    InternalState.mark_edge_success(0.01)
+    assert InternalState.should_report_to_edge() is True
+    assert InternalState.get_cooldown() == datetime.timedelta(seconds=1)
+
+
+@pytest.mark.parametrize(
+    "rtts, deadline_in, expected",
+    [
+        ([], None, lumigo_utils.EDGE_TIMEOUT),  # not enough samples
+        ([0.05] * 10, None, 0.15),  # p99 * 3
+        ([0.001] * 10, None, lumigo_utils.MIN_EDGE_TIMEOUT),  # lower bound
+        ([5] * 10, None, lumigo_utils.EDGE_TIMEOUT),  # upper bound
+        ([], 0.2, 0.2),  # capped by the invocation's remaining time
+    ],
+)
+def test_internal_state_get_edge_timeout(monkeypatch, rtts, deadline_in, expected):
+    monkeypatch.setattr(time, "time", lambda: 1000)
+    for rtt in rtts:
+        InternalState.mark_edge_success(rtt)
+    if deadline_in:
+        InternalState.invocation_deadline = 1000 + deadline_in
+
+    assert InternalState.get_edge_timeout() == pytest.approx(expected)
+
+
+def test_edge_timeout_of_big_body_after_small_rtts(monkeypatch, reporter_mock):
+    reporter_mock.side_effect = report_json
+    monkeypatch.setattr(Configuration, "host", "edge_host")
+    monkeypatch.setattr(lumigo_utils, "edge_connection", None)
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(http.client, "HTTPSConnection", Mock())
+    connection = http.client.HTTPSConnection("edge_host")
+    connection.host = "edge_host"
+    timeouts = []
+    connection.request.side_effect = lambda *args, **kwargs: timeouts.append(connection.timeout)
+
+    for _ in range(lumigo_utils.EDGE_RTT_MIN_SAMPLES + 1):
+        report_json(None, [{"id": "start"}])
+    report_json(None, [{"id": "end", "a": "b" * lumigo_utils.EDGE_RTT_TIMEOUT_MAX_BODY_SIZE}])
+
+    assert timeouts[-2] == lumigo_utils.MIN_EDGE_TIMEOUT
+    assert timeouts[-1] == lumigo_utils.EDGE_TIMEOUT
+
+
 def test_report_json_china_missing_access_key_id(monkeypatch, reporter_mock, caplog):
     monkeypatch.setattr(Configuration, "should_report", True)
     reporter_mock.side_effect = report_json
@@ -569,6 +1191,34 @@ def test_report_json_china_on_error_no_exception_and_notify_user(capsys, monkeyp
     assert "Failed to send spans" in capsys.readouterr().out
 
 
+@pytest.mark.parametrize("chunked_reporting", [False, True])
+def test_report_json_china_publishes_uncompressed_spans(monkeypatch, chunked_reporting):
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "edge_compression", "gzip")
+    monkeypatch.setattr(Configuration, "chunked_reporting", chunked_reporting)
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_access_key_id", "my_value")
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_secret_access_key", "my_value")
+    monkeypatch.setattr(boto3, "client", MagicMock())
+
+    report_json(CHINA_REGION, [{"a": "b"}])
+
+    data = boto3.client.return_value.put_record.call_args.kwargs["Data"]
+    assert json.loads(data) == [{"a": "b"}]
+
+
+def test_report_json_china_publishes_full_spans_with_compact_envelope(monkeypatch):
+    monkeypatch.setattr(Configuration, "should_report", True)
+    monkeypatch.setattr(Configuration, "compact_envelope", True)
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_access_key_id", "my_value")
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_secret_access_key", "my_value")
+    monkeypatch.setattr(boto3, "client", MagicMock())
+
+    report_json(CHINA_REGION, [{"a": "b"}], base_msg={"token": "t"})
+
+    data = boto3.client.return_value.put_record.call_args.kwargs["Data"]
+    assert json.loads(data) == [{"a": "b", "token": "t"}]
+
+
 def test_china_shouldnt_establish_http_connection(monkeypatch):
     monkeypatch.setenv("AWS_REGION", CHINA_REGION)
     # Reload a duplicate of lumigo_utils
@@ -13,6 +13,7 @@ from lumigo_tracer.parsing_utils import (
     parse_trace_id,
     safe_key_from_query,
     safe_key_from_xml,
+    safe_keys_from_xml,
     safe_get_list,
     extract_function_name_from_arn,
 )
@@ -66,12 +67,41 @@ def test_key_from_json(input_params, expected_output):
         ((b"<a>b</a>", "c"), None),  # not existing key
         ((b"<a><b>c</b></a>", "a/e"), None),  # not existing sub-key
         ((b'{"a": "b"}', "c"), None),  # not an xml
+        ((b"<a><b>c</b><b>d</b></a>", "a/b/1"), "d"),  # index
+        ((b"<a><b>c</b></a>", "a/b/0"), "c"),  # index of a single element
+        ((b"<a><b>c</b><b>d</b></a>", "a/b/2"), None),  # index out of range
+        ((b"<a><b><c>d</c></b><b><e>f</e></b></a>", "a/b/e"), "f"),  # no index - the first match
+        ((b"<a><b>c</b></a>", "a"), None),  # not a leaf
+        ((b"<a>\n  <b>  c </b>\n</a>", "a/b"), "c"),  # whitespaces
+        ((b'<a xmlns="http://ns"><b>c</b></a>', "a/b"), "c"),  # namespace
+        ((b"", "a"), None),  # empty body
     ],
 )
 def test_key_from_xml(input_params, expected_output):
     assert safe_key_from_xml(*input_params) == expected_output
 
 
+def test_keys_from_xml_several_keys():
+    xml = b"<a><b>c</b><d><e>f</e><e>g</e></d></a>"
+
+    assert safe_keys_from_xml(xml, ["a/d/e/1", "a/b", "a/h"], "default") == ["g", "c", "default"]
+
+
+def test_keys_from_xml_nested_paths():
+    xml = b"<r><a><b><c>1</c></b><d>2</d></a></r>"
+
+    assert safe_keys_from_xml(xml, ["r/a/b/c", "r/a/b"]) == ["1", None]
+    assert safe_keys_from_xml(xml, ["r/a/b", "r/a/b/c"]) == [None, "1"]
+    assert safe_keys_from_xml(xml, ["r/a/d", "r/a"]) == ["2", None]
+    assert safe_keys_from_xml(xml, ["r/a/b"]) == [safe_key_from_xml(xml, "r/a/b")]
+
+
+def test_keys_from_xml_stops_once_found():
+    assert safe_keys_from_xml(b"<a><b>c</b>not-closed", ["a/b"]) == ["c"]
+    assert safe_keys_from_xml(b"<a><b>c</b><b>d</b>not-closed", ["a/b/0"]) == ["c"]
+    assert safe_keys_from_xml(b"<a><b>c</b>not-closed", ["x/b"]) == [None]
+
+
 @pytest.mark.parametrize(
     ("input_params", "expected_output"),
     [
@@ -108,12 +138,26 @@ def test_parse_trace_id(trace_id, result):
         ({1: 2}, {1: 3}, {1: 2}),  # same key twice
         ({1: {2: 3}}, {4: 5}, {1: {2: 3}, 4: 5}),  # dictionary in d1 and nothing in d2
         ({1: {2: 3}}, {1: {4: 5}}, {1: {2: 3, 4: 5}}),  # merge two inner dictionaries
+        ({1: {2: 3}}, {1: {2: 4}, 5: {6: 7}}, {1: {2: 3}, 5: {6: 7}}),  # nested same key
+        ({1: None}, {1: {2: 3}}, {1: None}),  # d1 wins even with None
+        (None, {1: 2}, {1: 2}),  # no d1
     ],
 )
 def test_recursive_json_join(d1, d2, result):
     assert recursive_json_join(d1, d2) == result
 
 
+def test_recursive_json_join_does_not_change_the_inputs():
+    d1 = {"info": {"httpInfo": {"host": "a"}}, "id": 1}
+    d2 = {"info": {"tracer": {"version": "1"}}, "token": "t"}
+
+    result = recursive_json_join(d1, d2)
+    result["info"]["new"] = "value"
+
+    assert d1 == {"info": {"httpInfo": {"host": "a"}}, "id": 1}
+    assert d2 == {"info": {"tracer": {"version": "1"}}, "token": "t"}
+
+
 def test_config_with_verbose_param_with_no_env_verbose_verbose_is_false():
     config(verbose=False)
 
@@ -1,5 +1,11 @@
 import copy
 import os
+import random
+import signal
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
 
 import mock
 import inspect
@@ -14,10 +20,24 @@ from lumigo_tracer.wrappers.http.http_parser import HTTP_TYPE
 from lumigo_tracer.spans_container import (
     SpansContainer,
     TimeoutMechanism,
+    WatchdogTimer,
     FUNCTION_TYPE,
     MALFORMED_TXID,
+    AGGREGATED_SPAN_ID_SUFFIX,
+    TailSampler,
+    TAIL_SAMPLING_MIN_SAMPLES,
+    is_transaction_sampled,
 )
-from lumigo_tracer.lumigo_utils import Configuration, EXECUTION_TAGS_KEY
+from lumigo_tracer.lumigo_utils import (
+    Configuration,
+    EXECUTION_TAGS_KEY,
+    materialize,
+    EncodedSpan,
+    InternalState,
+)
+from lumigo_tracer.wrappers.http.http_data_classes import HttpState, HttpRequest
+from lumigo_tracer.wrappers.http.sync_http_wrappers import add_request_event, update_event_response
+from lumigo_tracer.wrappers.pymongo.pymongo_wrapper import LumigoMongoMonitoring
 
 
 @pytest.fixture
@@ -46,7 +66,7 @@ def test_spans_container_not_send_start_span_on_send_only_on_errors_mode(monkeyp
 @pytest.mark.dont_mock_lumigo_utils_reporter
 def test_start(monkeypatch):
     lumigo_utils_mock = mock.Mock()
-    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "true")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
     monkeypatch.setattr(lumigo_utils, "write_extension_file", lumigo_utils_mock)
     monkeypatch.setattr(SpansContainer, "_generate_start_span", lambda *args, **kwargs: {"a": "a"})
     monkeypatch.setattr(Configuration, "should_report", True)
@@ -64,7 +84,7 @@ def test_spans_container_end_function_got_none_return_value(monkeypatch):
 def test_spans_container_end_function_not_send_spans_on_send_only_on_errors_mode(
     monkeypatch, dummy_span, tmpdir
 ):
-    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "TRUE")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
     reported_ttl, stop_path_path = only_if_error(dummy_span, monkeypatch, tmpdir)
     stop_file_content = json.loads(open(stop_path_path, "r").read())
     assert json.dumps(stop_file_content) == json.dumps([{}])
@@ -135,7 +155,7 @@ def test_spans_container_end_function_with_error_double_size_limit(monkeypatch,
     SpansContainer.get_span().end(event=event)
 
     end_span = SpansContainer.get_span().function_span
-    assert len(end_span["event"]) > len(start_span["event"])
+    assert len(materialize(end_span["event"])) > len(materialize(start_span["event"]))
     assert end_span["event"] == json.dumps(event)
 
 
@@ -173,6 +193,134 @@ def test_timeout_mechanism_too_short_time(monkeypatch, context):
     assert not TimeoutMechanism.is_activated()
 
 
+def test_watchdog_timer_runs_in_background_thread():
+    called = threading.Event()
+    threads = []
+    WatchdogTimer.start(0.01, lambda: threads.append(threading.current_thread()) or called.set())
+    assert WatchdogTimer.is_activated()
+
+    assert called.wait(1)
+    assert threads[0] is not threading.main_thread()
+    assert not WatchdogTimer.is_activated()
+
+
+def test_watchdog_timer_stop_disarms():
+    to_exec = mock.Mock()
+    WatchdogTimer.start(0.05, to_exec)
+    WatchdogTimer.stop()
+    WatchdogTimer.start(0.05, to_exec)
+    WatchdogTimer.stop()
+
+    time.sleep(0.1)
+    assert not to_exec.called
+    assert not WatchdogTimer.is_activated()
+
+
+def test_watchdog_timer_stop_waits_for_running_callback():
+    started, finished = threading.Event(), threading.Event()
+    WatchdogTimer.start(0, lambda: started.set() or time.sleep(0.05) or finished.set())
+    assert started.wait(1)
+
+    WatchdogTimer.stop()
+    assert finished.is_set()
+
+
+def test_timeout_flush_on_watchdog_doesnt_change_the_spans(reporter_mock, dummy_span):
+    container = SpansContainer.create_span()
+    container.add_span(dummy_span)
+    container.add_span({"id": "in-flight", "started": 1})
+    finalizer = mock.Mock()
+    container.add_span_finalizer("key", finalizer)
+    # The user's code pops a span while the watchdog collects the spans
+    container.span_ids_to_send.add("already-popped")
+    done = threading.Event()
+
+    WatchdogTimer.start(0, lambda: container.handle_timeout() or done.set())
+
+    assert done.wait(1)
+    assert not finalizer.called
+    assert "key" in container.span_finalizers
+    sent = reporter_mock.call_args.kwargs["msgs"]
+    assert {span["id"] for span in sent} == {dummy_span["id"], "in-flight"}
+
+
+def test_timeout_mechanism_signal_configuration(monkeypatch):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    monkeypatch.setattr(Configuration, "timeout_mechanism", "signal")
+    TimeoutMechanism.start(10, lambda *args: None)
+    assert signal.getsignal(signal.SIGALRM) != signal.SIG_DFL
+    assert not WatchdogTimer.is_activated()
+
+    TimeoutMechanism.stop()
+    assert not TimeoutMechanism.is_activated()
+
+
+def test_timeout_mechanism_sends_spans_from_watchdog(
+    monkeypatch, context, reporter_mock, dummy_span
+):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    monkeypatch.setattr(Configuration, "timeout_timer_buffer", 1.95)
+    SpansContainer.create_span()
+    SpansContainer.get_span().start(context=context)
+    reporter_mock.reset_mock()
+    SpansContainer.get_span().add_span(dummy_span)
+    assert TimeoutMechanism.is_activated()
+
+    deadline = time.monotonic() + 1
+    while not reporter_mock.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    TimeoutMechanism.stop()
+
+    assert [m["id"] for m in reporter_mock.call_args.kwargs["msgs"]] == [dummy_span["id"]]
+    assert not SpansContainer.get_span().span_ids_to_send
+
+
+def test_timeout_flush_sends_checkpoint_of_finished_spans(monkeypatch, context, reporter_mock):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    monkeypatch.setattr(Configuration, "should_report", True)
+    SpansContainer.create_span()
+    SpansContainer.get_span().start(context=context)
+    TimeoutMechanism.stop()
+    SpansContainer.get_span().add_span({"id": "finished", "started": 1, "ended": 2})
+    SpansContainer.get_span().add_span({"id": "in-flight", "started": 3})
+
+    SpansContainer.get_span().handle_timeout()
+
+    finished, in_flight = sorted(reporter_mock.call_args.kwargs["msgs"], key=lambda m: m["id"])
+    assert isinstance(finished, EncodedSpan)
+    assert json.loads(finished.encoded) == finished
+    assert not isinstance(in_flight, EncodedSpan)
+    assert not SpansContainer.get_span().encoded_spans
+    assert InternalState.flush_duration is not None
+
+
+def test_checkpoint_invalidated_when_span_changes(monkeypatch):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    container = SpansContainer.create_span()
+    container.add_span({"id": "1", "started": 1, "ended": 2})
+    container.add_span({"id": "2", "started": 3})
+    assert json.loads(container.encoded_spans["1"].encoded)["ended"] == 2
+
+    container.get_span_by_id("1")["ended"] = 5
+    assert "1" not in container.encoded_spans
+    container.update_event_end_time("2")
+    container.add_span({"id": "3", "started": 6})
+
+    assert json.loads(container.encoded_spans["1"].encoded)["ended"] == 5
+    assert "2" in container.encoded_spans
+    assert container.pop_span("2") and "2" not in container.encoded_spans
+
+
+def test_checkpoint_skipped_if_spans_may_not_be_sent(monkeypatch):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    monkeypatch.setattr(Configuration, "send_only_if_error", True)
+    container = SpansContainer.create_span()
+    container.add_span({"id": "1", "started": 1, "ended": 2})
+    container.add_span({"id": "2", "started": 3})
+
+    assert not container.encoded_spans
+
+
 def test_timeout_mechanism_timeout_occurred_doesnt_send_span_twice(
     monkeypatch, context, dummy_span
 ):
@@ -247,3 +395,259 @@ def test_malformed_txid(monkeypatch, context):
     result = SpansContainer.get_span().get_patched_root()
     output_trace_id = result.split(";")[0].split("=")[1].split("-")[2]
     assert output_trace_id == SpansContainer.get_span().transaction_id
+
+
+def test_compact_envelope_expands_to_the_regular_format(monkeypatch, dummy_span, reporter_mock):
+    def end_and_get_reported_spans():
+        SpansContainer.create_span()
+        SpansContainer.get_span().add_span(dummy_span)
+        SpansContainer.get_span().end({})
+        return reporter_mock.call_args.kwargs
+
+    regular_spans = end_and_get_reported_spans()["msgs"]
+    monkeypatch.setattr(Configuration, "compact_envelope", True)
+    compact = end_and_get_reported_spans()
+
+    assert "token" not in compact["msgs"][1]
+    expanded = lumigo_utils.expand_envelope(
+        {"header": compact["base_msg"], "spans": compact["msgs"]}
+    )
+    assert expanded[1] == regular_spans[1]
+    assert expanded[0].keys() == regular_spans[0].keys()
+
+
+def _redis_span(span_id: str, duration: int, command: str = "GET", **kwargs) -> dict:
+    return {
+        "id": span_id,
+        "type": "redis",
+        "started": 1000,
+        "ended": 1000 + duration,
+        "requestCommand": command,
+        "connectionOptions": {"host": "lumigo", "port": None},
+        **kwargs,
+    }
+
+
+def _end_and_get_reported_spans(spans, reporter_mock):
+    SpansContainer.create_span()
+    for span in spans:
+        SpansContainer.get_span().add_span(span)
+    SpansContainer.get_span().end({})
+    return {span["id"]: span for span in reporter_mock.call_args.kwargs["msgs"][1:]}
+
+
+def test_span_aggregation_off_by_default(reporter_mock):
+    spans = [_redis_span(str(i), duration=i) for i in range(100)]
+
+    reported = _end_and_get_reported_spans(spans, reporter_mock)
+
+    assert len(reported) == 100
+
+
+def test_span_aggregation(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "span_aggregation_threshold", 3)
+    monkeypatch.setattr(Configuration, "span_aggregation_keep_slowest", 1)
+    spans = [_redis_span(str(i), duration=i) for i in range(10)]
+    spans.append(_redis_span("error", duration=1, error={"type": "ConnectionError"}))
+    spans.append(_redis_span("other", duration=1, command="SET"))
+
+    reported = _end_and_get_reported_spans(spans, reporter_mock)
+
+    aggregated_id = f"3{AGGREGATED_SPAN_ID_SUFFIX}"
+    assert set(reported) == {"0", "1", "2", "9", aggregated_id, "error", "other"}
+    assert reported[aggregated_id]["aggregation"] == {
+        "count": 6,
+        "totalDuration": 3 + 4 + 5 + 6 + 7 + 8,
+        "minDuration": 3,
+        "maxDuration": 8,
+        "histogram": {
+            "bucketsBounds": [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+            "counts": [0, 3, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+        },
+    }
+    assert reported[aggregated_id]["started"] == 1000
+    assert reported[aggregated_id]["ended"] == 1008
+    assert reported[aggregated_id]["requestCommand"] == "GET"
+
+
+def test_span_aggregation_below_the_threshold(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "span_aggregation_threshold", 3)
+    monkeypatch.setattr(Configuration, "span_aggregation_keep_slowest", 1)
+    spans = [_redis_span(str(i), duration=i) for i in range(4)]
+    spans.append({"id": "in-flight", "type": "redis", "started": 1000, "requestCommand": "GET"})
+
+    reported = _end_and_get_reported_spans(spans, reporter_mock)
+
+    assert set(reported) == {"0", "1", "2", "3", "in-flight"}
+
+
+def _end_sampled_invocation(reporter_mock, duration: int, error: bool = False) -> list:
+    SpansContainer.create_span(is_new_invocation=True)
+    SpansContainer.get_span().add_span(_redis_span("span", duration=1))
+    SpansContainer.get_span().function_span["started"] -= duration
+    if error:
+        SpansContainer.get_span().function_span["error"] = {"type": "ValueError"}
+    SpansContainer.get_span().end({})
+    return reporter_mock.call_args.kwargs["msgs"]
+
+
+@pytest.fixture
+def tail_sampling(monkeypatch):
+    monkeypatch.setattr(Configuration, "tail_sampling_rate", 0)
+    for _ in range(TAIL_SAMPLING_MIN_SAMPLES):
+        TailSampler.durations.append(1000)
+
+
+def test_tail_sampling_sends_summary_of_fast_invocations(tail_sampling, reporter_mock):
+    msgs = _end_sampled_invocation(reporter_mock, duration=10)
+
+    assert len(msgs) == 1
+    assert msgs[0]["id"] == SpansContainer.get_span().function_span["id"]
+    assert msgs[0]["type"] == FUNCTION_TYPE
+    assert msgs[0]["isSampled"] is False
+    assert msgs[0]["droppedSpans"] == 1
+    assert msgs[0]["started"] < msgs[0]["ended"]
+    assert msgs[0]["transactionId"] == SpansContainer.get_span().transaction_id
+
+
+@pytest.mark.parametrize(
+    "should_report, tail_sampled, expected",
+    [(True, False, True), (False, False, False), (True, True, False)],
+)
+def test_flush_duration_marked_only_when_posting_to_edge(
+    monkeypatch, tail_sampling, reporter_mock, should_report, tail_sampled, expected
+):
+    monkeypatch.setattr(Configuration, "should_report", should_report)
+
+    _end_sampled_invocation(reporter_mock, duration=10 if tail_sampled else 2000)
+
+    assert (InternalState.flush_duration is not None) is expected
+
+
+def test_tail_sampling_sends_slow_and_failed_invocations(tail_sampling, reporter_mock):
+    assert len(_end_sampled_invocation(reporter_mock, duration=2000)) == 2
+    assert len(_end_sampled_invocation(reporter_mock, duration=10, error=True)) == 2
+
+
+def test_tail_sampling_random_fraction(monkeypatch, tail_sampling, reporter_mock):
+    monkeypatch.setattr(Configuration, "tail_sampling_rate", 1)
+
+    assert len(_end_sampled_invocation(reporter_mock, duration=10)) == 2
+
+
+def test_tail_sampling_sends_all_until_enough_samples(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "tail_sampling_rate", 0)
+
+    for _ in range(TAIL_SAMPLING_MIN_SAMPLES):
+        assert len(_end_sampled_invocation(reporter_mock, duration=1000)) == 2
+    assert len(_end_sampled_invocation(reporter_mock, duration=10)) == 1
+
+
+def test_tail_sampling_duration_percentile():
+    TailSampler.durations.extend(range(1, 101))
+
+    assert TailSampler.get_duration_percentile(90) == 90
+    assert TailSampler.get_duration_percentile(100) == 100
+    assert TailSampler.get_duration_percentile(0) == 1
+
+
+def test_is_transaction_sampled(monkeypatch):
+    transaction_ids = [os.urandom(12).hex() for _ in range(2000)]
+    monkeypatch.setattr(Configuration, "sampling_rate", 0.25)
+
+    decisions = [is_transaction_sampled(transaction_id) for transaction_id in transaction_ids]
+
+    assert decisions == [
+        is_transaction_sampled(transaction_id) for transaction_id in transaction_ids
+    ]
+    assert 0.2 < sum(decisions) / len(decisions) < 0.3
+    monkeypatch.setattr(Configuration, "sampling_rate", 0.5)
+    assert all(
+        is_transaction_sampled(t) for t, sampled in zip(transaction_ids, decisions) if sampled
+    )
+    monkeypatch.setattr(Configuration, "sampling_rate", 1)
+    assert all(is_transaction_sampled(transaction_id) for transaction_id in transaction_ids)
+    monkeypatch.setattr(Configuration, "sampling_rate", 0)
+    assert not any(is_transaction_sampled(transaction_id) for transaction_id in transaction_ids)
+
+
+def test_unsampled_invocation_sends_only_its_timing(monkeypatch, context, reporter_mock):
+    monkeypatch.setattr(Configuration, "sampling_rate", 0)
+    monkeypatch.setenv(
+        "_X_AMZN_TRACE_ID",
+        "Root=1-5fd891b8-252f5de90a085ae04267aa4e;Parent=0a885f800de045d4;Sampled=0",
+    )
+    SpansContainer.create_span({"a": "b"}, context, is_new_invocation=True)
+    SpansContainer.get_span().start()
+    assert not reporter_mock.called
+    assert SpansContainer.get_span().function_span["event"] is None
+
+    SpansContainer.get_span().end({"return": "value"})
+
+    msgs = reporter_mock.call_args.kwargs["msgs"]
+    assert len(msgs) == 1
+    assert msgs[0]["isSampled"] is False
+    assert msgs[0]["ended"] >= msgs[0]["started"]
+    assert msgs[0]["transactionId"] == "252f5de90a085ae04267aa4e"
+    assert "return_value" not in msgs[0]
+    root = SpansContainer.get_span().get_patched_root().split(";")[0]
+    assert root.endswith("252f5de90a085ae04267aa4e")
+
+
+def test_spans_not_dumped_unless_reported(monkeypatch, context, reporter_mock):
+    monkeypatch.setattr(Configuration, "send_only_if_error", True)
+    dumps_mock = mock.Mock(side_effect=lumigo_utils.lumigo_dumps)
+    monkeypatch.setattr(lumigo_utils, "lumigo_dumps", dumps_mock)
+    SpansContainer.create_span({"a": "b"}, context, is_new_invocation=True)
+    SpansContainer.get_span().start()
+    request = HttpRequest(host="dummy", method="POST", uri="dummy", headers={}, body=b'{"a": "b"}')
+    span_id = add_request_event(None, request)["id"]
+    update_event_response(span_id, "dummy", 200, {}, b'{"c": "d"}')
+
+    SpansContainer.get_span().end({"return": "value"})
+    assert not reporter_mock.called
+    assert not dumps_mock.called
+
+    http_info = SpansContainer.get_span().spans[span_id]["info"]["httpInfo"]
+    assert json.loads(lumigo_utils.aws_dump(http_info))["response"]["body"] == '{"c": "d"}'
+    assert dumps_mock.called
+
+
+def _simulate_invocation(monitor):
+    SpansContainer.create_span(is_new_invocation=True)
+    for _ in range(3):
+        connection_id = random.random()
+        HttpState.request_id_to_span_id[connection_id] = str(uuid.uuid4())
+        HttpState.response_id_to_span_id[random.random()] = str(uuid.uuid4())
+    # a mongo command that never completes
+    monitor.started(
+        SimpleNamespace(
+            database_name="db",
+            command_name="find",
+            command={},
+            request_id=random.randint(0, 2 ** 31),
+            operation_id=1,
+            connection_id=("localhost", 27017),
+        )
+    )
+
+
+@pytest.mark.slow
+def test_connection_mappings_do_not_grow_across_invocations(monkeypatch):
+    monkeypatch.setattr(Configuration, "verbose", False)
+    monitor = LumigoMongoMonitoring()
+    for _ in range(1000):
+        _simulate_invocation(monitor)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(100_000):
+            _simulate_invocation(monitor)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(HttpState.request_id_to_span_id) == 3
+    assert len(HttpState.response_id_to_span_id) == 3
+    assert len(LumigoMongoMonitoring.request_to_span_id) == 1
+    assert current - baseline < 1024 * 1024
@@ -0,0 +1,201 @@
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from lumigo_tracer.lumigo_utils import md5hash, Configuration, config
+from lumigo_tracer.spans_container import SpansContainer
+from lumigo_tracer.wrappers.botocore import botocore_wrapper
+from lumigo_tracer.wrappers.botocore.botocore_wrapper import wrap_botocore
+from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest, BotocoreState
+from lumigo_tracer.wrappers.http.http_parser import DynamoParser, SnsParser
+from lumigo_tracer.wrappers.http.sync_http_wrappers import add_request_event, update_event_response
+
+TOPIC_ARN = "arn:aws:sns:us-east-1:123456789012:topic"
+
+
+def _model(service: str, operation: str):
+    return SimpleNamespace(service_model=SimpleNamespace(service_name=service), name=operation)
+
+
+def _api_call(service, operation, params, parsed, http_call):
+    context: dict = {}
+    model = _model(service, operation)
+    botocore_wrapper._before_parameter_build(params=params, context=context)
+    botocore_wrapper._before_call(model=model, context=context)
+    http_call()
+    botocore_wrapper._after_call(model=model, parsed=parsed)
+
+
+def _raise(*args, **kwargs):
+    raise AssertionError("the body should not be parsed")
+
+
+def test_botocore_call_skips_the_body_parsing(monkeypatch):
+    monkeypatch.setattr(DynamoParser, "parse_request", _raise)
+    request = HttpRequest(
+        host="dynamodb.us-east-1.amazonaws.com",
+        method="POST",
+        uri="dynamodb.us-east-1.amazonaws.com/",
+        headers={"x-amz-target": "DynamoDB_20120810.PutItem"},
+        body=b'{"TableName": "wire-table"}',
+    )
+
+    def http_call():
+        span = add_request_event(None, request)
+        update_event_response(
+            span["id"], request.host, 200, {"x-amzn-requestid": "request-id"}, b"{}"
+        )
+
+    _api_call(
+        "dynamodb", "PutItem", {"TableName": "table", "Item": {"key": {"S": "1"}}}, {}, http_call
+    )
+
+    span = SpansContainer.get_span().get_span_by_id("request-id")
+    assert span["info"]["resourceName"] == "table"
+    assert span["info"]["dynamodbMethod"] == "PutItem"
+    assert span["info"]["messageId"] == md5hash({"key": {"S": "1"}})
+    assert span["info"]["httpInfo"]["request"]["body"] == '{"TableName": "wire-table"}'
+
+
+def test_botocore_call_takes_the_response_fields_from_the_parsed_response():
+    request = HttpRequest(
+        host="sns.us-east-1.amazonaws.com",
+        method="POST",
+        uri="sns.us-east-1.amazonaws.com/",
+        headers={},
+        body=b"Action=Publish",
+    )
+
+    def http_call():
+        span = add_request_event(None, request)
+        update_event_response(span["id"], request.host, 200, {"x-amzn-requestid": "req"}, b"<a/>")
+
+    _api_call("sns", "Publish", {"TopicArn": TOPIC_ARN}, {"MessageId": "message"}, http_call)
+
+    span = SpansContainer.get_span().get_span_by_id("req")
+    assert span["info"]["resourceName"] == TOPIC_ARN
+    assert span["info"]["targetArn"] == TOPIC_ARN
+    assert span["info"]["messageId"] == "message"
+
+
+def test_botocore_call_retry_parses_the_previous_attempts_responses():
+    request = HttpRequest(
+        host="sns.us-east-1.amazonaws.com",
+        method="POST",
+        uri="sns.us-east-1.amazonaws.com/",
+        headers={},
+        body=b"Action=Publish",
+    )
+
+    def http_call():
+        for attempt in ("first", "second"):
+            span = add_request_event(None, request)
+            body = (
+                f"<PublishResponse><PublishResult><MessageId>{attempt}</MessageId></PublishResult>"
+                "</PublishResponse>"
+            ).encode()
+            update_event_response(
+                span["id"], request.host, 200, {"x-amzn-requestid": attempt}, body
+            )
+
+    _api_call("sns", "Publish", {"TopicArn": TOPIC_ARN}, {"MessageId": "parsed"}, http_call)
+
+    first = SpansContainer.get_span().get_span_by_id("first")
+    second = SpansContainer.get_span().get_span_by_id("second")
+    assert first["info"]["messageId"] == "first"
+    assert first["info"]["resourceName"] == TOPIC_ARN
+    assert second["info"]["messageId"] == "parsed"
+    assert list(BotocoreState.spans_to_calls) == ["second"]
+
+
+def test_botocore_call_with_other_parser_is_not_claimed():
+    request = HttpRequest(
+        host="sqs.us-east-1.amazonaws.com",
+        method="POST",
+        uri="sqs.us-east-1.amazonaws.com/",
+        headers={},
+        body=b"QueueUrl=queue",
+    )
+
+    def http_call():
+        add_request_event(None, request)
+
+    _api_call("sns", "Publish", {"TopicArn": TOPIC_ARN}, {"MessageId": "message"}, http_call)
+
+    span = list(SpansContainer.get_span().spans.values())[0]
+    assert span["info"]["resourceName"] == "queue"
+    assert not BotocoreState.spans_to_calls
+    assert BotocoreState.get_current_call() is None
+
+
+def test_botocore_call_of_unknown_service_is_not_claimed():
+    _api_call("s3", "PutObject", {"Bucket": "bucket"}, {}, lambda: None)
+
+    assert BotocoreState.get_current_call() is None
+
+
+def test_botocore_call_error_clears_the_current_call():
+    botocore_wrapper._before_call(model=_model("sns", "Publish"), context={})
+    assert isinstance(BotocoreState.get_current_call().parser(), SnsParser)
+
+    botocore_wrapper._after_call_error(exception=Exception())
+
+    assert BotocoreState.get_current_call() is None
+
+
+def _sns_client():
+    client = boto3.client(
+        "sns", region_name="us-east-1", aws_access_key_id="a", aws_secret_access_key="b"
+    )
+
+    def send(request, **kwargs):
+        span = add_request_event(
+            None,
+            HttpRequest(
+                host="sns.us-east-1.amazonaws.com",
+                method="POST",
+                uri="sns.us-east-1.amazonaws.com/",
+                headers={},
+                body=request.body.encode() if isinstance(request.body, str) else request.body,
+            ),
+        )
+        body = (
+            b"<PublishResponse><PublishResult><MessageId>message</MessageId></PublishResult>"
+            b"</PublishResponse>"
+        )
+        update_event_response(span["id"], "sns.us-east-1.amazonaws.com", 200, {}, body)
+        return AWSResponse(request.url, 200, {}, SimpleNamespace(stream=lambda: iter([body])))
+
+    client.meta.events.register("before-send", send)
+    return client
+
+
+def test_wrap_botocore_registers_the_hooks_on_new_clients(monkeypatch):
+    monkeypatch.setattr(Configuration, "botocore_instrumentation", True)
+    wrap_botocore()
+
+    assert _sns_client().publish(TopicArn=TOPIC_ARN, Message="hello")["MessageId"] == "message"
+
+    span = list(SpansContainer.get_span().spans.values())[0]
+    assert span["info"]["resourceName"] == TOPIC_ARN
+    assert span["info"]["messageId"] == "message"
+    assert BotocoreState.spans_to_calls
+
+
+def test_botocore_instrumentation_is_off_by_default():
+    wrap_botocore()
+
+    assert _sns_client().publish(TopicArn=TOPIC_ARN, Message="hello")["MessageId"] == "message"
+
+    span = list(SpansContainer.get_span().spans.values())[0]
+    assert span["info"]["messageId"] == "message"
+    assert not BotocoreState.spans_to_calls
+
+
+@pytest.mark.parametrize("env, expected", [("TRUE", True), ("", False)])
+def test_config_botocore_instrumentation(monkeypatch, env, expected):
+    monkeypatch.setenv("LUMIGO_BOTOCORE_INSTRUMENTATION", env)
+    config()
+    assert Configuration.botocore_instrumentation is expected
@@ -1,7 +1,7 @@
 import json
 
 import pytest
-from lumigo_tracer.lumigo_utils import Configuration
+from lumigo_tracer.lumigo_utils import Configuration, materialize
 
 from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
 from lumigo_tracer.wrappers.http.http_parser import (
@@ -13,7 +13,10 @@ from lumigo_tracer.wrappers.http.http_parser import (
     EventBridgeParser,
     LambdaParser,
     S3Parser,
+    register_parser,
+    get_parser_instance,
 )
+from lumigo_tracer.wrappers.http import http_parser
 
 
 def test_serverless_aws_parser_fallback_doesnt_change():
@@ -43,8 +46,39 @@ def test_get_parser_apigw():
     assert get_parser(url, {}) == ApiGatewayV2Parser
 
 
+def test_get_parser_instance_is_reused():
+    assert get_parser_instance("dynamodb.us-east-1.amazonaws.com") is get_parser_instance(
+        "dynamodb.us-west-2.amazonaws.com"
+    )
+    assert isinstance(get_parser_instance("dynamodb.us-east-1.amazonaws.com"), DynamoParser)
+
+
+def test_get_parser_resolution_is_cached():
+    http_parser._resolve_parser.cache_clear()
+    get_parser("api.dev.com", {"x-amzn-requestid": "1234"})
+    get_parser("api.dev.com", {"x-amzn-requestid": "5678"})
+    get_parser("api.dev.com", {})
+
+    cache_info = http_parser._resolve_parser.cache_info()
+    assert (cache_info.hits, cache_info.misses) == (1, 2)
+
+
+def test_register_parser(monkeypatch):
+    class MyParser(Parser):
+        pass
+
+    monkeypatch.setattr(http_parser, "_registered_parsers", [])
+    assert get_parser("my-service.example.com") == Parser
+
+    register_parser(r"my-service\.", MyParser)
+
+    assert get_parser("my-service.example.com") == MyParser
+    assert get_parser("other-service.example.com") == Parser
+    http_parser._resolve_parser.cache_clear()
+
+
 def test_get_default_parser_when_using_extension(monkeypatch):
-    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "TRUE")
+    monkeypatch.setattr(Configuration, "use_tracer_extension", True)
     url = "https://ne3kjv28fh.execute-api.us-west-2.amazonaws.com/doriaviram"
     assert get_parser(url, {}) == Parser
 
@@ -173,7 +207,7 @@ def test_dynamodb_parse_no_scrubbing():
         body=json.dumps(body),
     )
     response = parser.parse_request(params)
-    assert json.loads(response["info"]["httpInfo"]["request"]["body"]) == body
+    assert json.loads(materialize(response["info"]["httpInfo"]["request"]["body"])) == body
 
 
 def test_dynamodb_parser_sad_flow():
@@ -207,9 +241,9 @@ def test_dynamodb_parser_sad_flow_unsupported_query():
 def test_double_response_size_limit_on_error_status_code():
     d = {"a": "v" * int(Configuration.get_max_entry_size() * 1.5)}
     info_no_error = Parser().parse_response("www.google.com", 200, d, json.dumps(d))
-    response_no_error = info_no_error["info"]["httpInfo"]["response"]
+    response_no_error = materialize(info_no_error["info"]["httpInfo"]["response"])
     info_with_error = Parser().parse_response("www.google.com", 500, d, json.dumps(d))
-    response_with_error = info_with_error["info"]["httpInfo"]["response"]
+    response_with_error = materialize(info_with_error["info"]["httpInfo"]["response"])
 
     assert len(response_with_error["headers"]) > len(response_no_error["headers"])
     assert response_with_error["headers"] == json.dumps(d)
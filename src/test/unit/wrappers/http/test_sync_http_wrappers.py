@@ -22,6 +22,7 @@ from lumigo_tracer.lumigo_utils import (
     DEFAULT_MAX_ENTRY_SIZE,
     Configuration,
     TRUNCATE_SUFFIX,
+    materialize,
 )
 from lumigo_tracer.wrappers.http.http_parser import Parser
 from lumigo_tracer.spans_container import SpansContainer
@@ -30,7 +31,9 @@ from lumigo_tracer.wrappers.http.sync_http_wrappers import (
     add_request_event,
     update_event_response,
     is_lumigo_edge,
+    add_unparsed_request,
 )
+from lumigo_tracer.wrappers.http import sync_http_wrappers
 
 
 def test_lambda_wrapper_http(context, token):
@@ -526,11 +529,81 @@ def test_aggregating_response_body():
         update_event_response(
             span["id"], host=None, status_code=200, headers=None, body=big_response_chunk
         )
-    body = list(SpansContainer.get_span().spans.values())[0]["info"]["httpInfo"]["response"]["body"]
+    body = materialize(
+        list(SpansContainer.get_span().spans.values())[0]["info"]["httpInfo"]["response"]["body"]
+    )
     assert len(body) <= len(big_response_chunk)
     assert body[: -len(TRUNCATE_SUFFIX)] in json.dumps(big_response_chunk.decode())
 
 
+def test_chunked_response_body_parsed_once_on_finalize(monkeypatch):
+    SpansContainer.create_span()
+    request = HttpRequest(host="dummy", method="GET", uri="dummy", headers={}, body=b"")
+    span_id = update_event_response(
+        add_request_event(None, request)["id"], "dummy", 200, {}, b'{"a": '
+    )
+    calls = []
+    original_parse_response = sync_http_wrappers._parse_response
+    monkeypatch.setattr(
+        sync_http_wrappers,
+        "_parse_response",
+        lambda *args: calls.append(args) or original_parse_response(*args),
+    )
+
+    for index in range(100):
+        update_event_response(span_id, None, 200, {}, f'"{index}", "a": '.encode())
+    update_event_response(span_id, None, 200, {}, b'"last"}')
+    assert not calls
+
+    SpansContainer.get_span().finalize_spans()
+    assert len(calls) == 1
+    body = SpansContainer.get_span().spans[span_id]["info"]["httpInfo"]["response"]["body"]
+    assert json.loads(materialize(body)) == {"a": "last"}
+
+
+def test_chunked_request_body_dumped_once_on_response():
+    SpansContainer.create_span()
+    request = HttpRequest(host="dummy", method="POST", uri="dummy", headers={}, body=b'{"a": ')
+    span_id = add_request_event(None, request)["id"]
+    add_unparsed_request(span_id, request.clone(body=b'"b"'))
+    add_unparsed_request(span_id, request.clone(body=b"}"))
+
+    update_event_response(span_id, "dummy", 200, {}, b"")
+
+    http_info = SpansContainer.get_span().spans[span_id]["info"]["httpInfo"]
+    assert json.loads(materialize(http_info["request"]["body"])) == {"a": "b"}
+
+
+def test_chunked_bodies_of_many_calls_are_not_evicted():
+    container = SpansContainer.create_span()
+    request = HttpRequest(host="dummy", method="POST", uri="dummy", headers={}, body=b'{"a": ')
+    span_ids = []
+    for _ in range(lumigo_utils.INVOCATION_MAPPING_MAX_SIZE + 10):
+        span_id = add_request_event(None, request.clone())["id"]
+        add_unparsed_request(span_id, request.clone(body=b'"b"}'))
+        span_ids.append(span_id)
+
+    container.finalize_spans()
+
+    http_info = container.spans[span_ids[0]]["info"]["httpInfo"]
+    assert json.loads(materialize(http_info["request"]["body"])) == {"a": "b"}
+
+
+def test_finalized_request_body_keeps_the_span_checkpoint(monkeypatch):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    container = SpansContainer.create_span()
+    request = HttpRequest(host="dummy", method="POST", uri="dummy", headers={}, body=b'{"a": ')
+    span_id = add_request_event(None, request)["id"]
+    add_unparsed_request(span_id, request.clone(body=b'"b"}'))
+    span_id = update_event_response(span_id, "dummy", 200, {}, b"")
+    container.add_span({"id": "next", "started": 1})
+    assert span_id in container.encoded_spans
+
+    container.finalize_spans()
+
+    assert span_id in container.encoded_spans
+
+
 def test_double_response_size_limit_on_error_status_code(context, monkeypatch, token):
     d = {"a": "v" * int(Configuration.get_max_entry_size() * 1.5)}
     original_begin = http.client.HTTPResponse.begin
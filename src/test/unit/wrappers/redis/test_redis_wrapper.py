@@ -34,6 +34,15 @@ def test_execute_command_wrapper_happy_flow(instance):
     assert result == FUNCTION_RESULT
 
 
+def test_execute_command_wrapper_unsampled(instance, monkeypatch):
+    monkeypatch.setattr(SpansContainer.get_span(), "is_sampled", False)
+
+    result = execute_command_wrapper(func, instance, ["SET", {"a": 1}, "b"], {})
+
+    assert result == FUNCTION_RESULT
+    assert SpansContainer.get_span().spans == {}
+
+
 def test_execute_command_wrapper_non_json(instance):
     result = execute_command_wrapper(
         lambda *args, **kwargs: datetime.now(), instance, ["SET", {"a": 1}, "b"], {}